@@ -0,0 +1,280 @@
+"""
+calendar_store.py
+
+Local SQLite mirror of Google Calendar events.
+
+The first read of a calendar performs one full sync; afterwards only the
+changes since the stored syncToken are pulled from Google. Every read takes a
+staleness bound (in seconds) so callers can choose between a fresh answer and
+an instant local one.
+"""
+import os
+import json
+import heapq
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from googleapiclient.errors import HttpError
+import google_api
+from timezones import get_zone
+
+CALENDAR_DB = os.getenv("KAALA_CALENDAR_DB", "calendar_cache.db")
+# Default number of seconds a mirrored calendar may lag behind Google.
+DEFAULT_MAX_STALENESS = int(os.getenv("KAALA_CALENDAR_MAX_STALENESS", 60))
+DEFAULT_TIMEZONE = "Asia/Kolkata"
+PAGE_SIZE = 2500
+# Calendars the read tools cover, e.g. "primary,team@group.calendar.google.com".
+CALENDAR_IDS = [c.strip() for c in os.getenv("KAALA_CALENDAR_IDS", "primary").split(",") if c.strip()]
+FANOUT_WORKERS = 8
+
+_local = threading.local()
+_sync_locks = {}
+_sync_locks_guard = threading.Lock()
+# Long-lived so each worker keeps its own SQLite connection and Calendar service.
+_fanout_pool = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix="calendar-fanout")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    calendar_id TEXT NOT NULL,
+    event_id TEXT NOT NULL,
+    start_ts REAL,
+    end_ts REAL,
+    summary TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (calendar_id, event_id)
+);
+CREATE INDEX IF NOT EXISTS idx_events_start ON events (calendar_id, start_ts);
+CREATE TABLE IF NOT EXISTS sync_state (
+    calendar_id TEXT PRIMARY KEY,
+    sync_token TEXT,
+    synced_at REAL,
+    summary TEXT,
+    time_zone TEXT
+);
+"""
+
+
+def get_connection():
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(CALENDAR_DB, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+        _local.conn = conn
+    return conn
+
+
+def _sync_lock(calendar_id):
+    with _sync_locks_guard:
+        return _sync_locks.setdefault(calendar_id, threading.Lock())
+
+
+def parse_event_time(value, tz):
+    """Parse an event start/end dict into an aware datetime."""
+    if "dateTime" in value:
+        dt = datetime.fromisoformat(value["dateTime"].replace("Z", "+00:00"))
+        if dt.tzinfo is None:
+            dt = get_zone(value.get("timeZone") or tz.zone).localize(dt)
+        return dt
+    return tz.localize(datetime.strptime(value["date"], "%Y-%m-%d"))
+
+
+def _event_row(calendar_id, event, tz):
+    try:
+        start_ts = parse_event_time(event["start"], tz).timestamp()
+        end_ts = parse_event_time(event["end"], tz).timestamp()
+    except (KeyError, ValueError):
+        start_ts = end_ts = None
+    return (calendar_id, event["id"], start_ts, end_ts, event.get("summary", ""), json.dumps(event))
+
+
+def get_sync_state(calendar_id="primary"):
+    row = get_connection().execute(
+        "SELECT sync_token, synced_at, summary, time_zone FROM sync_state WHERE calendar_id = ?",
+        (calendar_id,)
+    ).fetchone()
+    if not row:
+        return None
+    return {"sync_token": row[0], "synced_at": row[1], "summary": row[2], "time_zone": row[3]}
+
+
+def _calendar_tz(calendar_id):
+    state = get_sync_state(calendar_id)
+    return get_zone((state and state["time_zone"]) or DEFAULT_TIMEZONE)
+
+
+def _apply_page(conn, calendar_id, items, tz):
+    removed = [(calendar_id, e["id"]) for e in items if e.get("status") == "cancelled"]
+    kept = [_event_row(calendar_id, e, tz) for e in items if e.get("status") != "cancelled"]
+    if removed:
+        conn.executemany("DELETE FROM events WHERE calendar_id = ? AND event_id = ?", removed)
+    if kept:
+        conn.executemany("INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?, ?)", kept)
+    return len(removed) + len(kept)
+
+
+def sync_calendar(calendar_id="primary"):
+    """
+    Bring the local mirror of a calendar up to date.
+    Uses the stored syncToken when there is one, otherwise (or when Google
+    invalidates the token) performs a full sync. Returns the number of
+    changed events.
+    """
+    from google_calendar import get_calendar_service
+
+    with _sync_lock(calendar_id):
+        conn = get_connection()
+        state = get_sync_state(calendar_id)
+        token = state["sync_token"] if state else None
+        service = get_calendar_service()
+        params = {"calendarId": calendar_id, "singleEvents": True, "maxResults": PAGE_SIZE}
+        if token:
+            params["syncToken"] = token
+        try:
+            page = google_api.execute(service.events().list(**params))
+        except HttpError as e:
+            if token and e.resp.status == 410:
+                # Sync token expired: drop the mirror and start over.
+                params.pop("syncToken")
+                token = None
+                page = google_api.execute(service.events().list(**params))
+            else:
+                raise
+
+        tz = get_zone(page.get("timeZone") or DEFAULT_TIMEZONE)
+        changed = 0
+        with conn:
+            if not token:
+                conn.execute("DELETE FROM events WHERE calendar_id = ?", (calendar_id,))
+            while True:
+                changed += _apply_page(conn, calendar_id, page.get("items", []), tz)
+                page_token = page.get("nextPageToken")
+                if not page_token:
+                    break
+                page = google_api.execute(service.events().list(pageToken=page_token, **params))
+            conn.execute(
+                "INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?, ?, ?)",
+                (calendar_id, page.get("nextSyncToken"), time.time(), page.get("summary"), tz.zone)
+            )
+        return changed
+
+
+def ensure_fresh(calendar_id="primary", max_staleness=DEFAULT_MAX_STALENESS):
+    """
+    Sync the calendar if its mirror is older than max_staleness seconds.
+    max_staleness=None never refreshes an existing mirror. If Google cannot be
+    reached, a previously synced mirror is served as-is.
+    """
+    state = get_sync_state(calendar_id)
+    if state and state["sync_token"]:
+        if max_staleness is None or time.time() - state["synced_at"] <= max_staleness:
+            return
+    try:
+        sync_calendar(calendar_id)
+    except Exception as e:
+        if not state:
+            raise
+        print(f"[calendar_store] Sync of {calendar_id} failed, serving local copy: {e}")
+
+
+def _query(time_min, time_max, calendar_id, max_staleness, keyword, limit):
+    """Yield (start_ts, event) pairs from the mirror, ordered by start."""
+    ensure_fresh(calendar_id, max_staleness)
+    sql = "SELECT start_ts, summary, data FROM events WHERE calendar_id = ?"
+    args = [calendar_id]
+    if time_min is not None:
+        sql += " AND end_ts > ?"
+        args.append(time_min.timestamp())
+    if time_max is not None:
+        sql += " AND start_ts < ?"
+        args.append(time_max.timestamp())
+    sql += " ORDER BY start_ts"
+    if limit is not None and keyword is None:
+        sql += " LIMIT ?"
+        args.append(limit)
+
+    rows = []
+    needle = keyword.lower() if keyword else None
+    for start_ts, summary, data in get_connection().execute(sql, args):
+        if needle and needle not in (summary or "").lower():
+            continue
+        rows.append((start_ts if start_ts is not None else float("-inf"), json.loads(data)))
+        if limit is not None and len(rows) >= limit:
+            break
+    return rows
+
+
+def query_events(time_min=None, time_max=None, calendar_id="primary",
+                 max_staleness=DEFAULT_MAX_STALENESS, keyword=None, limit=None):
+    """
+    Return mirrored events overlapping [time_min, time_max), ordered by start.
+    time_min/time_max are aware datetimes; keyword filters summaries
+    case-insensitively.
+    """
+    return [event for _, event in _query(time_min, time_max, calendar_id, max_staleness, keyword, limit)]
+
+
+def query_calendars(time_min=None, time_max=None, calendar_ids=None,
+                    max_staleness=DEFAULT_MAX_STALENESS, keyword=None, limit=None):
+    """
+    Like query_events, across several calendars (default: CALENDAR_IDS).
+    Calendars are refreshed and queried concurrently, so latency is bounded
+    by the slowest one. Results are merged by start time and each event is
+    tagged with "calendarId" and "calendarName". A calendar that cannot be
+    read is skipped with a warning.
+    """
+    calendar_ids = calendar_ids or CALENDAR_IDS
+
+    def fetch(calendar_id):
+        try:
+            rows = _query(time_min, time_max, calendar_id, max_staleness, keyword, limit)
+        except Exception as e:
+            if len(calendar_ids) == 1:
+                raise
+            print(f"[calendar_store] Could not read calendar {calendar_id}: {e}")
+            return []
+        state = get_sync_state(calendar_id)
+        name = (state and state["summary"]) or calendar_id
+        for _, event in rows:
+            event["calendarId"] = calendar_id
+            event["calendarName"] = name
+        return rows
+
+    if len(calendar_ids) == 1:
+        per_calendar = [fetch(calendar_ids[0])]
+    else:
+        per_calendar = list(_fanout_pool.map(fetch, calendar_ids))
+    merged = (event for _, event in heapq.merge(*per_calendar, key=lambda row: row[0]))
+    if limit is not None:
+        return [event for _, event in zip(range(limit), merged)]
+    return list(merged)
+
+
+def get_event(event_id, calendar_id="primary"):
+    """Mirrored copy of one event, or None."""
+    row = get_connection().execute(
+        "SELECT data FROM events WHERE calendar_id = ? AND event_id = ?",
+        (calendar_id, event_id)
+    ).fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def upsert_event(event, calendar_id="primary"):
+    """Write an event returned by a Calendar mutation through to the mirror."""
+    conn = get_connection()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?, ?)",
+            _event_row(calendar_id, event, _calendar_tz(calendar_id))
+        )
+
+
+def remove_event(event_id, calendar_id="primary"):
+    conn = get_connection()
+    with conn:
+        conn.execute(
+            "DELETE FROM events WHERE calendar_id = ? AND event_id = ?",
+            (calendar_id, event_id)
+        )
@@ -3,36 +3,29 @@ contacts.py
 
 Module for managing contacts and scheduling calls.
 """
-import os
-import json
 import uuid
 from datetime import datetime, timedelta
 import pytz
-from google_calendar import get_calendar_service
+from google_calendar import get_calendar_service, batch_mutate, format_batch_failures
+import calendar_store
+import freebusy
+import google_api
+import outbox
+import datastore
 
 # File paths for storage
-CONTACTS_FILE = "contacts.json"
-CALLS_FILE = "calls.json"
+CONTACTS_FILE = datastore.CONTACTS_FILE
+CALLS_FILE = datastore.CALLS_FILE
 DEFAULT_TIMEZONE = "Asia/Kolkata"
 
 def load_contacts():
-    if not os.path.exists(CONTACTS_FILE):
-        with open(CONTACTS_FILE, "w") as f:
-            json.dump([], f)
-        return []
-    try:
-        with open(CONTACTS_FILE) as f:
-            return json.load(f)
-    except json.JSONDecodeError:
-        return []
+    return datastore.get_backend().load_records("contacts")
 
 def save_contacts(contacts):
-    with open(CONTACTS_FILE, "w") as f:
-        json.dump(contacts, f, indent=2)
+    datastore.get_backend().save_records("contacts", contacts)
 
 def add_contact(name, email=None, phone=None, notes=None, frequency_days=None):
     """Add a new contact. Optionally specify a call frequency in days."""
-    contacts = load_contacts()
     contact_id = str(uuid.uuid4())
     contact = {
         "id": contact_id,
@@ -42,8 +35,7 @@ def add_contact(name, email=None, phone=None, notes=None, frequency_days=None):
         "notes": notes,
         "frequency_days": frequency_days,
     }
-    contacts.append(contact)
-    save_contacts(contacts)
+    datastore.get_backend().insert_records("contacts", [contact])
     return f"✅ Added contact '{name}' with id {contact_id}."
 
 def list_contacts():
@@ -87,51 +79,55 @@ def find_contact(query):
 
 def update_contact(contact_id, name=None, email=None, phone=None, notes=None, frequency_days=None):
     """Update an existing contact's details, including call frequency."""
-    contacts = load_contacts()
-    for c in contacts:
-        if c.get('id') == contact_id:
-            if name:
-                c['name'] = name
-            if email is not None:
-                c['email'] = email
-            if phone is not None:
-                c['phone'] = phone
-            if notes is not None:
-                c['notes'] = notes
-            if frequency_days is not None:
-                c['frequency_days'] = frequency_days
-            save_contacts(contacts)
-            return f"✅ Updated contact '{contact_id}'."
+    changes = {}
+    if name:
+        changes['name'] = name
+    if email is not None:
+        changes['email'] = email
+    if phone is not None:
+        changes['phone'] = phone
+    if notes is not None:
+        changes['notes'] = notes
+    if frequency_days is not None:
+        changes['frequency_days'] = frequency_days
+    if datastore.get_backend().update_record("contacts", contact_id, changes):
+        return f"✅ Updated contact '{contact_id}'."
     return f"Contact with id {contact_id} not found."
 
 def delete_contact(contact_id):
     """Delete a contact."""
-    contacts = load_contacts()
-    new_contacts = [c for c in contacts if c.get('id') != contact_id]
-    if len(new_contacts) == len(contacts):
+    if not datastore.get_backend().delete_record("contacts", contact_id):
         return f"Contact with id {contact_id} not found."
-    save_contacts(new_contacts)
     return f"🗑️ Deleted contact with id {contact_id}."
 
 def load_calls():
-    if not os.path.exists(CALLS_FILE):
-        with open(CALLS_FILE, "w") as f:
-            json.dump([], f)
-        return []
-    try:
-        with open(CALLS_FILE) as f:
-            return json.load(f)
-    except json.JSONDecodeError:
-        return []
+    return datastore.get_backend().load_records("calls")
 
 def save_calls(calls):
-    with open(CALLS_FILE, "w") as f:
-        json.dump(calls, f, indent=2)
+    datastore.get_backend().save_records("calls", calls)
+
+def _call_event_body(name, start, duration, notes, timezone):
+    end = start + timedelta(minutes=duration)
+    return {
+        "summary": f"Call with {name}",
+        "description": notes or "",
+        "start": {"dateTime": start.isoformat(), "timeZone": timezone},
+        "end": {"dateTime": end.isoformat(), "timeZone": timezone},
+    }
+
+def _call_record(contact_id, start, duration, event_id, notes):
+    return {
+        "call_id": str(uuid.uuid4()),
+        "contact_id": contact_id,
+        "start": start.isoformat(),
+        "duration": duration,
+        "event_id": event_id,
+        "notes": notes,
+    }
 
 def schedule_call(contact_id, date_str, time_str, duration, notes=None, timezone=DEFAULT_TIMEZONE):
     """Schedule a call with a contact on Google Calendar."""
-    contacts = load_contacts()
-    contact = next((c for c in contacts if c.get('id') == contact_id), None)
+    contact = datastore.get_backend().get_record("contacts", contact_id)
     if not contact:
         return f"Contact with id {contact_id} not found."
     name = contact.get('name')
@@ -141,35 +137,25 @@ def schedule_call(contact_id, date_str, time_str, duration, notes=None, timezone
         return f"Invalid date or time format."
     tz = pytz.timezone(timezone)
     start = tz.localize(start_naive)
-    end = start + timedelta(minutes=duration)
-    summary = f"Call with {name}"
-    description = notes or ""
-    event_body = {
-        "summary": summary,
-        "description": description,
-        "start": {"dateTime": start.isoformat(), "timeZone": timezone},
-        "end": {"dateTime": end.isoformat(), "timeZone": timezone},
-    }
-    service = get_calendar_service()
+    event_body = google_api.with_event_id(_call_event_body(name, start, duration, notes, timezone))
+    call = _call_record(contact_id, start, duration, event_body["id"], notes)
+    call["sync_status"] = "queued"
     try:
-        created = service.events().insert(calendarId="primary", body=event_body).execute()
-        event_id = created.get("id")
-        link = created.get("htmlLink")
-        call_id = str(uuid.uuid4())
-        calls = load_calls()
-        calls.append({
-            "call_id": call_id,
-            "contact_id": contact_id,
-            "start": start.isoformat(),
-            "duration": duration,
-            "event_id": event_id,
-            "notes": notes,
-        })
-        save_calls(calls)
-        return f"✅ Scheduled call with '{name}' on {date_str} at {time_str}. Event link: {link}. Call id: {call_id}"
+        datastore.get_backend().insert_records("calls", [call])
+        outbox.enqueue("insert", "primary", event_body["id"], event_body,
+                       callback={"kind": "call", "call_id": call["call_id"]})
+        return f"✅ Scheduled call with '{name}' on {date_str} at {time_str} (syncing to Google Calendar). Call id: {call['call_id']}"
     except Exception as e:
         return f"❌ Failed to schedule call: {e}"
 
+def record_call_sync(call_id, event, error=None):
+    """Outbox callback: note whether a call's calendar event reached Google."""
+    if error:
+        changes = {"sync_status": "failed", "sync_error": error}
+    else:
+        changes = {"sync_status": "synced", "event_id": event.get("id"), "sync_error": None}
+    datastore.get_backend().update_record("calls", call_id, changes)
+
 def list_scheduled_calls():
     """List all scheduled calls."""
     calls = load_calls()
@@ -186,29 +172,77 @@ def list_scheduled_calls():
         contact = contacts.get(c.get('contact_id'), {})
         name = contact.get('name', 'Unknown')
         out += f"\n- Call id: {c.get('call_id')}, with: {name}, start: {c.get('start')}, duration: {c.get('duration')} mins"
+        if c.get('sync_status') in ("queued", "failed"):
+            out += f" [calendar: {c['sync_status']}]"
     return out
 
 def delete_scheduled_call(call_id):
     """Delete a scheduled call by its ID."""
-    calls = load_calls()
-    call = next((c for c in calls if c.get('call_id') == call_id), None)
+    call = datastore.get_backend().get_record("calls", call_id)
     if not call:
         return f"Call with id {call_id} not found."
     event_id = call.get('event_id')
-    service = get_calendar_service()
-    try:
-        if event_id:
-            service.events().delete(calendarId='primary', eventId=event_id).execute()
-    except Exception:
-        pass
-    new_calls = [c for c in calls if c.get('call_id') != call_id]
-    save_calls(new_calls)
+    if event_id and outbox.has_pending(event_id):
+        # Not sent yet (or in flight): let the outbox cancel or follow up the insert.
+        outbox.enqueue("delete", "primary", event_id)
+    elif event_id:
+        service = get_calendar_service()
+        try:
+            google_api.execute(service.events().delete(calendarId='primary', eventId=event_id))
+        except Exception as e:
+            # 404/410: the event is already gone, so the local record can go too.
+            if google_api.error_status(e) not in (404, 410):
+                return f"❌ Failed to delete calendar event for call {call_id}; the call was kept: {e}"
+        calendar_store.remove_event(event_id)
+    datastore.get_backend().delete_record("calls", call_id)
     return f"🗑️ Deleted scheduled call with id {call_id}."
 
-def auto_schedule_calls(start_date_str, end_date_str, time_str, duration, notes=None, timezone=DEFAULT_TIMEZONE):
+def find_call_slots(contact_id, duration, days=7, count=3, timezone=DEFAULT_TIMEZONE):
+    """Suggest free slots within working hours for a call with a contact."""
+    contact = datastore.get_backend().get_record("contacts", contact_id)
+    if not contact:
+        return f"Contact with id {contact_id} not found."
+    tz = pytz.timezone(timezone)
+    slots = freebusy.find_slots(duration, days=days, count=count, timezone=timezone)
+    if not slots:
+        return f"No free slots of {duration} minutes in the next {days} day(s) for a call with {contact.get('name')}."
+    out = f"Free slots for a {duration}-minute call with {contact.get('name')}:"
+    for s, e in slots:
+        s, e = s.astimezone(tz), e.astimezone(tz)
+        out += f"\n- {s.strftime('%Y-%m-%d')} {s.strftime('%H:%M')} to {e.strftime('%H:%M')}"
+    return out
+
+def _move_to_free_slots(planned, duration, tz, timezone):
+    """
+    Shift each planned call to the first free time at or after its start on
+    the same day. Returns (planned, skipped) where skipped lists calls that
+    had no free time left that day.
+    """
+    if not planned:
+        return planned, []
+    first = min(start for _, start in planned)
+    last = max(start for _, start in planned)
+    busy = freebusy.fetch_busy(first, last + timedelta(days=1), timezone=timezone)
+    moved, skipped = [], []
+    length = timedelta(minutes=duration)
+    for contact, start in planned:
+        day_end = tz.localize(datetime.fromisoformat(f"{start.astimezone(tz).strftime('%Y-%m-%d')}T{freebusy.WORKDAY_END}"))
+        if day_end <= start:
+            day_end = tz.localize(datetime.combine(start.astimezone(tz).date() + timedelta(days=1), datetime.min.time()))
+        slot = busy.first_fit(start, day_end, length)
+        if slot is None:
+            skipped.append((contact, start))
+            continue
+        busy.add(slot, slot + length)
+        moved.append((contact, slot.astimezone(tz)))
+    return moved, skipped
+
+def auto_schedule_calls(start_date_str, end_date_str, time_str, duration, notes=None, timezone=DEFAULT_TIMEZONE,
+                        avoid_conflicts=False):
     """
     Auto-schedule calls for contacts with defined frequency_days between start and end dates (inclusive).
     start_date_str, end_date_str: YYYY-MM-DD; time_str: HH:MM; duration in minutes; optional notes and timezone.
+    With avoid_conflicts, each call moves to the first free time after time_str on its day.
     """
     try:
         start_naive = datetime.fromisoformat(f"{start_date_str}T{time_str}")
@@ -220,7 +254,7 @@ def auto_schedule_calls(start_date_str, end_date_str, time_str, duration, notes=
     end_dt = tz.localize(end_naive)
     contacts_list = load_contacts()
     calls_list = load_calls()
-    results = []
+    planned = []
     for contact in contacts_list:
         freq = contact.get('frequency_days')
         if not isinstance(freq, int) or freq <= 0:
@@ -242,14 +276,38 @@ def auto_schedule_calls(start_date_str, end_date_str, time_str, duration, notes=
         # Schedule calls at intervals
         next_dt = last_dt + timedelta(days=freq)
         while next_dt <= end_dt:
-            date_str = next_dt.strftime("%Y-%m-%d")
-            time_str_fmt = next_dt.strftime("%H:%M")
-            res = schedule_call(contact_id, date_str, time_str_fmt, duration, notes, timezone)
-            results.append(res)
-            # Refresh calls list after scheduling
-            calls_list = load_calls()
-            # Next
+            planned.append((contact, next_dt))
             next_dt = next_dt + timedelta(days=freq)
-    if not results:
+    if not planned:
         return "No calls scheduled. Ensure contacts have 'frequency_days' set to a positive integer and dates are valid."
-    return "\n".join(results)
\ No newline at end of file
+    skipped = []
+    if avoid_conflicts:
+        planned, skipped = _move_to_free_slots(planned, duration, tz, timezone)
+    # Create all events in batched requests and record the calls in one write.
+    service = get_calendar_service()
+    requests = [
+        service.events().insert(
+            calendarId="primary",
+            body=google_api.with_event_id(_call_event_body(contact.get('name'), start, duration, notes, timezone))
+        )
+        for contact, start in planned
+    ]
+    batch_results = batch_mutate(requests)
+    results = []
+    new_calls = []
+    for (contact, start), result in zip(planned, batch_results):
+        if not result["ok"]:
+            continue
+        created = result["response"]
+        calendar_store.upsert_event(created)
+        call = _call_record(contact.get('id'), start, duration, created.get("id"), notes)
+        new_calls.append(call)
+        results.append(
+            f"✅ Scheduled call with '{contact.get('name')}' on {start.strftime('%Y-%m-%d')} at "
+            f"{start.strftime('%H:%M')}. Event link: {created.get('htmlLink')}. Call id: {call['call_id']}"
+        )
+    datastore.get_backend().insert_records("calls", new_calls)
+    for contact, start in skipped:
+        results.append(f"⚠️ No free slot for a call with '{contact.get('name')}' on {start.strftime('%Y-%m-%d')}.")
+    labels = [f"Call with {contact.get('name')} at {start.isoformat()}" for contact, start in planned]
+    return ("\n".join(results) + format_batch_failures(batch_results, labels)).strip()
\ No newline at end of file
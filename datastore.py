@@ -0,0 +1,644 @@
+"""
+datastore.py
+
+Pluggable storage behind the scheduler, to-do and contacts modules.
+
+KAALA_STORAGE selects the backend:
+- "file" (default): one text file per day under schedules/, todo_list.txt,
+  and JSON files for contacts, calls and recurrence rules, written through
+  storage.
+- "sqlite": a single database (KAALA_STORAGE_DB) with one row per schedule
+  line, to-do item, contact, call and recurrence rule, indexed by date,
+  status, contact_id and start time, so point updates and range queries
+  stay O(log n).
+- "journal": an append-only log of small changes with periodic snapshots
+  (see journal.py), which adds undo and point-in-time views.
+
+Run `python datastore.py import` once to copy the file data into the
+SQLite or journal backend.
+"""
+import os
+import sys
+import json
+import sqlite3
+import threading
+import storage
+
+SCHEDULE_DIR = "schedules"
+TODO_FILE = "todo_list.txt"
+CONTACTS_FILE = "contacts.json"
+CALLS_FILE = "calls.json"
+RECURRENCES_FILE = "recurrences.json"
+OCCURRENCES_FILE = "recurrence_exceptions.json"
+STORAGE_BACKEND = os.getenv("KAALA_STORAGE", "file")
+STORAGE_DB = os.getenv("KAALA_STORAGE_DB", "kaala.db")
+
+# Record kinds: primary key and indexed columns.
+RECORD_KINDS = {
+    "contacts": ("id", ("name",)),
+    "calls": ("call_id", ("contact_id", "start")),
+    "recurrences": ("id", ()),
+    "occurrences": ("key", ("rule_id", "date")),
+}
+
+
+def _task_fields(line):
+    """(start, done, task_id) of a schedule line, or None if it is not a task."""
+    from scheduler import _parse_task
+
+    task = _parse_task(line, 0)
+    return (task.start, task.done, task.id) if task else None
+
+
+def _item_id(line):
+    from scheduler import split_task_id
+
+    return split_task_id(line)[1]
+
+
+def _replace_by_id(lines, item_id, new_line, hint=None):
+    """Replace (or with new_line=None, drop) the line carrying item_id. Returns success."""
+    if hint is None or not (0 <= hint < len(lines)) or _item_id(lines[hint]) != item_id:
+        hint = next((i for i, line in enumerate(lines) if _item_id(line) == item_id), None)
+        if hint is None:
+            return False
+    if new_line is None:
+        del lines[hint]
+    else:
+        lines[hint] = new_line
+    return True
+
+
+class FileBackend:
+    """The original plain-file layout."""
+
+    def __init__(self, schedule_dir=SCHEDULE_DIR, todo_file=TODO_FILE,
+                 contacts_file=CONTACTS_FILE, calls_file=CALLS_FILE,
+                 recurrences_file=RECURRENCES_FILE, occurrences_file=OCCURRENCES_FILE):
+        self.schedule_dir = schedule_dir
+        self.todo_file = todo_file
+        self.record_files = {
+            "contacts": contacts_file,
+            "calls": calls_file,
+            "recurrences": recurrences_file,
+            "occurrences": occurrences_file,
+        }
+        os.makedirs(schedule_dir, exist_ok=True)
+
+    # Schedules
+
+    def day_path(self, date):
+        return os.path.join(self.schedule_dir, f"{date}.txt")
+
+    def day_version(self, date):
+        return storage.file_version(self.day_path(date))
+
+    def read_day(self, date):
+        """Return (text, version), or (None, None) if the day has no schedule."""
+        return storage.read_text(self.day_path(date), None)
+
+    def create_day(self, date, text):
+        """Write a day only if it does not exist yet. Returns True if created."""
+        path = self.day_path(date)
+        if os.path.exists(path):
+            return False
+        with storage.file_lock(path):
+            if os.path.exists(path):
+                return False
+            storage.atomic_write(path, text)
+        return True
+
+    def write_day(self, date, text, expected_version=None):
+        storage.atomic_write(self.day_path(date), text, expected_version)
+
+    def append_line(self, date, line):
+        with storage.edit_text(self.day_path(date)) as doc:
+            if doc.text and not doc.text.endswith("\n"):
+                doc.text += "\n"
+            doc.text += line
+
+    def assign_task_ids(self, date):
+        """Give every task of a day that lacks one a stable ID."""
+        from scheduler import with_task_ids
+
+        path = self.day_path(date)
+        if os.path.exists(path):
+            with storage.edit_text(path) as doc:
+                doc.text = with_task_ids(doc.text)
+
+    def replace_task(self, date, task_id, new_line, hint=None):
+        """
+        Replace the line of one task (new_line=None deletes it). `hint` is the
+        line index from the caller's parsed copy; the file is only scanned if
+        the task has moved. Returns False if the task does not exist.
+        """
+        path = self.day_path(date)
+        if not os.path.exists(path):
+            return False
+        with storage.edit_text(path) as doc:
+            lines = doc.text.splitlines(keepends=True)
+            found = _replace_by_id(lines, task_id, new_line, hint)
+            doc.text = "".join(lines)
+        return found
+
+    def delete_day(self, date):
+        path = self.day_path(date)
+        with storage.file_lock(path):
+            if not os.path.exists(path):
+                return False
+            os.remove(path)
+        return True
+
+    def day_versions(self, start=None, end=None):
+        """{date: version} for days with a schedule, optionally within [start, end], in date order."""
+        days = sorted(name[:-4] for name in os.listdir(self.schedule_dir) if name.endswith(".txt"))
+        versions = {}
+        for date in days:
+            if (start is None or date >= start) and (end is None or date <= end):
+                version = self.day_version(date)
+                if version is not None:
+                    versions[date] = version
+        return versions
+
+    def list_days(self, start=None, end=None):
+        return list(self.day_versions(start, end))
+
+    # To-do list
+
+    def todo_exists(self):
+        return os.path.exists(self.todo_file)
+
+    def todo_lines(self):
+        text, _ = storage.read_text(self.todo_file)
+        return text.splitlines()
+
+    def todo_append(self, line):
+        with storage.edit_text(self.todo_file) as doc:
+            if doc.text and not doc.text.endswith("\n"):
+                doc.text += "\n"
+            doc.text += f"{line}\n"
+
+    def todo_replace(self, item_id, new_line, hint=None):
+        """Replace (or with new_line=None, delete) one to-do item by ID."""
+        with storage.edit_text(self.todo_file) as doc:
+            lines = doc.text.splitlines()
+            found = _replace_by_id(lines, item_id, new_line, hint)
+            doc.text = "".join(f"{line}\n" for line in lines)
+        return found
+
+    def todo_assign_ids(self):
+        """Give every to-do item that lacks one a stable ID."""
+        from scheduler import with_item_ids
+
+        with storage.edit_text(self.todo_file) as doc:
+            doc.text = "".join(f"{line}\n" for line in with_item_ids(doc.text.splitlines()))
+
+    # Contacts, calls and recurrence rules
+
+    def records_version(self, kind):
+        """Changes whenever records of `kind` are written; None if never written."""
+        return storage.file_version(self.record_files[kind])
+
+    def load_records(self, kind):
+        return storage.load_json(self.record_files[kind], [])
+
+    def save_records(self, kind, records):
+        storage.save_json(self.record_files[kind], records)
+
+    def get_record(self, kind, key):
+        pk = RECORD_KINDS[kind][0]
+        return next((r for r in self.load_records(kind) if r.get(pk) == key), None)
+
+    def insert_records(self, kind, records):
+        path = self.record_files[kind]
+        with storage.file_lock(path):
+            self.save_records(kind, self.load_records(kind) + list(records))
+
+    def update_record(self, kind, key, changes):
+        """Merge `changes` into a record. Returns False if it does not exist."""
+        pk = RECORD_KINDS[kind][0]
+        path = self.record_files[kind]
+        with storage.file_lock(path):
+            records = self.load_records(kind)
+            for record in records:
+                if record.get(pk) == key:
+                    record.update(changes)
+                    self.save_records(kind, records)
+                    return True
+        return False
+
+    def delete_record(self, kind, key):
+        pk = RECORD_KINDS[kind][0]
+        path = self.record_files[kind]
+        with storage.file_lock(path):
+            records = self.load_records(kind)
+            kept = [r for r in records if r.get(pk) != key]
+            if len(kept) == len(records):
+                return False
+            self.save_records(kind, kept)
+        return True
+
+    def find_records(self, kind, **filters):
+        return [r for r in self.load_records(kind) if all(r.get(k) == v for k, v in filters.items())]
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS schedule_days (
+    date TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    deleted INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS schedule_lines (
+    date TEXT NOT NULL,
+    lineno INTEGER NOT NULL,
+    line TEXT NOT NULL,
+    is_task INTEGER NOT NULL,
+    done INTEGER NOT NULL,
+    start_time TEXT,
+    task_id TEXT,
+    PRIMARY KEY (date, lineno)
+);
+CREATE INDEX IF NOT EXISTS idx_schedule_status ON schedule_lines (is_task, done, date);
+CREATE TABLE IF NOT EXISTS todo_items (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    line TEXT NOT NULL,
+    done INTEGER NOT NULL,
+    item_id TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_todo_done ON todo_items (done);
+CREATE TABLE IF NOT EXISTS contacts (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    name TEXT,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS calls (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    call_id TEXT NOT NULL UNIQUE,
+    contact_id TEXT,
+    start TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_calls_contact ON calls (contact_id, start);
+CREATE INDEX IF NOT EXISTS idx_calls_start ON calls (start);
+CREATE TABLE IF NOT EXISTS recurrences (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS occurrences (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT NOT NULL UNIQUE,
+    rule_id TEXT,
+    date TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_occurrences_rule ON occurrences (rule_id, date);
+CREATE TABLE IF NOT EXISTS record_versions (
+    kind TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+"""
+# Columns added after the first release: (table, column, declaration).
+SQLITE_MIGRATIONS = [
+    ("schedule_lines", "task_id", "TEXT"),
+    ("todo_items", "item_id", "TEXT"),
+    ("schedule_days", "deleted", "INTEGER NOT NULL DEFAULT 0"),
+]
+SQLITE_INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_schedule_task ON schedule_lines (date, task_id);
+CREATE INDEX IF NOT EXISTS idx_todo_item ON todo_items (item_id);
+"""
+
+
+LINE_INSERT = (
+    "INSERT INTO schedule_lines (date, lineno, line, is_task, done, start_time, task_id) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+
+
+class SQLiteBackend:
+    """Everything in one SQLite database; one row per line, item or record."""
+
+    def __init__(self, path=STORAGE_DB):
+        self.path = path
+        self._local = threading.local()
+
+    @property
+    def conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SQLITE_SCHEMA)
+            for table, column, declaration in SQLITE_MIGRATIONS:
+                columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+            conn.executescript(SQLITE_INDEXES)
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self):
+        return _Transaction(self.conn)
+
+    # Schedules
+
+    def day_version(self, date):
+        row = self.conn.execute("SELECT version FROM schedule_days WHERE date = ? AND NOT deleted", (date,)).fetchone()
+        return str(row[0]) if row else None
+
+    def read_day(self, date):
+        # One statement, so the version always matches the lines returned.
+        rows = self.conn.execute(
+            """
+            SELECT d.version, l.line FROM schedule_days AS d
+            LEFT JOIN schedule_lines AS l ON l.date = d.date
+            WHERE d.date = ? AND NOT d.deleted ORDER BY l.lineno
+            """,
+            (date,)
+        ).fetchall()
+        if not rows:
+            return None, None
+        return "".join(line for _, line in rows if line is not None), str(rows[0][0])
+
+    def _line_rows(self, date, lines, first_lineno=0):
+        rows = []
+        for lineno, line in enumerate(lines, first_lineno):
+            start, done, task_id = _task_fields(line) or (None, False, None)
+            rows.append((date, lineno, line, _task_fields(line) is not None, done, start, task_id))
+        return rows
+
+    def _bump(self, conn, date):
+        # A deleted day keeps its row as a tombstone, so a recreated day
+        # continues from the old version and never reuses a cached one.
+        conn.execute(
+            "INSERT INTO schedule_days (date, version) VALUES (?, 1) "
+            "ON CONFLICT(date) DO UPDATE SET version = version + 1, deleted = 0",
+            (date,)
+        )
+
+    def create_day(self, date, text):
+        with self._transaction() as conn:
+            if self.day_version(date) is not None:
+                return False
+            self._write_lines(conn, date, text)
+        return True
+
+    def _write_lines(self, conn, date, text):
+        conn.execute("DELETE FROM schedule_lines WHERE date = ?", (date,))
+        conn.executemany(
+            LINE_INSERT,
+            self._line_rows(date, text.splitlines(keepends=True))
+        )
+        self._bump(conn, date)
+
+    def write_day(self, date, text, expected_version=None):
+        with self._transaction() as conn:
+            if expected_version is not None and self.day_version(date) != expected_version:
+                raise storage.VersionConflict(date)
+            self._write_lines(conn, date, text)
+
+    def append_line(self, date, line):
+        with self._transaction() as conn:
+            last = conn.execute(
+                "SELECT lineno, line FROM schedule_lines WHERE date = ? ORDER BY lineno DESC LIMIT 1", (date,)
+            ).fetchone()
+            lineno = 0
+            if last:
+                lineno = last[0] + 1
+                if not last[1].endswith("\n"):
+                    conn.execute("UPDATE schedule_lines SET line = line || ? WHERE date = ? AND lineno = ?",
+                                 ("\n", date, last[0]))
+            conn.executemany(LINE_INSERT,
+                             self._line_rows(date, [line], lineno))
+            self._bump(conn, date)
+
+    def assign_task_ids(self, date):
+        from scheduler import with_task_ids
+
+        with self._transaction() as conn:
+            text, version = self.read_day(date)
+            if version is not None:
+                tagged = with_task_ids(text)
+                if tagged != text:
+                    self._write_lines(conn, date, tagged)
+
+    def replace_task(self, date, task_id, new_line, hint=None):
+        with self._transaction() as conn:
+            if new_line is None:
+                found = conn.execute(
+                    "DELETE FROM schedule_lines WHERE date = ? AND task_id = ?", (date, task_id)
+                ).rowcount
+            else:
+                _, _, line, is_task, done, start, new_id = self._line_rows(date, [new_line])[0]
+                found = conn.execute(
+                    """
+                    UPDATE schedule_lines SET line = ?, is_task = ?, done = ?, start_time = ?, task_id = ?
+                    WHERE date = ? AND task_id = ?
+                    """,
+                    (line, is_task, done, start, new_id, date, task_id)
+                ).rowcount
+            if found:
+                self._bump(conn, date)
+        return found > 0
+
+    def delete_day(self, date):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM schedule_lines WHERE date = ?", (date,))
+            return conn.execute(
+                "UPDATE schedule_days SET deleted = 1, version = version + 1 WHERE date = ? AND NOT deleted", (date,)
+            ).rowcount > 0
+
+    def day_versions(self, start=None, end=None):
+        sql, args = "SELECT date, version FROM schedule_days WHERE NOT deleted", []
+        if start is not None:
+            sql += " AND date >= ?"
+            args.append(start)
+        if end is not None:
+            sql += " AND date <= ?"
+            args.append(end)
+        return {date: str(version) for date, version in self.conn.execute(sql + " ORDER BY date", args)}
+
+    def list_days(self, start=None, end=None):
+        return list(self.day_versions(start, end))
+
+    # To-do list
+
+    def todo_exists(self):
+        return True
+
+    def todo_lines(self):
+        return [row[0] for row in self.conn.execute("SELECT line FROM todo_items ORDER BY id")]
+
+    def todo_append(self, line):
+        with self._transaction() as conn:
+            conn.execute("INSERT INTO todo_items (line, done, item_id) VALUES (?, ?, ?)",
+                         (line, line.startswith("[x]"), _item_id(line)))
+
+    def todo_replace(self, item_id, new_line, hint=None):
+        with self._transaction() as conn:
+            if new_line is None:
+                return conn.execute("DELETE FROM todo_items WHERE item_id = ?", (item_id,)).rowcount > 0
+            return conn.execute(
+                "UPDATE todo_items SET line = ?, done = ?, item_id = ? WHERE item_id = ?",
+                (new_line, new_line.startswith("[x]"), _item_id(new_line), item_id)
+            ).rowcount > 0
+
+    def todo_assign_ids(self):
+        from scheduler import with_item_ids
+
+        with self._transaction() as conn:
+            rows = conn.execute("SELECT id, line FROM todo_items ORDER BY id").fetchall()
+            tagged = with_item_ids([line for _, line in rows])
+            conn.executemany(
+                "UPDATE todo_items SET line = ?, item_id = ? WHERE id = ?",
+                [(line, _item_id(line), row_id) for (row_id, old), line in zip(rows, tagged) if line != old]
+            )
+
+    # Contacts, calls and recurrence rules
+
+    def records_version(self, kind):
+        row = self.conn.execute("SELECT version FROM record_versions WHERE kind = ?", (kind,)).fetchone()
+        return row[0] if row else None
+
+    def _bump_records(self, conn, kind):
+        conn.execute(
+            "INSERT INTO record_versions (kind, version) VALUES (?, 1) "
+            "ON CONFLICT(kind) DO UPDATE SET version = version + 1",
+            (kind,),
+        )
+
+    def _record_row(self, kind, record):
+        pk, columns = RECORD_KINDS[kind]
+        return [record.get(pk)] + [record.get(c) for c in columns] + [json.dumps(record)]
+
+    def _upsert_sql(self, kind):
+        pk, columns = RECORD_KINDS[kind]
+        names = [pk, *columns, "data"]
+        updates = ", ".join(f"{name} = excluded.{name}" for name in names[1:])
+        return (f"INSERT INTO {kind} ({', '.join(names)}) VALUES ({', '.join('?' * len(names))}) "
+                f"ON CONFLICT({pk}) DO UPDATE SET {updates}")
+
+    def load_records(self, kind):
+        return [json.loads(row[0]) for row in self.conn.execute(f"SELECT data FROM {kind} ORDER BY seq")]
+
+    def save_records(self, kind, records):
+        with self._transaction() as conn:
+            conn.execute(f"DELETE FROM {kind}")
+            conn.executemany(self._upsert_sql(kind), [self._record_row(kind, r) for r in records])
+            self._bump_records(conn, kind)
+
+    def get_record(self, kind, key):
+        pk = RECORD_KINDS[kind][0]
+        row = self.conn.execute(f"SELECT data FROM {kind} WHERE {pk} = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def insert_records(self, kind, records):
+        with self._transaction() as conn:
+            conn.executemany(self._upsert_sql(kind), [self._record_row(kind, r) for r in records])
+            self._bump_records(conn, kind)
+
+    def update_record(self, kind, key, changes):
+        with self._transaction() as conn:
+            record = self.get_record(kind, key)
+            if record is None:
+                return False
+            record.update(changes)
+            conn.execute(self._upsert_sql(kind), self._record_row(kind, record))
+            self._bump_records(conn, kind)
+        return True
+
+    def delete_record(self, kind, key):
+        pk = RECORD_KINDS[kind][0]
+        with self._transaction() as conn:
+            if conn.execute(f"DELETE FROM {kind} WHERE {pk} = ?", (key,)).rowcount == 0:
+                return False
+            self._bump_records(conn, kind)
+        return True
+
+    def find_records(self, kind, **filters):
+        _, columns = RECORD_KINDS[kind]
+        indexed = {k: v for k, v in filters.items() if k in columns}
+        sql = f"SELECT data FROM {kind}"
+        if indexed:
+            sql += " WHERE " + " AND ".join(f"{k} = ?" for k in indexed)
+        records = [json.loads(row[0]) for row in self.conn.execute(sql + " ORDER BY seq", list(indexed.values()))]
+        return [r for r in records if all(r.get(k) == v for k, v in filters.items())]
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT that nests inside an open transaction."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.outer = False
+
+    def __enter__(self):
+        if not self.conn.in_transaction:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.outer = True
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.outer:
+            self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """The backend selected by KAALA_STORAGE, created on first use."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            if STORAGE_BACKEND == "sqlite":
+                _backend = SQLiteBackend()
+            elif STORAGE_BACKEND == "file":
+                _backend = FileBackend()
+            elif STORAGE_BACKEND == "journal":
+                from journal import JournalBackend
+
+                _backend = JournalBackend()
+            else:
+                raise ValueError(f"Unknown KAALA_STORAGE backend: {STORAGE_BACKEND}")
+        return _backend
+
+
+def import_files(source=None, target=None):
+    """
+    One-shot copy of the file layout into SQLite. Days, to-do items and
+    records already in the target are replaced. Returns a summary string.
+    """
+    source = source or FileBackend()
+    target = target or SQLiteBackend()
+    days = source.list_days()
+    with target._transaction() as conn:
+        for date in days:
+            text, _ = source.read_day(date)
+            target._write_lines(conn, date, text)
+        conn.execute("DELETE FROM todo_items")
+        for line in source.todo_lines() if source.todo_exists() else []:
+            target.todo_append(line)
+        counts = {}
+        for kind in RECORD_KINDS:
+            records = source.load_records(kind)
+            target.save_records(kind, records)
+            counts[kind] = len(records)
+    return (f"📦 Imported {len(days)} schedule day(s), {len(target.todo_lines())} to-do item(s), "
+            f"{counts['contacts']} contact(s) and {counts['calls']} call(s) into {target.path}.")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["import"]:
+        if STORAGE_BACKEND == "journal":
+            print(get_backend().import_from(FileBackend()))
+        else:
+            print(import_files())
+    elif sys.argv[1:] == ["compact"] and STORAGE_BACKEND == "journal":
+        seq = get_backend().compact()
+        print(f"🗜️ Compacted the journal at change #{seq}." if seq else "Journal is already compact.")
+    else:
+        print("Usage: python datastore.py import | compact (journal only)")
@@ -0,0 +1,371 @@
+"""
+email_index.py
+
+Local SQLite index of email headers (From, Subject, Date), keyed by folder,
+UIDVALIDITY and UID, with full-text search over sender and subject.
+
+A folder's first sync indexes its newest EMAIL_BACKFILL messages; after
+that only UIDs above the highest one seen are fetched. If the server
+reports a new UIDVALIDITY the folder's index is dropped and rebuilt.
+Deleted messages are reconciled at most every RECONCILE_EVERY seconds.
+Searches take a staleness bound like the calendar mirror, and an optional
+IDLE listener keeps a folder current in the background.
+"""
+import os
+import select
+import sqlite3
+import ssl
+import threading
+import time
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+import mail
+
+EMAIL_DB = os.getenv("KAALA_EMAIL_DB", "email_index.db")
+DEFAULT_MAX_STALENESS = int(os.getenv("KAALA_EMAIL_MAX_STALENESS", 300))
+# Newest messages indexed on a folder's first sync.
+EMAIL_BACKFILL = int(os.getenv("KAALA_EMAIL_BACKFILL", 5000))
+FETCH_CHUNK = 500
+RECONCILE_EVERY = 900
+# Servers drop IDLE after 30 minutes; re-issue it before that.
+IDLE_REFRESH = 25 * 60
+POLL_INTERVAL = 300
+
+_local = threading.local()
+_sync_locks = {}
+_sync_locks_guard = threading.Lock()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    folder TEXT NOT NULL,
+    uidvalidity INTEGER NOT NULL,
+    uid INTEGER NOT NULL,
+    sender TEXT,
+    subject TEXT,
+    date TEXT,
+    date_ts REAL,
+    PRIMARY KEY (folder, uidvalidity, uid)
+);
+CREATE INDEX IF NOT EXISTS idx_messages_date ON messages (folder, date_ts);
+CREATE TABLE IF NOT EXISTS folder_state (
+    folder TEXT PRIMARY KEY,
+    uidvalidity INTEGER,
+    last_uid INTEGER NOT NULL,
+    synced_at REAL,
+    reconciled_at REAL
+);
+"""
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    sender, subject, content='messages', content_rowid='rowid'
+);
+CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, sender, subject) VALUES (new.rowid, new.sender, new.subject);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, sender, subject)
+    VALUES ('delete', old.rowid, old.sender, old.subject);
+END;
+"""
+# False when this SQLite build lacks FTS5; searches then fall back to LIKE.
+HAS_FTS = True
+
+
+def get_connection():
+    global HAS_FTS
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(EMAIL_DB, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+        try:
+            conn.executescript(FTS_SCHEMA)
+        except sqlite3.OperationalError:
+            HAS_FTS = False
+        _local.conn = conn
+    return conn
+
+
+def _sync_lock(folder):
+    with _sync_locks_guard:
+        return _sync_locks.setdefault(folder, threading.Lock())
+
+
+def get_folder_state(folder):
+    row = get_connection().execute(
+        "SELECT uidvalidity, last_uid, synced_at, reconciled_at FROM folder_state WHERE folder = ?", (folder,)
+    ).fetchone()
+    if not row:
+        return None
+    return {"uidvalidity": row[0], "last_uid": row[1], "synced_at": row[2], "reconciled_at": row[3]}
+
+
+def _timestamp(date):
+    try:
+        return parsedate_to_datetime(date).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def _search_uids(session, criteria):
+    status, data = session.conn.uid("SEARCH", None, criteria)
+    if status != "OK":
+        raise mail.imaplib.IMAP4.error(f"SEARCH failed: {data}")
+    return sorted(int(uid) for uid in (data[0] or b"").split())
+
+
+def _fetch_headers(session, uids):
+    """Headers for `uids` (ascending), FETCH_CHUNK UIDs per command."""
+    messages = []
+    for offset in range(0, len(uids), FETCH_CHUNK):
+        chunk = uids[offset:offset + FETCH_CHUNK]
+        status, data = session.conn.uid("FETCH", f"{chunk[0]}:{chunk[-1]}", f"(UID {mail.HEADER_FIELDS})")
+        if status != "OK":
+            raise mail.imaplib.IMAP4.error(f"FETCH failed: {data}")
+        messages.extend(m for m in mail.parse_header_fetch(data) if chunk[0] <= m[0] <= chunk[-1])
+    return messages
+
+
+def _sync(session, folder):
+    conn = get_connection()
+    state = get_folder_state(folder)
+    validity = session.uidvalidity or 0
+    if state and state["uidvalidity"] != validity:
+        # UIDs from the old UIDVALIDITY no longer name the same messages.
+        with conn:
+            conn.execute("DELETE FROM messages WHERE folder = ?", (folder,))
+        state = None
+    now = time.time()
+    if state is None:
+        if session.exists == 0:
+            uids = []
+        else:
+            first = max(1, session.exists - EMAIL_BACKFILL + 1)
+            uids = _search_uids(session, f"{first}:*")
+        last_uid = 0
+        reconciled_at = now
+    else:
+        last_uid = state["last_uid"]
+        # "n:*" always matches the newest message, so filter to genuinely new UIDs.
+        uids = [uid for uid in _search_uids(session, f"UID {last_uid + 1}:*") if uid > last_uid]
+        reconciled_at = state["reconciled_at"]
+    messages = _fetch_headers(session, uids) if uids else []
+    removed = 0
+    with conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO messages VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(folder, validity, uid, h["from"], h["subject"], h["date"], _timestamp(h["date"]))
+             for uid, h in messages]
+        )
+        if state is not None and now - (reconciled_at or 0) > RECONCILE_EVERY:
+            low = conn.execute("SELECT MIN(uid) FROM messages WHERE folder = ?", (folder,)).fetchone()[0]
+            if low is not None:
+                present = set(_search_uids(session, f"UID {low}:*"))
+                stale = [(folder, uid) for (uid,) in conn.execute(
+                    "SELECT uid FROM messages WHERE folder = ?", (folder,)) if uid not in present]
+                conn.executemany("DELETE FROM messages WHERE folder = ? AND uid = ?", stale)
+                removed = len(stale)
+            reconciled_at = now
+        conn.execute(
+            "INSERT OR REPLACE INTO folder_state VALUES (?, ?, ?, ?, ?)",
+            (folder, validity, max([last_uid] + uids), now, reconciled_at)
+        )
+    return len(messages), removed
+
+
+def sync_folder(folder="INBOX"):
+    """Fetch headers of new messages into the index. Returns (added, removed)."""
+    pool = mail.imap_pool()
+    if pool is None:
+        raise RuntimeError("IMAP credentials not set.")
+    with _sync_lock(folder):
+        return pool.run(folder, lambda session: _sync(session, folder))
+
+
+def ensure_fresh(folder="INBOX", max_staleness=DEFAULT_MAX_STALENESS):
+    """
+    Sync the folder if its index is older than max_staleness seconds. If the
+    server cannot be reached, an existing index is served as-is.
+    """
+    state = get_folder_state(folder)
+    if state and (max_staleness is None or time.time() - state["synced_at"] <= max_staleness):
+        return
+    try:
+        sync_folder(folder)
+    except Exception as e:
+        if not state:
+            raise
+        print(f"[email_index] Sync of {folder} failed, serving local copy: {e}")
+
+
+def _fts_query(text):
+    """Quote each word so user text is never parsed as FTS syntax."""
+    return " ".join('"' + word.replace('"', '""') + '"' for word in text.split())
+
+
+def _day_start(date_str):
+    return datetime.strptime(date_str, "%Y-%m-%d").timestamp()
+
+
+def query_messages(folder="INBOX", query=None, sender=None, since=None, until=None, limit=10,
+                   max_staleness=DEFAULT_MAX_STALENESS):
+    """Indexed headers matching every given filter, newest first."""
+    ensure_fresh(folder, max_staleness)
+    sql = "SELECT m.uid, m.sender, m.subject, m.date FROM messages AS m"
+    where, args = ["m.folder = ?"], [folder]
+    if query and HAS_FTS:
+        sql += " JOIN messages_fts ON messages_fts.rowid = m.rowid"
+        where.append("messages_fts MATCH ?")
+        args.append("subject : (" + _fts_query(query) + ")")
+    elif query:
+        for word in query.split():
+            where.append("m.subject LIKE ?")
+            args.append(f"%{word}%")
+    if sender:
+        where.append("m.sender LIKE ?")
+        args.append(f"%{sender}%")
+    if since:
+        where.append("m.date_ts >= ?")
+        args.append(_day_start(since))
+    if until:
+        where.append("m.date_ts < ?")
+        args.append(_day_start(until) + 86400)
+    sql += " WHERE " + " AND ".join(where) + " ORDER BY m.date_ts DESC, m.uid DESC LIMIT ?"
+    args.append(limit)
+    return [
+        {"uid": uid, "from": sender, "subject": subject, "date": date}
+        for uid, sender, subject, date in get_connection().execute(sql, args)
+    ]
+
+
+def search_emails(query: str = None, sender: str = None, since: str = None, until: str = None,
+                  folder: str = "INBOX", limit: int = 10, max_staleness: int = DEFAULT_MAX_STALENESS) -> str:
+    """
+    Search email headers from the local index: words in the subject, part of
+    the sender, and a date range (YYYY-MM-DD, inclusive).
+    """
+    if mail.imap_pool() is None and get_folder_state(folder) is None:
+        return "IMAP credentials not set."
+    try:
+        if since:
+            _day_start(since)
+        if until:
+            _day_start(until)
+    except ValueError:
+        return "❌ Dates must be YYYY-MM-DD."
+    try:
+        messages = query_messages(folder, query, sender, since, until, limit, max_staleness)
+    except Exception as e:
+        return f"Failed to search emails: {e}"
+    if not messages:
+        return "No matching emails."
+    return "\n".join(f"From: {m['from']}, Subject: {m['subject']}, Date: {m['date']}" for m in messages)
+
+
+# Background listener
+
+def _is_change(line):
+    return b"EXISTS" in line or b"EXPUNGE" in line
+
+
+def _buffered(conn):
+    """
+    Whether a line is already waiting in imaplib's buffered reader (or the
+    TLS layer), which select() on the socket cannot see. The socket is made
+    non-blocking for the peek so an empty buffer returns at once.
+    """
+    sock = conn.sock
+    timeout = sock.gettimeout()
+    sock.settimeout(0)
+    try:
+        return bool(conn.file.peek(1))
+    except (BlockingIOError, ssl.SSLWantReadError):
+        return False
+    finally:
+        sock.settimeout(timeout)
+
+
+def _readable(conn, timeout):
+    """Wait up to `timeout` seconds for the server to send something."""
+    return _buffered(conn) or bool(select.select([conn.sock], [], [], timeout)[0])
+
+
+def _read_line(conn):
+    line = conn.readline()
+    if not line:
+        raise mail.imaplib.IMAP4.abort("connection closed during IDLE")
+    return line
+
+
+def _idle_once(session, timeout):
+    """
+    Wait in IDLE until the server reports a change or `timeout` passes.
+    Returns True if the folder changed.
+
+    imaplib has no IDLE command, and its command methods block until the
+    tagged reply, which IDLE only sends after DONE. So the exchange uses
+    imaplib's low-level _new_tag/send/readline, and waits with select()
+    rather than a socket timeout: a timed-out read leaves the socket's file
+    object unusable, so reads happen only once data is there.
+    """
+    conn = session.conn
+    tag = conn._new_tag()
+    conn.send(tag + b" IDLE\r\n")
+    if not _read_line(conn).startswith(b"+"):
+        raise mail.imaplib.IMAP4.error("IDLE rejected")
+    changed = False
+    deadline = time.monotonic() + timeout
+    while not changed:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not _readable(conn, remaining):
+            break
+        changed = _is_change(_read_line(conn))
+    conn.send(b"DONE\r\n")
+    while True:
+        line = _read_line(conn)
+        if line.startswith(tag):
+            return changed
+        changed = changed or _is_change(line)
+
+
+def _listen(folder):
+    while True:
+        session = None
+        try:
+            sync_folder(folder)
+            pool = mail.imap_pool()
+            session = mail.IMAPSession(*pool.args)
+            session.select(folder)
+            if "IDLE" not in session.conn.capabilities:
+                session.logout()
+                session = None
+                time.sleep(POLL_INTERVAL)
+                continue
+            while True:
+                if _idle_once(session, IDLE_REFRESH):
+                    sync_folder(folder)
+        except Exception as e:
+            print(f"[email_index] Listener for {folder} stopped ({e}); retrying in {POLL_INTERVAL}s.")
+            time.sleep(POLL_INTERVAL)
+        finally:
+            if session:
+                session.logout()
+
+
+_listeners = {}
+_listeners_lock = threading.Lock()
+
+
+def start_listener(folder="INBOX"):
+    """
+    Keep a folder's index current in the background: IDLE where the server
+    supports it, otherwise a sync every POLL_INTERVAL seconds.
+    """
+    if mail.imap_pool() is None:
+        return None
+    with _listeners_lock:
+        if folder not in _listeners:
+            thread = threading.Thread(target=_listen, args=(folder,), daemon=True, name=f"email-idle-{folder}")
+            thread.start()
+            _listeners[folder] = thread
+        return _listeners[folder]
@@ -0,0 +1,178 @@
+"""
+freebusy.py
+
+Free/busy engine shared by the scheduling tools.
+
+Busy time comes from the Calendar freebusy API, which answers for several
+calendars in one request and already accounts for all-day, multi-day and
+"free" (transparent) events. Inserts and patches still waiting in the
+outbox are added on top, so back-to-back bookings do not land in the same
+slot before Google has seen the first. It is kept in a sorted, merged
+interval index so slot queries are answered with bisect instead of
+rescanning events.
+"""
+import bisect
+from datetime import datetime, timedelta
+import pytz
+from google_calendar import get_calendar_service
+import calendar_store
+import google_api
+import outbox
+from calendar_store import CALENDAR_IDS
+
+DEFAULT_TIMEZONE = "Asia/Kolkata"
+WORKDAY_START = "09:00"
+WORKDAY_END = "18:00"
+# The freebusy endpoint accepts at most 50 calendars per query.
+MAX_CALENDARS_PER_QUERY = 50
+
+
+def _parse(ts):
+    return datetime.fromisoformat(ts.replace("Z", "+00:00"))
+
+
+class BusyIndex:
+    """Sorted, non-overlapping busy intervals."""
+
+    def __init__(self, intervals=()):
+        self.starts = []
+        self.ends = []
+        for start, end in sorted(intervals):
+            self.add(start, end)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __iter__(self):
+        return iter(zip(self.starts, self.ends))
+
+    def add(self, start, end):
+        """Mark [start, end) busy, merging it with touching intervals."""
+        i = bisect.bisect_left(self.ends, start)
+        j = bisect.bisect_right(self.starts, end)
+        if i < j:
+            start = min(start, self.starts[i])
+            end = max(end, self.ends[j - 1])
+        self.starts[i:j] = [start]
+        self.ends[i:j] = [end]
+
+    def is_free(self, start, end):
+        i = bisect.bisect_right(self.ends, start)
+        return i == len(self.starts) or self.starts[i] >= end
+
+    def free_slots(self, window_start, window_end, min_duration):
+        """Yield free (start, end) gaps of at least min_duration inside the window."""
+        cursor = window_start
+        i = bisect.bisect_right(self.ends, window_start)
+        while i < len(self.starts) and self.starts[i] < window_end:
+            if self.starts[i] - cursor >= min_duration:
+                yield cursor, self.starts[i]
+            cursor = max(cursor, self.ends[i])
+            i += 1
+        if window_end - cursor >= min_duration:
+            yield cursor, window_end
+
+    def first_fit(self, window_start, window_end, duration):
+        """Start of the first free gap of `duration` in the window, or None."""
+        for start, _ in self.free_slots(window_start, window_end, duration):
+            return start
+        return None
+
+
+def pack(busy, items):
+    """
+    Place items ({"duration", "priority", "earliest", "latest"}, with
+    datetimes and a timedelta) into free time in one pass: most important
+    first (lowest priority number), then the tightest windows and the longest
+    tasks, each in the earliest gap that fits. Placed items are added to
+    `busy`. Returns the start (or None if it did not fit) per item, in order.
+    """
+    def order(i):
+        item = items[i]
+        slack = item["latest"] - item["earliest"] - item["duration"]
+        return item["priority"], slack, -item["duration"]
+
+    starts = [None] * len(items)
+    for i in sorted(range(len(items)), key=order):
+        item = items[i]
+        start = busy.first_fit(item["earliest"], item["latest"], item["duration"])
+        if start is not None:
+            busy.add(start, start + item["duration"])
+            starts[i] = start
+    return starts
+
+
+def fetch_busy(time_min, time_max, calendar_ids=None, timezone=DEFAULT_TIMEZONE):
+    """
+    Query Google for busy time across calendars (default: CALENDAR_IDS) and
+    merge it into one index.
+    """
+    service = get_calendar_service()
+    index = BusyIndex()
+    calendar_ids = list(calendar_ids or CALENDAR_IDS)
+    for offset in range(0, len(calendar_ids), MAX_CALENDARS_PER_QUERY):
+        body = {
+            "timeMin": time_min.isoformat(),
+            "timeMax": time_max.isoformat(),
+            "timeZone": timezone,
+            "items": [{"id": cal_id} for cal_id in calendar_ids[offset:offset + MAX_CALENDARS_PER_QUERY]],
+        }
+        result = google_api.execute(service.freebusy().query(body=body))
+        for cal_id, calendar in result.get("calendars", {}).items():
+            if calendar.get("errors"):
+                print(f"[freebusy] Skipping {cal_id}: {calendar['errors']}")
+                continue
+            for busy in calendar.get("busy", []):
+                index.add(_parse(busy["start"]), _parse(busy["end"]))
+    _add_pending(index, time_min, time_max, calendar_ids, pytz.timezone(timezone))
+    return index
+
+
+def _add_pending(index, time_min, time_max, calendar_ids, tz):
+    """Mark events queued in the outbox, which Google does not know about yet, busy."""
+    for _, event in outbox.pending_events(calendar_ids):
+        if event.get("status") == "cancelled" or event.get("transparency") == "transparent":
+            continue
+        try:
+            start = calendar_store.parse_event_time(event["start"], tz)
+            end = calendar_store.parse_event_time(event["end"], tz)
+        except (KeyError, ValueError):
+            continue
+        if start < time_max and end > time_min:
+            index.add(start, end)
+
+
+def working_windows(start, days, tz, work_start=WORKDAY_START, work_end=WORKDAY_END):
+    """Yield each day's (start, end) working window, beginning no earlier than `start`."""
+    day = start.astimezone(tz).date()
+    for offset in range(days):
+        date_str = (day + timedelta(days=offset)).isoformat()
+        window_start = tz.localize(datetime.fromisoformat(f"{date_str}T{work_start}"))
+        window_end = tz.localize(datetime.fromisoformat(f"{date_str}T{work_end}"))
+        window_start = max(window_start, start)
+        if window_start < window_end:
+            yield window_start, window_end
+
+
+def find_slots(duration, days=1, count=3, start=None, work_start=WORKDAY_START,
+               work_end=WORKDAY_END, calendar_ids=None, timezone=DEFAULT_TIMEZONE,
+               busy=None):
+    """
+    First `count` free slots of at least `duration` minutes inside working
+    hours over the next `days` days, with one freebusy query for all
+    calendars. Returns a list of (start, end) gaps.
+    """
+    tz = pytz.timezone(timezone)
+    start = start or datetime.now(tz)
+    windows = list(working_windows(start, days, tz, work_start, work_end))
+    if not windows:
+        return []
+    if busy is None:
+        busy = fetch_busy(windows[0][0], windows[-1][1], calendar_ids, timezone)
+    slots = []
+    for window_start, window_end in windows:
+        for slot in busy.free_slots(window_start, window_end, timedelta(minutes=duration)):
+            slots.append(slot)
+            if len(slots) >= count:
+                return slots
+    return slots
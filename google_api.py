@@ -0,0 +1,185 @@
+"""
+google_api.py
+
+Shared executor for Google API requests.
+
+Every request goes through a token-bucket limiter sized to the project's
+quota. Rate-limit (403 rateLimitExceeded/userRateLimitExceeded, 429) and
+server (5xx) errors, plus dropped connections, are retried with exponential
+backoff and full jitter. Event inserts carry a client-generated ID so a
+retried insert can never create a duplicate. Counters for retries and
+throttle waits are kept for tuning bulk jobs.
+"""
+import os
+import json
+import random
+import threading
+import time
+import uuid
+from googleapiclient.errors import HttpError
+
+# Calendar API default quota is per-user per-minute; stay comfortably below it.
+REQUESTS_PER_SECOND = float(os.getenv("KAALA_GOOGLE_QPS", 5))
+BURST = int(os.getenv("KAALA_GOOGLE_BURST", 10))
+MAX_RETRIES = int(os.getenv("KAALA_GOOGLE_MAX_RETRIES", 5))
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 32.0
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded"}
+
+
+class TokenBucket:
+    """Thread-safe token bucket; acquire() blocks until a token is available."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Take one token, returning the number of seconds spent waiting."""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+_bucket = TokenBucket(REQUESTS_PER_SECOND, BURST)
+_stats_lock = threading.Lock()
+_stats = {
+    "requests": 0,
+    "retries": 0,
+    "rate_limited": 0,
+    "server_errors": 0,
+    "failures": 0,
+    "throttle_waits": 0,
+    "throttle_wait_seconds": 0.0,
+}
+
+
+def _count(key, amount=1):
+    with _stats_lock:
+        _stats[key] += amount
+
+
+def throttle():
+    """Wait for the rate limiter to allow one more request."""
+    waited = _bucket.acquire()
+    _count("requests")
+    if waited:
+        _count("throttle_waits")
+        _count("throttle_wait_seconds", waited)
+
+
+def error_status(error):
+    if isinstance(error, HttpError):
+        return error.resp.status
+    return None
+
+
+def _error_reason(error):
+    try:
+        details = json.loads(error.content.decode("utf-8"))["error"]["errors"]
+        return details[0].get("reason")
+    except (ValueError, KeyError, IndexError, AttributeError, TypeError):
+        return None
+
+
+def is_retryable(error):
+    """True for rate-limit, server and connection errors."""
+    if isinstance(error, HttpError):
+        status = error.resp.status
+        if status in RETRYABLE_STATUSES:
+            return True
+        return status == 403 and _error_reason(error) in RATE_LIMIT_REASONS
+    return isinstance(error, (ConnectionError, TimeoutError))
+
+
+def record_retry(error):
+    status = error_status(error)
+    _count("retries")
+    if status in (403, 429):
+        _count("rate_limited")
+    elif status is not None and status >= 500:
+        _count("server_errors")
+
+
+def backoff_delay(attempt):
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def execute(request, retries=MAX_RETRIES):
+    """Execute an HttpRequest under the rate limiter, retrying transient errors."""
+    attempt = 0
+    while True:
+        throttle()
+        try:
+            return request.execute()
+        except Exception as e:
+            if attempt >= retries or not is_retryable(e):
+                _count("failures")
+                raise
+            record_retry(e)
+            time.sleep(backoff_delay(attempt))
+            attempt += 1
+
+
+def new_event_id():
+    """A client-side event ID (Calendar accepts lowercase base32hex, 5-1024 chars)."""
+    return uuid.uuid4().hex
+
+
+def with_event_id(body):
+    """Copy of an event body with a client-generated ID, for idempotent inserts."""
+    body = dict(body)
+    body.setdefault("id", new_event_id())
+    return body
+
+
+def insert_event(service, calendar_id, body):
+    """
+    Insert an event exactly once. The body gets a client-generated ID, so if
+    a retry hits 409 the earlier attempt went through and that event is
+    returned instead of creating a duplicate.
+    """
+    body = with_event_id(body)
+    try:
+        return execute(service.events().insert(calendarId=calendar_id, body=body))
+    except HttpError as e:
+        if e.resp.status != 409:
+            raise
+        return execute(service.events().get(calendarId=calendar_id, eventId=body["id"]))
+
+
+def get_stats():
+    with _stats_lock:
+        return dict(_stats)
+
+
+def reset_stats():
+    with _stats_lock:
+        for key in _stats:
+            _stats[key] = 0
+
+
+def get_api_stats():
+    """Summarize Google API request counters since startup."""
+    stats = get_stats()
+    return (
+        f"Google API: {stats['requests']} request(s), {stats['retries']} retr(ies) "
+        f"({stats['rate_limited']} rate-limited, {stats['server_errors']} server errors), "
+        f"{stats['failures']} failure(s), {stats['throttle_waits']} throttle wait(s) "
+        f"totalling {stats['throttle_wait_seconds']:.1f}s. "
+        f"Limit: {REQUESTS_PER_SECOND:g} req/s, burst {BURST}."
+    )
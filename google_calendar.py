@@ -4,19 +4,46 @@ import os
 import datetime
 import pytz
 import pickle
+import hashlib
+import threading
+import time
 from google.auth.transport.requests import Request
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 import json
 from datetime import datetime, timedelta
+import calendar_store
+import google_api
+import outbox
+import storage
+from calendar_store import DEFAULT_MAX_STALENESS
 
 CLIENT_SECRET_FILE = os.getenv("GOOGLE_CALENDAR_SECRET_PATH")
 SCOPES = ["https://www.googleapis.com/auth/calendar"]
+TOKEN_FILE = "token.pkl"
+# Refresh the access token this long before Google says it expires.
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+# The Calendar batch endpoint accepts at most 50 calls per HTTP request.
+MAX_BATCH_SIZE = 50
+BATCH_CHUNK_SIZE = int(os.getenv("KAALA_BATCH_CHUNK_SIZE", MAX_BATCH_SIZE))
 
-def get_calendar_service():
+# Credentials are shared process-wide; service objects are not thread-safe
+# (httplib2 connections), so each worker thread keeps its own, built once.
+_creds = None
+_creds_lock = threading.RLock()
+_refresher = None
+_local = threading.local()
+
+
+def _save_credentials(creds):
+    with open(TOKEN_FILE, "wb") as token:
+        pickle.dump(creds, token)
+
+
+def _load_credentials():
     creds = None
-    if os.path.exists("token.pkl"):
-        with open("token.pkl", "rb") as token:
+    if os.path.exists(TOKEN_FILE):
+        with open(TOKEN_FILE, "rb") as token:
             creds = pickle.load(token)
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
@@ -24,14 +51,153 @@ def get_calendar_service():
         else:
             flow = InstalledAppFlow.from_client_secrets_file(CLIENT_SECRET_FILE, SCOPES)
             creds = flow.run_local_server(port=0)
-        with open("token.pkl", "wb") as token:
-            pickle.dump(creds, token)
-    return build("calendar", "v3", credentials=creds)
+        _save_credentials(creds)
+    return creds
+
+
+def _refresh_loop():
+    """Keep the shared credentials fresh so no tool call pays for a refresh."""
+    while True:
+        with _creds_lock:
+            expiry = _creds.expiry if _creds else None
+        if expiry is None:
+            return
+        # google-auth stores expiry as a naive UTC datetime.
+        wait = (expiry - TOKEN_REFRESH_MARGIN - datetime.utcnow()).total_seconds()
+        if wait > 0:
+            time.sleep(min(wait, 600))
+            continue
+        try:
+            with _creds_lock:
+                _creds.refresh(Request())
+                _save_credentials(_creds)
+        except Exception as e:
+            print(f"[google_calendar] Background token refresh failed: {e}")
+            time.sleep(60)
+
+
+def _start_refresher():
+    global _refresher
+    if _refresher is None or not _refresher.is_alive():
+        _refresher = threading.Thread(target=_refresh_loop, name="calendar-token-refresh", daemon=True)
+        _refresher.start()
+
+
+def get_credentials():
+    global _creds
+    with _creds_lock:
+        if _creds is None or not _creds.valid:
+            if _creds is not None and _creds.refresh_token:
+                _creds.refresh(Request())
+                _save_credentials(_creds)
+            else:
+                _creds = _load_credentials()
+            _start_refresher()
+        return _creds
 
-def create_calendar_event(summary, start_time_str, end_time_str, timezone="Asia/Kolkata", description=None):
+
+def get_calendar_service():
+    """
+    Return this thread's Calendar service, building it on first use.
+    The service keeps its HTTP connection alive between calls and shares the
+    process-wide credentials, which are refreshed in the background.
+    """
+    creds = get_credentials()
+    service = getattr(_local, "service", None)
+    if service is None or getattr(_local, "creds", None) is not creds:
+        service = build("calendar", "v3", credentials=creds, cache_discovery=False)
+        _local.service = service
+        _local.creds = creds
+    return service
+
+
+def reset_calendar_service():
+    """Drop cached credentials and services, e.g. after re-authenticating."""
+    global _creds
+    with _creds_lock:
+        _creds = None
+    _local.__dict__.clear()
+
+def batch_mutate(requests, chunk_size=BATCH_CHUNK_SIZE, retries=google_api.MAX_RETRIES):
+    """
+    Execute unexecuted Calendar requests (e.g. service.events().insert(...))
+    through the batch endpoint, chunk_size calls per HTTP request.
+    Returns one dict per request, in order, with "ok", "response" and "error".
+    A failed item never aborts the rest of the batch; items that failed with
+    a rate-limit or server error are retried with backoff. Inserts should
+    carry a client-side ID (google_api.with_event_id) so retries are safe.
+    """
     service = get_calendar_service()
+    chunk_size = max(1, min(chunk_size, MAX_BATCH_SIZE))
+    results = [None] * len(requests)
+    errors = {}
+
+    def callback(request_id, response, exception):
+        i = int(request_id)
+        errors[i] = exception
+        results[i] = {
+            "ok": exception is None,
+            "response": response,
+            "error": str(exception) if exception else None,
+        }
+
+    pending = list(range(len(requests)))
+    attempt = 0
+    while pending:
+        for offset in range(0, len(pending), chunk_size):
+            chunk = pending[offset:offset + chunk_size]
+            batch = service.new_batch_http_request(callback=callback)
+            for i in chunk:
+                google_api.throttle()
+                results[i] = None
+                batch.add(requests[i], request_id=str(i))
+            try:
+                batch.execute()
+            except Exception as e:
+                for i in chunk:
+                    if results[i] is None:
+                        errors[i] = e
+                        results[i] = {"ok": False, "response": None, "error": str(e)}
+
+        retry = []
+        for i in pending:
+            if results[i]["ok"]:
+                continue
+            error = errors[i]
+            if attempt and google_api.error_status(error) == 409 and getattr(requests[i], "method", None) == "POST":
+                # An earlier attempt of this insert went through.
+                results[i] = {"ok": True, "response": json.loads(requests[i].body), "error": None}
+            elif attempt < retries and google_api.is_retryable(error):
+                google_api.record_retry(error)
+                retry.append(i)
+        if retry:
+            time.sleep(google_api.backoff_delay(attempt))
+        attempt += 1
+        pending = retry
+    return results
+
+
+def format_batch_failures(results, labels):
+    """Describe the failed items of a batch_mutate() run, or return ''."""
+    failed = [(label, r["error"]) for label, r in zip(labels, results) if not r["ok"]]
+    if not failed:
+        return ""
+    out = f"\n⚠️ {len(failed)} operation(s) failed:"
+    for label, error in failed:
+        out += f"\n- {label}: {error}"
+    return out
+
+
+def event_source_label(event):
+    """' [Calendar name (calendar: id)]' for events outside the primary calendar."""
+    calendar_id = event.get("calendarId", "primary")
+    if calendar_id == "primary":
+        return ""
+    return f" [{event.get('calendarName') or calendar_id} (calendar: {calendar_id})]"
+
 
-    event = {
+def create_calendar_event(summary, start_time_str, end_time_str, timezone="Asia/Kolkata", description=None):
+    event = google_api.with_event_id({
         "summary": summary,
         "description": description,
         "start": {
@@ -42,25 +208,19 @@ def create_calendar_event(summary, start_time_str, end_time_str, timezone="Asia/
             "dateTime": end_time_str,
             "timeZone": timezone,
         },
-    }
+    })
 
-    event = service.events().insert(calendarId="primary", body=event).execute()
-    return f"✅ Event created: {event.get('htmlLink')}"
+    outbox.enqueue("insert", "primary", event["id"], event)
+    return f"🕒 Event '{summary}' queued (ID: {event['id']}); it will appear on Google Calendar shortly."
 
-def list_today_events(timezone="Asia/Kolkata"):
-    service = get_calendar_service()
+
+
+def list_today_events(timezone="Asia/Kolkata", max_staleness=DEFAULT_MAX_STALENESS):
     now = datetime.now(pytz.timezone(timezone))
-    start_of_day = now.replace(hour=0, minute=0, second=0, microsecond=0).isoformat()
-    end_of_day = now.replace(hour=23, minute=59, second=59, microsecond=0).isoformat()
-
-    events_result = service.events().list(
-        calendarId="primary",
-        timeMin=start_of_day,
-        timeMax=end_of_day,
-        singleEvents=True,
-        orderBy="startTime"
-    ).execute()
-    events = events_result.get("items", [])
+    start_of_day = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    end_of_day = now.replace(hour=23, minute=59, second=59, microsecond=0)
+
+    events = calendar_store.query_calendars(start_of_day, end_of_day, max_staleness=max_staleness)
 
     if not events:
         return "📭 No events found for today."
@@ -68,129 +228,233 @@ def list_today_events(timezone="Asia/Kolkata"):
     out = "📅 Today's Google Calendar events:\n"
     for event in events:
         start = event["start"].get("dateTime", event["start"].get("date"))
-        out += f"- {event['summary']} at {start}\n"
+        out += f"- {event['summary']} at {start}{event_source_label(event)}\n"
     return out
 
 
-def sync_schedule_folder_to_calendar(folder_path="schedules"):
-    service = get_calendar_service()
-    timezone = "Asia/Kolkata"
-    created_events = []
+SYNC_MANIFEST = ".calendar_sync.json"
+# Private extended property tying an event to the schedule line it came from.
+LINE_ID_PROPERTY = "kaala_line_id"
 
-    for filename in os.listdir(folder_path):
-        if not filename.endswith(".txt"):
-            continue
 
-        date_str = filename.replace(".txt", "")
-        file_path = os.path.join(folder_path, filename)
+def _load_sync_manifest(folder_path):
+    path = os.path.join(folder_path, SYNC_MANIFEST)
+    if not os.path.exists(path):
+        return {"files": {}}
+    with open(path) as f:
+        return json.load(f)
 
-        with open(file_path, "r") as f:
-            lines = f.readlines()
 
-        for line in lines:
-            if not line.strip():
-                continue
-            try:
-                time_part, task = line.strip().split(" - ", 1)
-                start_dt = datetime.strptime(f"{date_str} {time_part}", "%Y-%m-%d %H:%M")
-                end_dt = start_dt + timedelta(minutes=60)
-
-                event = {
-                    "summary": task.strip(),
-                    "start": {"dateTime": start_dt.isoformat(), "timeZone": timezone},
-                    "end": {"dateTime": end_dt.isoformat(), "timeZone": timezone},
-                }
-                service.events().insert(calendarId="primary", body=event).execute()
-                created_events.append(task.strip())
-            except ValueError:
-                continue
+def _save_sync_manifest(folder_path, manifest):
+    storage.atomic_write(os.path.join(folder_path, SYNC_MANIFEST), json.dumps(manifest))
+
 
-    return f"📤 Synced {len(created_events)} events from {folder_path} to Google Calendar."
+def _schedule_file_events(date_str, text, timezone):
+    """
+    Parse a schedule file into {line_id: event body}.
+    A line ID is the date, the start time and the line's position among lines
+    sharing that start time, so editing a task's text updates its event.
+    """
+    events = {}
+    per_time = {}
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        try:
+            time_part, task = line.strip().split(" - ", 1)
+            start_dt = datetime.strptime(f"{date_str} {time_part}", "%Y-%m-%d %H:%M")
+        except ValueError:
+            continue
+        end_dt = start_dt + timedelta(minutes=60)
+        n = per_time.get(time_part, 0)
+        per_time[time_part] = n + 1
+        line_id = f"{date_str}T{time_part.replace(':', '')}-{n}"
+        events[line_id] = {
+            "summary": task.strip(),
+            "start": {"dateTime": start_dt.isoformat(), "timeZone": timezone},
+            "end": {"dateTime": end_dt.isoformat(), "timeZone": timezone},
+            "extendedProperties": {"private": {LINE_ID_PROPERTY: line_id}},
+        }
+    return events
+
+
+def _event_body_hash(body):
+    return hashlib.sha1(json.dumps(body, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def sync_schedule_folder_to_calendar(folder_path="schedules", chunk_size=BATCH_CHUNK_SIZE):
+    """
+    Push schedule files to Google Calendar, sending only what changed.
+    A manifest in the folder records each file's mtime, size and content hash
+    plus the event created for every line. Unchanged files are not even read,
+    and re-running on an unchanged folder makes no API calls.
+    """
+    timezone = "Asia/Kolkata"
+    manifest = _load_sync_manifest(folder_path)
+    files = manifest.setdefault("files", {})
+    # (kind, filename, line_id, body, event_id) for every change to send
+    ops = []
+    present = set()
+    touched = False
+
+    for filename in sorted(os.listdir(folder_path)):
+        if not filename.endswith(".txt"):
+            continue
+        present.add(filename)
+        file_path = os.path.join(folder_path, filename)
+        st = os.stat(file_path)
+        entry = files.get(filename)
+        if entry and entry["mtime_ns"] == st.st_mtime_ns and entry["size"] == st.st_size:
+            continue
 
+        with open(file_path, "rb") as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()
+        if entry is None:
+            entry = files[filename] = {"events": {}}
+        entry.update({"mtime_ns": st.st_mtime_ns, "size": st.st_size})
+        touched = True
+        if entry.get("sha256") == digest:
+            continue
+        entry["sha256"] = digest
+
+        date_str = filename[:-len(".txt")]
+        desired = _schedule_file_events(date_str, data.decode("utf-8"), timezone)
+        known = entry["events"]
+        for line_id, body in desired.items():
+            if line_id not in known:
+                ops.append(("insert", filename, line_id, body, None))
+            elif known[line_id]["hash"] != _event_body_hash(body):
+                ops.append(("update", filename, line_id, body, known[line_id]["event_id"]))
+        for line_id, synced in known.items():
+            if line_id not in desired:
+                ops.append(("delete", filename, line_id, None, synced["event_id"]))
+
+    for filename in list(files):
+        if filename not in present:
+            touched = True
+            for line_id, synced in files[filename]["events"].items():
+                ops.append(("delete", filename, line_id, None, synced["event_id"]))
+
+    if not ops:
+        if touched:
+            _save_sync_manifest(folder_path, manifest)
+        return f"📤 {folder_path} is already in sync with Google Calendar."
 
-def sync_calendar_to_schedule(folder_path="schedules"):
     service = get_calendar_service()
+    requests = []
+    for kind, _, _, body, event_id in ops:
+        if kind == "insert":
+            requests.append(service.events().insert(calendarId="primary", body=google_api.with_event_id(body)))
+        elif kind == "update":
+            requests.append(service.events().patch(calendarId="primary", eventId=event_id, body=body))
+        else:
+            requests.append(service.events().delete(calendarId="primary", eventId=event_id))
+    results = batch_mutate(requests, chunk_size)
+
+    counts = {"insert": 0, "update": 0, "delete": 0}
+    for (kind, filename, line_id, body, event_id), result in zip(ops, results):
+        entry = files.get(filename)
+        if not result["ok"]:
+            if entry is not None:
+                # Force the file to be read and diffed again on the next run.
+                entry["mtime_ns"] = entry["sha256"] = None
+            continue
+        counts[kind] += 1
+        if kind == "delete":
+            calendar_store.remove_event(event_id)
+            if entry is not None:
+                entry["events"].pop(line_id, None)
+        else:
+            calendar_store.upsert_event(result["response"])
+            entry["events"][line_id] = {"event_id": result["response"]["id"], "hash": _event_body_hash(body)}
+    for filename in list(files):
+        if filename not in present and not files[filename]["events"]:
+            del files[filename]
+    _save_sync_manifest(folder_path, manifest)
+
+    labels = [f"{kind} {line_id}" for kind, _, line_id, _, _ in ops]
+    return (f"📤 Synced {folder_path} to Google Calendar: {counts['insert']} created, "
+            f"{counts['update']} updated, {counts['delete']} deleted."
+            + format_batch_failures(results, labels))
+
+
+def sync_calendar_to_schedule(folder_path="schedules", days=7, max_staleness=DEFAULT_MAX_STALENESS):
+    """
+    Append upcoming calendar events to the day's schedule file.
+    Events are grouped by date; each day file is read once into a set of
+    existing entries and rewritten once, atomically.
+    - days: how far ahead to look (default 7)
+    """
     timezone = "Asia/Kolkata"
     now = datetime.now(pytz.timezone(timezone))
-    future = now + timedelta(days=7)
-
-    events_result = service.events().list(
-        calendarId="primary",
-        timeMin=now.isoformat(),
-        timeMax=future.isoformat(),
-        singleEvents=True,
-        orderBy="startTime"
-    ).execute()
+    future = now + timedelta(days=days)
 
-    events = events_result.get("items", [])
-    written = 0
+    events = calendar_store.query_events(now, future, max_staleness=max_staleness)
 
+    by_date = {}
     for event in events:
         start = event["start"].get("dateTime")
         if not start:
             continue
 
-        start_dt = datetime.fromisoformat(start)
+        start_dt = datetime.fromisoformat(start.replace("Z", "+00:00"))
         date_str = start_dt.strftime("%Y-%m-%d")
         time_str = start_dt.strftime("%H:%M")
         summary = event.get("summary", "Untitled")
+        by_date.setdefault(date_str, []).append(f"{time_str} - {summary}\n")
 
+    written = 0
+    for date_str, entries in by_date.items():
         filepath = os.path.join(folder_path, f"{date_str}.txt")
-
-        entry = f"{time_str} - {summary}\n"
-
-        if os.path.exists(filepath):
-            with open(filepath, "r") as f:
-                if entry in f.read():
-                    continue
-
-        with open(filepath, "a") as f:
-            f.write(entry)
-            written += 1
+        with storage.edit_text(filepath) as doc:
+            existing = set(doc.text.splitlines(keepends=True))
+            new_entries = []
+            for entry in entries:
+                if entry not in existing:
+                    existing.add(entry)
+                    new_entries.append(entry)
+            if not new_entries:
+                continue
+            if doc.text and not doc.text.endswith("\n"):
+                doc.text += "\n"
+            doc.text += "".join(new_entries)
+        written += len(new_entries)
 
     return f"📥 Synced {written} events from Google Calendar into {folder_path} folder."
 
 
-def delete_calendar_event(event_id):
-    service = get_calendar_service()
+def delete_calendar_event(event_id, calendar_id="primary"):
     try:
-        service.events().delete(calendarId='primary', eventId=event_id).execute()
-        return f"🗑️ Deleted event with ID: {event_id}"
+        if outbox.enqueue("delete", calendar_id, event_id) == "cancelled":
+            return f"🗑️ Cancelled event {event_id} before it reached Google Calendar."
+        return f"🗑️ Deletion of event {event_id} queued."
     except Exception as e:
         return f"❌ Failed to delete event: {str(e)}"
 
-def update_calendar_event(event_id, summary=None, start_time_str=None, end_time_str=None, description=None, timezone="Asia/Kolkata"):
-    service = get_calendar_service()
+def update_calendar_event(event_id, summary=None, start_time_str=None, end_time_str=None, description=None, timezone="Asia/Kolkata", calendar_id="primary"):
+    patch = {}
+    if summary:
+        patch["summary"] = summary
+    if description:
+        patch["description"] = description
+    if start_time_str:
+        patch["start"] = {"dateTime": start_time_str, "timeZone": timezone}
+    if end_time_str:
+        patch["end"] = {"dateTime": end_time_str, "timeZone": timezone}
+    if not patch:
+        return "⚠️ Nothing to update."
     try:
-        event = service.events().get(calendarId="primary", eventId=event_id).execute()
-
-        if summary:
-            event["summary"] = summary
-        if description:
-            event["description"] = description
-        if start_time_str:
-            event["start"]["dateTime"] = start_time_str
-            event["start"]["timeZone"] = timezone
-        if end_time_str:
-            event["end"]["dateTime"] = end_time_str
-            event["end"]["timeZone"] = timezone
-
-        updated_event = service.events().update(calendarId="primary", eventId=event_id, body=event).execute()
-        return f"✏️ Event updated: {updated_event.get('htmlLink')}"
+        outbox.enqueue("patch", calendar_id, event_id, patch)
+        return f"✏️ Update of event {event_id} queued."
     except Exception as e:
         return f"❌ Failed to update event: {str(e)}"
 
-def list_upcoming_events(n=5, timezone="Asia/Kolkata"):
-    service = get_calendar_service()
-    now = datetime.now(pytz.timezone(timezone)).isoformat()
-    events_result = service.events().list(
-        calendarId="primary",
-        timeMin=now,
-        maxResults=n,
-        singleEvents=True,
-        orderBy="startTime"
-    ).execute()
-    events = events_result.get("items", [])
+
+
+def list_upcoming_events(n=5, timezone="Asia/Kolkata", max_staleness=DEFAULT_MAX_STALENESS):
+    now = datetime.now(pytz.timezone(timezone))
+    events = calendar_store.query_calendars(now, limit=n, max_staleness=max_staleness)
 
     if not events:
         return "📭 No upcoming events found."
@@ -198,80 +462,59 @@ def list_upcoming_events(n=5, timezone="Asia/Kolkata"):
     out = f"📆 Your next {n} event(s):\n"
     for event in events:
         start = event["start"].get("dateTime", event["start"].get("date"))
-        out += f"- {event['summary']} at {start} (ID: {event['id']})\n"
+        out += f"- {event['summary']} at {start} (ID: {event['id']}){event_source_label(event)}\n"
     return out
 
-def delete_all_events_on_date(date_str, timezone="Asia/Kolkata"):
+def _delete_events(events, chunk_size=BATCH_CHUNK_SIZE):
+    """Batch-delete events; returns (deleted count, failure report)."""
     service = get_calendar_service()
+    requests = [service.events().delete(calendarId="primary", eventId=event["id"]) for event in events]
+    results = batch_mutate(requests, chunk_size)
+    deleted = 0
+    for event, result in zip(events, results):
+        if result["ok"]:
+            calendar_store.remove_event(event["id"])
+            deleted += 1
+    labels = [f"{event.get('summary', 'Untitled')} (ID: {event['id']})" for event in events]
+    return deleted, format_batch_failures(results, labels)
+
+
+def delete_all_events_on_date(date_str, timezone="Asia/Kolkata", chunk_size=BATCH_CHUNK_SIZE):
     start = datetime.strptime(date_str, "%Y-%m-%d").replace(tzinfo=pytz.timezone(timezone))
     end = start + timedelta(days=1)
 
-    events_result = service.events().list(
-        calendarId="primary",
-        timeMin=start.isoformat(),
-        timeMax=end.isoformat(),
-        singleEvents=True,
-        orderBy="startTime"
-    ).execute()
+    # Deleting needs an exact picture of the day, so always refresh first.
+    events = calendar_store.query_events(start, end, max_staleness=0)
+    deleted, failures = _delete_events(events, chunk_size)
 
-    deleted = 0
-    for event in events_result.get("items", []):
-        service.events().delete(calendarId='primary', eventId=event['id']).execute()
-        deleted += 1
-
-    return f"🗑️ Deleted {deleted} event(s) on {date_str}"
+    return f"🗑️ Deleted {deleted} event(s) on {date_str}" + failures
 
 
 def create_all_day_event(summary, date_str, timezone="Asia/Kolkata", description=None):
-    service = get_calendar_service()
-    event = {
+    event = google_api.with_event_id({
         "summary": summary,
         "description": description,
         "start": {"date": date_str, "timeZone": timezone},
         "end": {"date": (datetime.strptime(date_str, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d"), "timeZone": timezone},
-    }
-    event = service.events().insert(calendarId="primary", body=event).execute()
-    return f"🗓️ All-day event created: {event.get('htmlLink')}"
-
+    })
+    outbox.enqueue("insert", "primary", event["id"], event)
+    return f"🗓️ All-day event '{summary}' queued (ID: {event['id']})."
 
-def delete_all_upcoming_events(days=30, timezone="Asia/Kolkata"):
-    service = get_calendar_service()
+def delete_all_upcoming_events(days=30, timezone="Asia/Kolkata", chunk_size=BATCH_CHUNK_SIZE):
     now = datetime.now(pytz.timezone(timezone))
     future = now + timedelta(days=days)
 
-    events_result = service.events().list(
-        calendarId="primary",
-        timeMin=now.isoformat(),
-        timeMax=future.isoformat(),
-        singleEvents=True,
-        orderBy="startTime"
-    ).execute()
-
-    deleted = 0
-    for event in events_result.get("items", []):
-        service.events().delete(calendarId="primary", eventId=event["id"]).execute()
-        deleted += 1
+    events = calendar_store.query_events(now, future, max_staleness=0)
+    deleted, failures = _delete_events(events, chunk_size)
 
-    return f"🚫 Cleared {deleted} upcoming event(s) from your calendar."
+    return f"🚫 Cleared {deleted} upcoming event(s) from your calendar." + failures
 
 
-def find_events_by_keyword(keyword, timezone="Asia/Kolkata"):
-    service = get_calendar_service()
+def find_events_by_keyword(keyword, timezone="Asia/Kolkata", max_staleness=DEFAULT_MAX_STALENESS):
     now = datetime.now(pytz.timezone(timezone))
     future = now + timedelta(days=30)
 
-    events_result = service.events().list(
-        calendarId="primary",
-        timeMin=now.isoformat(),
-        timeMax=future.isoformat(),
-        singleEvents=True,
-        orderBy="startTime"
-    ).execute()
-
-    matches = []
-    for event in events_result.get("items", []):
-        if keyword.lower() in event.get("summary", "").lower():
-            matches.append(event)
+    matches = calendar_store.query_calendars(now, future, keyword=keyword, max_staleness=max_staleness)
 
     if not matches:
         return f"🔍 No events found with keyword '{keyword}'"
@@ -279,25 +522,164 @@ def find_events_by_keyword(keyword, timezone="Asia/Kolkata"):
     out = f"🔍 Events containing '{keyword}':\n"
     for event in matches:
         start = event["start"].get("dateTime", event["start"].get("date"))
-        out += f"- {event['summary']} at {start} (ID: {event['id']})\n"
+        out += f"- {event['summary']} at {start} (ID: {event['id']}){event_source_label(event)}\n"
     return out
 
 
-def export_calendar_to_json(filepath="calendar_dump.json", timezone="Asia/Kolkata"):
-    service = get_calendar_service()
-    now = datetime.now(pytz.timezone(timezone))
-    future = now + timedelta(days=90)
+EXPORT_FORMATS = ("jsonl", "ics", "json")
+EXPORT_PAGE_SIZE = 2500
+
+
+def _ics_escape(text):
+    return (text or "").replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+
+def _ics_fold(line):
+    """Fold a content line at 75 octets as RFC 5545 requires."""
+    data = line.encode("utf-8")
+    if len(data) <= 75:
+        return line + "\r\n"
+    parts = []
+    while data:
+        limit = 75 if not parts else 74
+        cut = min(limit, len(data))
+        # Never split a multi-byte UTF-8 sequence.
+        while cut < len(data) and (data[cut] & 0xC0) == 0x80:
+            cut -= 1
+        parts.append(data[:cut].decode("utf-8"))
+        data = data[cut:]
+    return "\r\n ".join(parts) + "\r\n"
+
+
+def _ics_time(prop, value, tz):
+    if "dateTime" in value:
+        dt = calendar_store.parse_event_time(value, tz).astimezone(pytz.utc)
+        return f"{prop}:{dt.strftime('%Y%m%dT%H%M%SZ')}"
+    return f"{prop};VALUE=DATE:{value['date'].replace('-', '')}"
+
+
+def _event_to_ics(event, tz):
+    lines = ["BEGIN:VEVENT", f"UID:{event.get('iCalUID') or event['id']}"]
+    if event.get("updated"):
+        stamp = datetime.fromisoformat(event["updated"].replace("Z", "+00:00")).astimezone(pytz.utc)
+        lines.append(f"DTSTAMP:{stamp.strftime('%Y%m%dT%H%M%SZ')}")
+    lines.append(_ics_time("DTSTART", event["start"], tz))
+    lines.append(_ics_time("DTEND", event["end"], tz))
+    lines.append(f"SUMMARY:{_ics_escape(event.get('summary'))}")
+    if event.get("description"):
+        lines.append(f"DESCRIPTION:{_ics_escape(event['description'])}")
+    if event.get("location"):
+        lines.append(f"LOCATION:{_ics_escape(event['location'])}")
+    lines.append("END:VEVENT")
+    return "".join(_ics_fold(line) for line in lines)
+
+
+def _export_header(fmt):
+    if fmt == "ics":
+        return "BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//Kaala//Calendar Export//EN\r\n"
+    return "[\n" if fmt == "json" else ""
+
+
+def _export_footer(fmt):
+    if fmt == "ics":
+        return "END:VCALENDAR\r\n"
+    return "\n]\n" if fmt == "json" else ""
+
+
+def _export_item(fmt, event, index, tz):
+    if fmt == "ics":
+        return _event_to_ics(event, tz)
+    if fmt == "json":
+        return ("" if index == 0 else ",\n") + json.dumps(event)
+    return json.dumps(event) + "\n"
+
+
+def export_calendar(filepath="calendar_dump.jsonl", fmt="jsonl", start_date=None, end_date=None,
+                    resume=False, timezone="Asia/Kolkata", calendar_id="primary"):
+    """
+    Stream events to disk page by page, following nextPageToken.
+    - fmt: "jsonl", "ics" or "json"
+    - start_date / end_date: YYYY-MM-DD, inclusive (default: now to 90 days ahead)
+    - resume: continue an interrupted export from its checkpoint file
+    Only one page of events is held in memory at a time. After every page the
+    next page token and the file offset are written to `<filepath>.checkpoint`.
+    """
+    if fmt not in EXPORT_FORMATS:
+        return f"❌ Unsupported export format '{fmt}'. Use one of: {', '.join(EXPORT_FORMATS)}."
+    tz = pytz.timezone(timezone)
+    if start_date:
+        time_min = tz.localize(datetime.strptime(start_date, "%Y-%m-%d"))
+    else:
+        time_min = datetime.now(tz)
+    if end_date:
+        time_max = tz.localize(datetime.strptime(end_date, "%Y-%m-%d")) + timedelta(days=1)
+    else:
+        time_max = time_min + timedelta(days=90)
+
+    checkpoint_path = f"{filepath}.checkpoint"
+    checkpoint = None
+    if resume and os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as f:
+            checkpoint = json.load(f)
+        if checkpoint.get("fmt") != fmt or checkpoint.get("calendar_id") != calendar_id:
+            return f"❌ Checkpoint {checkpoint_path} belongs to a different export."
+        # The original range wins so resumed pages line up with the token.
+        time_min = datetime.fromisoformat(checkpoint["time_min"])
+        time_max = datetime.fromisoformat(checkpoint["time_max"])
 
-    events_result = service.events().list(
-        calendarId="primary",
-        timeMin=now.isoformat(),
-        timeMax=future.isoformat(),
-        singleEvents=True,
-        orderBy="startTime"
-    ).execute()
+    service = get_calendar_service()
+    params = {
+        "calendarId": calendar_id,
+        "timeMin": time_min.isoformat(),
+        "timeMax": time_max.isoformat(),
+        "singleEvents": True,
+        "orderBy": "startTime",
+        "maxResults": EXPORT_PAGE_SIZE,
+    }
 
-    with open(filepath, "w") as f:
-        json.dump(events_result.get("items", []), f, indent=2)
+    if checkpoint:
+        f = open(filepath, "r+b")
+        # Drop anything written after the last completed page.
+        f.seek(checkpoint["offset"])
+        f.truncate()
+        count = checkpoint["count"]
+        page_token = checkpoint["page_token"]
+    else:
+        f = open(filepath, "wb")
+        f.write(_export_header(fmt).encode("utf-8"))
+        count = 0
+        page_token = None
+
+    with f:
+        while True:
+            if page_token:
+                page = google_api.execute(service.events().list(pageToken=page_token, **params))
+            else:
+                page = google_api.execute(service.events().list(**params))
+            for event in page.get("items", []):
+                f.write(_export_item(fmt, event, count, tz).encode("utf-8"))
+                count += 1
+            page_token = page.get("nextPageToken")
+            if not page_token:
+                break
+            f.flush()
+            os.fsync(f.fileno())
+            with open(checkpoint_path, "w") as cp:
+                json.dump({
+                    "fmt": fmt,
+                    "calendar_id": calendar_id,
+                    "time_min": time_min.isoformat(),
+                    "time_max": time_max.isoformat(),
+                    "page_token": page_token,
+                    "count": count,
+                    "offset": f.tell(),
+                }, cp)
+        f.write(_export_footer(fmt).encode("utf-8"))
+
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return f"📄 Exported {count} events to {filepath}"
 
-    return f"📄 Exported {len(events_result.get('items', []))} events to {filepath}"
 
+def export_calendar_to_json(filepath="calendar_dump.json", timezone="Asia/Kolkata"):
+    return export_calendar(filepath, fmt="json", timezone=timezone)
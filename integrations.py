@@ -1,194 +1,142 @@
 import os
-import imaplib
-import smtplib
-from email.message import EmailMessage
-from email import message_from_bytes
-import googlemaps
-import requests
 import json
+import re
 from datetime import datetime, timedelta
 import pytz
-from google_calendar import get_calendar_service
+from google_calendar import event_source_label
+import calendar_store
+import freebusy
+import google_api
+import outbox
+import mail
+import mail_outbox
+import datastore
+from scheduler import split_task_id, new_task_id, resolve_item
+from calendar_store import DEFAULT_MAX_STALENESS
 
 # Email (IMAP) integration
 def list_emails(folder: str = "INBOX", limit: int = 5) -> str:
-    host = os.getenv("IMAP_HOST")
-    port = int(os.getenv("IMAP_PORT", 993))
-    user = os.getenv("EMAIL_USER")
-    password = os.getenv("EMAIL_PASS")
-    if not all([host, user, password]):
+    pool = mail.imap_pool()
+    if pool is None:
         return "IMAP credentials not set."
     try:
-        mail = imaplib.IMAP4_SSL(host, port)
-        mail.login(user, password)
-        mail.select(folder)
-        status, data = mail.search(None, "ALL")
-        email_ids = data[0].split()
-        email_ids = email_ids[-limit:] if len(email_ids) >= limit else email_ids
-        emails = []
-        for eid in reversed(email_ids):
-            status, msg_data = mail.fetch(eid, "(RFC822.HEADER)")
-            raw = msg_data[0][1]
-            msg = message_from_bytes(raw)
-            subj = msg.get("Subject")
-            frm = msg.get("From")
-            date = msg.get("Date")
-            emails.append(f"From: {frm}, Subject: {subj}, Date: {date}")
+        headers = pool.run(folder, lambda session: mail.recent_headers(session, limit))
+        emails = [f"From: {h['from']}, Subject: {h['subject']}, Date: {h['date']}" for _, h in headers]
         return "\n".join(emails) if emails else "No emails found."
     except Exception as e:
         return f"Failed to list emails: {e}"
 
 # Email (SMTP) integration
-def send_email(to: str, subject: str, body: str) -> str:
-    host = os.getenv("SMTP_HOST")
-    port = int(os.getenv("SMTP_PORT", 587))
-    user = os.getenv("EMAIL_USER")
-    password = os.getenv("EMAIL_PASS")
-    if not all([host, user, password]):
-        return "SMTP credentials not set."
-    try:
-        with smtplib.SMTP(host, port) as server:
-            server.starttls()
-            server.login(user, password)
-            msg = EmailMessage()
-            msg["From"] = user
-            msg["To"] = to
-            msg["Subject"] = subject
-            msg.set_content(body)
-            server.send_message(msg)
-        return f"Email sent to {to}."
-    except Exception as e:
-        return f"Failed to send email: {e}"
+# Queue outgoing mail for the background sender by default instead of sending inline.
+QUEUE_EMAIL = bool(os.getenv("KAALA_MAIL_QUEUE"))
 
-# Google Maps travel-time estimates
-def get_travel_time(origin: str, destination: str, mode: str = "driving") -> str:
-    api_key = os.getenv("GOOGLE_MAPS_API_KEY")
-    if not api_key:
-        return "Google Maps API key not set."
-    try:
-        gmaps = googlemaps.Client(key=api_key)
-        matrix = gmaps.distance_matrix(origins=[origin], destinations=[destination], mode=mode)
-        elem = matrix["rows"][0]["elements"][0]
-        if elem.get("status") != "OK":
-            return f"Could not compute travel time: {elem.get('status')}"
-        duration = elem["duration"]["text"]
-        return f"Travel time from {origin} to {destination} by {mode}: {duration}"
-    except Exception as e:
-        return f"Failed to get travel time: {e}"
 
-# OpenWeatherMap integration
-def get_current_weather(location: str) -> str:
-    api_key = os.getenv("OWM_API_KEY")
-    if not api_key:
-        return "OpenWeatherMap API key not set."
+def send_emails(messages: list, queue: bool = None) -> str:
+    """
+    Send many emails over one SMTP session. Each message is a dict with
+    "to", "subject" and "body". With queue=True they are handed to the
+    background sender and this returns at once.
+    """
+    client = mail.smtp_client()
+    if client is None:
+        return "SMTP credentials not set."
     try:
-        url = f"http://api.openweathermap.org/data/2.5/weather?q={location}&appid={api_key}&units=metric"
-        resp = requests.get(url)
-        data = resp.json()
-        temp = data["main"]["temp"]
-        desc = data["weather"][0]["description"]
-        return f"Current weather in {location}: {temp}°C, {desc}."
-    except Exception as e:
-        return f"Failed to get weather: {e}"
-
-def get_weather_forecast(location: str, date: str) -> str:
-    api_key = os.getenv("OWM_API_KEY")
-    if not api_key:
-        return "OpenWeatherMap API key not set."
+        batch = [(m["to"], m["subject"], m["body"]) for m in messages]
+    except (KeyError, TypeError):
+        return "❌ Each email needs 'to', 'subject' and 'body'."
+    if not batch:
+        return "⚠️ No emails to send."
+    errors = [None] * len(batch)
+    built = []
+    for i, (to, subject, body) in enumerate(batch):
+        try:
+            built.append((i, mail.build_message(client.user, to, subject, body)))
+        except Exception as e:
+            errors[i] = e
+    if queue if queue is not None else QUEUE_EMAIL:
+        rejected = [(to, error) for (to, _, _), error in zip(batch, errors) if error is not None]
+        try:
+            count = mail_outbox.enqueue([batch[i] for i, _ in built]) if built else 0
+        except Exception as e:
+            return f"Failed to queue emails: {e}"
+        out = f"📤 Queued {count} email(s) for sending."
+        for to, error in rejected:
+            out += f"\nFailed to send email to {to}: {error}"
+        return out
     try:
-        url = f"http://api.openweathermap.org/data/2.5/forecast?q={location}&appid={api_key}&units=metric"
-        resp = requests.get(url)
-        data = resp.json()
-        target = datetime.fromisoformat(date)
-        forecasts = data.get("list", [])
-        best = None
-        for item in forecasts:
-            dt = datetime.fromtimestamp(item["dt"])
-            if dt.date() == target.date():
-                best = item
-                break
-        if not best:
-            return f"No forecast found for {date} in {location}."
-        temp = best["main"]["temp"]
-        desc = best["weather"][0]["description"]
-        time_str = datetime.fromtimestamp(best["dt"]).strftime("%Y-%m-%d %H:%M")
-        return f"Forecast for {location} on {date} at {time_str}: {temp}°C, {desc}."
+        for (i, _), error in zip(built, client.send([msg for _, msg in built])):
+            errors[i] = error
     except Exception as e:
-        return f"Failed to get weather forecast: {e}"
+        for i, _ in built:
+            errors[i] = e
+    sent = [to for (to, _, _), error in zip(batch, errors) if error is None]
+    failed = [(to, error) for (to, _, _), error in zip(batch, errors) if error is not None]
+    if len(batch) == 1:
+        return f"Failed to send email: {failed[0][1]}" if failed else f"Email sent to {batch[0][0]}."
+    out = f"📧 Sent {len(sent)} of {len(batch)} emails" + (f" (to {', '.join(sent)})." if sent else ".")
+    for to, error in failed:
+        out += f"\nFailed to send email to {to}: {error}"
+    return out
 
-# Timezone conversion
-def convert_timezone(time_str: str, from_tz: str, to_tz: str) -> str:
-    try:
-        naive = datetime.fromisoformat(time_str)
-        src = pytz.timezone(from_tz)
-        dst = pytz.timezone(to_tz)
-        localized = src.localize(naive)
-        converted = localized.astimezone(dst)
-        return converted.isoformat()
-    except Exception as e:
-        return f"Failed to convert timezone: {e}"
+
+def send_email(to: str, subject: str, body: str, queue: bool = None) -> str:
+    return send_emails([{"to": to, "subject": subject, "body": body}], queue)
 
 # Google Calendar date-specific events
-def list_events_on_date(date_str: str, timezone: str = "Asia/Kolkata") -> str:
-    service = get_calendar_service()
+def list_events_on_date(date_str: str, timezone: str = "Asia/Kolkata",
+                        max_staleness: int = DEFAULT_MAX_STALENESS) -> str:
     tz = pytz.timezone(timezone)
     start = tz.localize(datetime.strptime(date_str, "%Y-%m-%d"))
     end = start + timedelta(days=1)
-    events_result = service.events().list(
-        calendarId="primary",
-        timeMin=start.isoformat(),
-        timeMax=end.isoformat(),
-        singleEvents=True,
-        orderBy="startTime"
-    ).execute()
-    events = events_result.get("items", [])
+    events = calendar_store.query_calendars(start, end, max_staleness=max_staleness)
     if not events:
         return f"No events on {date_str}."
     out = f"Events on {date_str}:"
     for event in events:
         start_time = event["start"].get("dateTime", event["start"].get("date"))
-        out += f"\n- {event.get('summary','')} at {start_time} (ID: {event.get('id')})"
+        out += f"\n- {event.get('summary','')} at {start_time} (ID: {event.get('id')}){event_source_label(event)}"
     return out
 
 # Find free slots based on calendar events
 def find_free_slots(date_str: str, duration: int, timezone: str = "Asia/Kolkata") -> str:
-    service = get_calendar_service()
     tz = pytz.timezone(timezone)
     start = tz.localize(datetime.strptime(date_str, "%Y-%m-%d"))
     end = start + timedelta(days=1)
-    events_result = service.events().list(
-        calendarId="primary",
-        timeMin=start.isoformat(),
-        timeMax=end.isoformat(),
-        singleEvents=True,
-        orderBy="startTime"
-    ).execute()
-    events = events_result.get("items", [])
-    slots = []
-    current = start
-    for event in events:
-        ev_start = datetime.fromisoformat(event["start"].get("dateTime", event["start"].get("date")))
-        ev_end = datetime.fromisoformat(event["end"].get("dateTime", event["end"].get("date")))
-        if ev_start - current >= timedelta(minutes=duration):
-            slots.append((current, ev_start))
-        current = max(current, ev_end)
-    if end - current >= timedelta(minutes=duration):
-        slots.append((current, end))
+    busy = freebusy.fetch_busy(start, end, timezone=timezone)
+    slots = list(busy.free_slots(start, end, timedelta(minutes=duration)))
     if not slots:
         return f"No free slots of at least {duration} minutes on {date_str}."
     out = f"Free slots on {date_str} for {duration} minutes:"
     for s, e in slots:
-        out += f"\n- {s.strftime('%H:%M')} to {e.strftime('%H:%M')}"
+        out += f"\n- {s.astimezone(tz).strftime('%H:%M')} to {e.astimezone(tz).strftime('%H:%M')}"
+    return out
+
+def find_next_free_slots(duration: int, days: int = 7, count: int = 3,
+                         start_date: str = None,
+                         work_start: str = freebusy.WORKDAY_START,
+                         work_end: str = freebusy.WORKDAY_END,
+                         timezone: str = "Asia/Kolkata") -> str:
+    """
+    Find the first `count` free slots of `duration` minutes within working
+    hours across the next `days` days (from start_date, default now).
+    """
+    tz = pytz.timezone(timezone)
+    start = tz.localize(datetime.strptime(start_date, "%Y-%m-%d")) if start_date else None
+    slots = freebusy.find_slots(duration, days=days, count=count, start=start,
+                                work_start=work_start, work_end=work_end, timezone=timezone)
+    if not slots:
+        return f"No free slots of at least {duration} minutes in the next {days} day(s)."
+    out = f"Next free slots for {duration} minutes:"
+    for s, e in slots:
+        s, e = s.astimezone(tz), e.astimezone(tz)
+        out += f"\n- {s.strftime('%Y-%m-%d')} {s.strftime('%H:%M')} to {e.strftime('%H:%M')}"
     return out
 
 # Local to-do list syncing
-todo_file = "todo_list.txt"
+todo_file = datastore.TODO_FILE
 
 def read_todo_list() -> str:
-    if not os.path.exists(todo_file):
-        open(todo_file, "w").close()
-    with open(todo_file) as f:
-        lines = [l.strip() for l in f if l.strip()]
+    lines = [l.strip() for l in datastore.get_backend().todo_lines() if l.strip()]
     if not lines:
         return "No tasks in to-do list."
     out = "To-do list:"
@@ -196,40 +144,71 @@ def read_todo_list() -> str:
         out += f"\n{idx}. {line}"
     return out
 
+class TodoItem:
+    """One "[ ] text ^id" line of the to-do list."""
+    __slots__ = ("id", "done", "text", "index")
+
+    def __init__(self, id, done, text, index):
+        self.id = id
+        self.done = done
+        self.text = text
+        self.index = index
+
+def _todo_items(backend):
+    """Parsed to-do items, tagging legacy items with IDs on first use."""
+    def parse(lines):
+        items = []
+        for index, line in enumerate(lines):
+            if line.startswith(("[ ]", "[x]")):
+                text, item_id = split_task_id(line[3:])
+                items.append(TodoItem(item_id, line.startswith("[x]"), text, index))
+        return items
+
+    items = parse(backend.todo_lines())
+    if any(not item.id for item in items):
+        backend.todo_assign_ids()
+        items = parse(backend.todo_lines())
+    return items
+
 def append_todo_item(task: str) -> str:
-    if not os.path.exists(todo_file):
-        open(todo_file, "w").close()
-    with open(todo_file, "a") as f:
-        f.write(f"[ ] {task}\n")
-    return f"Added to to-do list: {task}"
+    backend = datastore.get_backend()
+    item_id = new_task_id({split_task_id(line)[1] for line in backend.todo_lines()})
+    backend.todo_append(f"[ ] {task} ^{item_id}")
+    return f"Added to to-do list: {task} (id {item_id})"
 
-def mark_todo_item_done(task_text: str) -> str:
-    if not os.path.exists(todo_file):
+def mark_todo_item_done(task_text: str = None, match: str = "exact", item_id: str = None) -> str:
+    """Tick one to-do item, chosen by id or by text (match: exact, prefix or fuzzy)."""
+    backend = datastore.get_backend()
+    if not backend.todo_exists():
         return "To-do list not found."
-    with open(todo_file) as f:
-        lines = f.readlines()
-    new_lines = []
-    found = False
-    for l in lines:
-        if task_text in l and "[ ]" in l:
-            new_lines.append(l.replace("[ ]", "[x]"))
-            found = True
-        else:
-            new_lines.append(l)
-    with open(todo_file, "w") as f:
-        f.writelines(new_lines)
-    return "Marked task as done." if found else "Task not found."
+    items = _todo_items(backend)
+    if not item_id:
+        items = [item for item in items if not item.done] or items
+    item, error = resolve_item(items, task_text, match, item_id)
+    if error:
+        return error
+    if item.done:
+        return f"Task '{item.text}' is already done."
+    if not backend.todo_replace(item.id, f"[x] {item.text} ^{item.id}", hint=item.index):
+        return "Task not found."
+    return "Marked task as done."
 
-def delete_todo_item(task_text: str) -> str:
-    if not os.path.exists(todo_file):
+def delete_todo_item(task_text: str = None, match: str = "exact", item_id: str = None) -> str:
+    """Delete one to-do item, chosen by id or by text (match: exact, prefix or fuzzy)."""
+    backend = datastore.get_backend()
+    if not backend.todo_exists():
         return "To-do list not found."
-    with open(todo_file) as f:
-        lines = f.readlines()
-    new_lines = [l for l in lines if task_text not in l]
-    deleted = len(lines) - len(new_lines)
-    with open(todo_file, "w") as f:
-        f.writelines(new_lines)
-    return f"Deleted {deleted} matching task(s)." if deleted else "Task not found."
+    item, error = resolve_item(_todo_items(backend), task_text, match, item_id)
+    if error:
+        return error
+    if not backend.todo_replace(item.id, None, hint=item.index):
+        return "Task not found."
+    return f"Deleted task: {item.text}"
+
+def _day_window(date_str: str, earliest_time: str, latest_time: str, tz):
+    start_dt = datetime.fromisoformat(f"{date_str}T{earliest_time or '00:00'}")
+    end_dt = datetime.fromisoformat(f"{date_str}T{latest_time or '23:59'}")
+    return tz.localize(start_dt), tz.localize(end_dt)
 
 def schedule_task(description: str, duration: int, date_str: str,
                   earliest_time: str = None, latest_time: str = None,
@@ -242,80 +221,123 @@ def schedule_task(description: str, duration: int, date_str: str,
     - earliest_time: HH:MM (default: 00:00)
     - latest_time: HH:MM (default: 23:59)
     """
-    service = get_calendar_service()
     tz = pytz.timezone(timezone)
     # Build day start/end boundaries
-    if earliest_time:
-        start_dt = datetime.fromisoformat(f"{date_str}T{earliest_time}")
-    else:
-        start_dt = datetime.fromisoformat(f"{date_str}T00:00")
-    if latest_time:
-        end_dt = datetime.fromisoformat(f"{date_str}T{latest_time}")
-    else:
-        end_dt = datetime.fromisoformat(f"{date_str}T23:59")
-    start = tz.localize(start_dt)
-    end = tz.localize(end_dt)
-    # Fetch existing events
-    events_result = service.events().list(
-        calendarId="primary",
-        timeMin=start.isoformat(),
-        timeMax=end.isoformat(),
-        singleEvents=True,
-        orderBy="startTime"
-    ).execute()
-    events = events_result.get("items", [])
+    start, end = _day_window(date_str, earliest_time, latest_time, tz)
     # Find free slot
-    cursor = start
-    for ev in events:
-        ev_start_str = ev["start"].get("dateTime")
-        ev_end_str = ev["end"].get("dateTime")
-        if not ev_start_str or not ev_end_str:
-            continue
-        ev_start = datetime.fromisoformat(ev_start_str)
-        ev_end = datetime.fromisoformat(ev_end_str)
-        # Check for gap before this event
-        if (ev_start - cursor).total_seconds() >= duration * 60:
-            slot_start = cursor
-            break
-        # Move cursor forward
-        cursor = max(cursor, ev_end)
-    else:
-        # After all events, check final gap
-        if (end - cursor).total_seconds() >= duration * 60:
-            slot_start = cursor
-        else:
-            return f"No available slot of {duration} minutes on {date_str}."
+    busy = freebusy.fetch_busy(start, end, timezone=timezone)
+    slot_start = busy.first_fit(start, end, timedelta(minutes=duration))
+    if slot_start is None:
+        return f"No available slot of {duration} minutes on {date_str}."
+    slot_start = slot_start.astimezone(tz)
     slot_end = slot_start + timedelta(minutes=duration)
-    # Create event
-    event_body = {
+    # Queue event creation
+    event_body = google_api.with_event_id({
         "summary": description,
         "start": {"dateTime": slot_start.isoformat(), "timeZone": timezone},
         "end": {"dateTime": slot_end.isoformat(), "timeZone": timezone},
-    }
+    })
     try:
-        created = service.events().insert(calendarId="primary", body=event_body).execute()
-        link = created.get("htmlLink")
-        return f"✅ Scheduled '{description}' on {date_str} at {slot_start.strftime('%H:%M')}. Link: {link}"
+        outbox.enqueue("insert", "primary", event_body["id"], event_body)
+        return f"✅ Scheduled '{description}' on {date_str} at {slot_start.strftime('%H:%M')} (ID: {event_body['id']}, syncing to Google Calendar)."
     except Exception as e:
         return f"Failed to schedule task: {e}"
 
+# Scheduling hints written into a to-do item: "Write report ~1h30m !1 @14:00-17:00"
+# (duration, priority 1-5 where 1 is most important, and time window).
+TODO_DURATION_TAG = re.compile(r"^~(?:(\d+)h)?(?:(\d+)m)?$")
+TODO_PRIORITY_TAG = re.compile(r"^!([1-5])$")
+TODO_WINDOW_TAG = re.compile(r"^@(\d{2}:\d{2})?-(\d{2}:\d{2})?$")
+DEFAULT_PRIORITY = 3
+
+def _todo_hints(text: str):
+    """Split scheduling tags off a to-do text; returns (summary, hints)."""
+    words, hints = [], {}
+    for word in text.split():
+        duration = TODO_DURATION_TAG.match(word)
+        priority = TODO_PRIORITY_TAG.match(word)
+        window = TODO_WINDOW_TAG.match(word)
+        if duration and any(duration.groups()):
+            hints["duration"] = int(duration.group(1) or 0) * 60 + int(duration.group(2) or 0)
+        elif priority:
+            hints["priority"] = int(priority.group(1))
+        elif window and any(window.groups()):
+            for key, value in zip(("earliest_time", "latest_time"), window.groups()):
+                if value:
+                    hints[key] = value
+        else:
+            words.append(word)
+    return " ".join(words), hints
+
 def schedule_todo_tasks(date_str: str, default_duration: int = 60,
-                        timezone: str = "Asia/Kolkata") -> str:
+                        timezone: str = "Asia/Kolkata", tasks: list = None,
+                        dry_run: bool = False, earliest_time: str = None,
+                        latest_time: str = None) -> str:
     """
     Auto-schedule all undone to-do list items into free slots on a given date.
+    Each item's duration, priority and window come from its tags, from
+    `tasks` (overrides matched by item id or text) or from the defaults.
+    Busy time is fetched once, all items are packed in one pass and the
+    events are queued in the calendar outbox; dry_run only shows the plan.
     """
     # Load undone tasks
-    if not os.path.exists(todo_file):
+    backend = datastore.get_backend()
+    if not backend.todo_exists():
         return "To-do list not found."
-    with open(todo_file) as f:
-        lines = [l.strip() for l in f if l.startswith("[ ]")]
-    if not lines:
+    todo = [item for item in _todo_items(backend) if not item.done]
+    if not todo:
         return "No undone tasks to schedule."
+    overrides = {}
+    for override in tasks or []:
+        key = override.get("id") or (override.get("text") or "").strip().casefold()
+        overrides[key] = override
+    tz = pytz.timezone(timezone)
+    items = []
+    try:
+        for item in todo:
+            summary, hints = _todo_hints(item.text)
+            hints.update({k: v for k, v in (overrides.get(item.id) or overrides.get(summary.casefold()) or {}).items() if v})
+            duration = int(hints.get("duration") or default_duration)
+            if duration <= 0:
+                return f"❌ Duration for '{summary}' must be positive."
+            earliest, latest = _day_window(date_str, hints.get("earliest_time") or earliest_time,
+                                           hints.get("latest_time") or latest_time, tz)
+            items.append({
+                "summary": summary,
+                "duration": timedelta(minutes=duration),
+                "priority": int(hints.get("priority") or DEFAULT_PRIORITY),
+                "earliest": earliest,
+                "latest": latest,
+            })
+    except ValueError as e:
+        return f"❌ Invalid date or time: {e}"
+    busy = freebusy.fetch_busy(min(i["earliest"] for i in items), max(i["latest"] for i in items), timezone=timezone)
+    starts = freebusy.pack(busy, items)
+    placed = sorted(
+        ((start.astimezone(tz), item) for start, item in zip(starts, items) if start is not None),
+        key=lambda pair: pair[0],
+    )
+    unplaced = [item for start, item in zip(starts, items) if start is None]
     results = []
-    for line in lines:
-        # Strip checkbox prefix
-        task = line[3:].strip()
-        res = schedule_task(task, default_duration, date_str,
-                            timezone=timezone)
-        results.append(res)
-    return "\n".join(results)
\ No newline at end of file
+    if dry_run:
+        results.append(f"🗓️ Plan for {date_str} (dry run, nothing created):")
+        for start, item in placed:
+            end = start + item["duration"]
+            results.append(f"- {start.strftime('%H:%M')} to {end.strftime('%H:%M')}: {item['summary']} (priority {item['priority']})")
+    else:
+        for start, item in placed:
+            event_body = google_api.with_event_id({
+                "summary": item["summary"],
+                "start": {"dateTime": start.isoformat(), "timeZone": timezone},
+                "end": {"dateTime": (start + item["duration"]).isoformat(), "timeZone": timezone},
+            })
+            try:
+                outbox.enqueue("insert", "primary", event_body["id"], event_body)
+                results.append(f"✅ Scheduled '{item['summary']}' on {date_str} at {start.strftime('%H:%M')} "
+                               f"(ID: {event_body['id']}, syncing to Google Calendar).")
+            except Exception as e:
+                results.append(f"Failed to schedule task '{item['summary']}': {e}")
+    for item in unplaced:
+        minutes = int(item["duration"].total_seconds() // 60)
+        results.append(f"No available slot of {minutes} minutes on {date_str} for '{item['summary']}'.")
+    return "\n".join(results)
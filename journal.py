@@ -0,0 +1,572 @@
+"""
+journal.py
+
+Append-only storage backend (KAALA_STORAGE=journal). Every change to a
+schedule day, the to-do list or a record kind (contacts, calls, recurrence
+rules) is one small JSON line appended to the current log segment: the
+lines or records it removed and inserted at one position. A write costs
+O(size of the change) instead of a full-file rewrite.
+
+State lives in memory and is rebuilt from the latest snapshot plus the
+records after it; appends by other processes are picked up by reading only
+the new tail of the log. Every COMPACT_EVERY records the state is written
+as a snapshot and a new segment starts. The last KEEP_SNAPSHOTS snapshots
+and their segments are kept, so recent changes can be undone and any
+moment since the oldest kept snapshot can be viewed.
+"""
+import os
+import json
+import copy
+import threading
+import time
+from datetime import datetime
+import datastore
+import storage
+
+JOURNAL_DIR = os.getenv("KAALA_JOURNAL_DIR", "journal")
+# Records per segment before the state is compacted into a snapshot.
+COMPACT_EVERY = 1000
+KEEP_SNAPSHOTS = 20
+
+
+def _day(date):
+    return f"day:{date}"
+
+
+def _records(kind):
+    return f"records:{kind}"
+
+
+def _diff(old, new):
+    """Smallest single splice turning list `old` into `new`: (index, removed, inserted)."""
+    start = 0
+    while start < len(old) and start < len(new) and old[start] == new[start]:
+        start += 1
+    end_old, end_new = len(old), len(new)
+    while end_old > start and end_new > start and old[end_old - 1] == new[end_new - 1]:
+        end_old -= 1
+        end_new -= 1
+    return start, old[start:end_old], new[start:end_new]
+
+
+def _apply(state, record):
+    target = record["target"]
+    if record["op"] == "drop":
+        state.pop(target, None)
+        return
+    entry = state.setdefault(target, {"items": [], "version": 0})
+    index = record["index"]
+    entry["items"][index:index + len(record["remove"])] = copy.deepcopy(record["insert"])
+    entry["version"] = record["seq"]
+
+
+def _inverse(record):
+    """The record that undoes `record`."""
+    target = record["target"]
+    if record["op"] == "drop":
+        return {"op": "splice", "target": target, "index": 0, "remove": [], "insert": record["before"], "created": True}
+    if record.get("created"):
+        return {"op": "drop", "target": target, "before": record["insert"]}
+    return {"op": "splice", "target": target, "index": record["index"],
+            "remove": record["insert"], "insert": record["remove"]}
+
+
+def _applies(state, record):
+    """Whether `record` still matches the state it was meant for."""
+    entry = state.get(record["target"])
+    if record["op"] == "drop":
+        return entry is not None and entry["items"] == record["before"]
+    if record.get("created"):
+        return entry is None
+    if entry is None:
+        return False
+    index = record["index"]
+    return entry["items"][index:index + len(record["remove"])] == record["remove"]
+
+
+class JournalBackend:
+    """All local state as snapshots plus an append-only log of splices."""
+
+    def __init__(self, directory=JOURNAL_DIR):
+        self.directory = directory
+        self.lock_target = os.path.join(directory, "journal")
+        self._lock = threading.RLock()
+        self.state = None
+        os.makedirs(directory, exist_ok=True)
+
+    # Files
+
+    def _segment_path(self, start):
+        return os.path.join(self.directory, f"log-{start:012d}.jsonl")
+
+    def _snapshot_path(self, seq):
+        return os.path.join(self.directory, f"snapshot-{seq:012d}.json")
+
+    def _list(self, prefix):
+        return sorted(int(name[len(prefix):].split(".")[0])
+                      for name in os.listdir(self.directory) if name.startswith(prefix))
+
+    def _read_snapshot(self, seq):
+        with open(self._snapshot_path(seq)) as f:
+            return json.load(f)
+
+    def _read_lines(self, path, offset=0):
+        """Complete records in a segment from `offset`, and the offset after the last one."""
+        try:
+            with open(path, "rb") as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return [], offset
+        end = data.rfind(b"\n") + 1
+        records = []
+        for line in data[:end].splitlines():
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                print(f"[journal] Skipping unreadable record in {path}.")
+        return records, offset + end
+
+    # State
+
+    def _load(self):
+        snapshots = self._list("snapshot-")
+        if snapshots:
+            snapshot = self._read_snapshot(snapshots[-1])
+            self.state, self.seq, self.last_ts = snapshot["state"], snapshot["seq"], snapshot["ts"]
+        else:
+            self.state, self.seq, self.last_ts = {}, 0, None
+        self.snapshot_seq = self.segment = self.seq
+        self.offset = 0
+
+    def _refresh(self):
+        """Catch up with records appended since the last read, by any process."""
+        with self._lock:
+            snapshots = self._list("snapshot-")
+            if self.state is None or (snapshots and self.segment < snapshots[0]
+                                      and not os.path.exists(self._segment_path(self.segment))):
+                # First use, or our segment was pruned by a compaction elsewhere.
+                self._load()
+            for start in [s for s in self._list("log-") if s >= self.segment]:
+                records, offset = self._read_lines(self._segment_path(start), self.offset if start == self.segment else 0)
+                for record in records:
+                    if record["seq"] > self.seq:
+                        _apply(self.state, record)
+                        self.seq, self.last_ts = record["seq"], record["ts"]
+                if start != self.segment:
+                    # A compaction elsewhere started this segment.
+                    self.snapshot_seq = start
+                self.segment, self.offset = start, offset
+            latest = self._list("snapshot-")[-1:]
+            if latest and latest[0] > self.segment and self.seq >= latest[0]:
+                # Compacted elsewhere and nothing appended yet: write to the new segment.
+                self.segment = self.snapshot_seq = latest[0]
+                self.offset = 0
+
+    def _writing(self):
+        return _Writing(self)
+
+    def _append(self, record):
+        """Write one record to the log and apply it. Call inside _writing()."""
+        record = {"seq": self.seq + 1, "ts": time.time(), **record}
+        path = self._segment_path(self.segment)
+        if os.path.exists(path) and os.path.getsize(path) > self.offset:
+            # A torn record left by a crashed writer.
+            os.truncate(path, self.offset)
+        line = (json.dumps(record, separators=(",", ":")) + "\n").encode()
+        with open(path, "ab") as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        self.offset += len(line)
+        _apply(self.state, record)
+        self.seq, self.last_ts = record["seq"], record["ts"]
+        if self.seq - self.snapshot_seq >= COMPACT_EVERY:
+            self.compact()
+        return record
+
+    def _splice(self, target, index, remove, insert):
+        """Append a splice of one target; creates the target if it is missing."""
+        if not remove and not insert and target in self.state:
+            return None
+        record = {"op": "splice", "target": target, "index": index, "remove": remove, "insert": insert}
+        if target not in self.state:
+            record["created"] = True
+        return self._append(record)
+
+    def _replace_all(self, target, items):
+        old = self.state[target]["items"] if target in self.state else []
+        return self._splice(target, *_diff(old, list(items)))
+
+    def compact(self):
+        """Snapshot the current state, start a new segment and prune old history."""
+        with self._writing():
+            if self.seq == self.snapshot_seq:
+                return None
+            storage.atomic_write(self._snapshot_path(self.seq), json.dumps(
+                {"seq": self.seq, "ts": self.last_ts, "state": self.state}, separators=(",", ":")
+            ))
+            self.snapshot_seq = self.segment = self.seq
+            self.offset = 0
+            snapshots = self._list("snapshot-")
+            if len(snapshots) > KEEP_SNAPSHOTS:
+                oldest = snapshots[-KEEP_SNAPSHOTS]
+                for seq in snapshots[:-KEEP_SNAPSHOTS]:
+                    os.remove(self._snapshot_path(seq))
+                    if os.path.exists(storage.lock_path(self._snapshot_path(seq))):
+                        os.remove(storage.lock_path(self._snapshot_path(seq)))
+                for start in self._list("log-"):
+                    if start < oldest:
+                        os.remove(self._segment_path(start))
+            return self.seq
+
+    def _items(self, target):
+        self._refresh()
+        entry = self.state.get(target)
+        return list(entry["items"]) if entry else None
+
+    def _version(self, target):
+        self._refresh()
+        entry = self.state.get(target)
+        return str(entry["version"]) if entry else None
+
+    def _find(self, items, item_id, hint):
+        if hint is not None and 0 <= hint < len(items) and datastore._item_id(items[hint]) == item_id:
+            return hint
+        return next((i for i, line in enumerate(items) if datastore._item_id(line) == item_id), None)
+
+    # Schedules
+
+    def day_version(self, date):
+        return self._version(_day(date))
+
+    def read_day(self, date):
+        with self._lock:
+            items = self._items(_day(date))
+            if items is None:
+                return None, None
+            return "".join(items), str(self.state[_day(date)]["version"])
+
+    def create_day(self, date, text):
+        with self._writing():
+            if _day(date) in self.state:
+                return False
+            self._splice(_day(date), 0, [], text.splitlines(keepends=True))
+        return True
+
+    def write_day(self, date, text, expected_version=None):
+        with self._writing():
+            if expected_version is not None and self.day_version(date) != expected_version:
+                raise storage.VersionConflict(date)
+            self._replace_all(_day(date), text.splitlines(keepends=True))
+
+    def append_line(self, date, line):
+        with self._writing():
+            items = self._items(_day(date)) or []
+            if items and not items[-1].endswith("\n"):
+                self._splice(_day(date), len(items) - 1, [items[-1]], [items[-1] + "\n", line])
+            else:
+                self._splice(_day(date), len(items), [], [line])
+
+    def assign_task_ids(self, date):
+        from scheduler import with_task_ids
+
+        with self._writing():
+            text, version = self.read_day(date)
+            if version is not None:
+                self._replace_all(_day(date), with_task_ids(text).splitlines(keepends=True))
+
+    def replace_task(self, date, task_id, new_line, hint=None):
+        with self._writing():
+            items = self._items(_day(date)) or []
+            index = self._find(items, task_id, hint)
+            if index is None:
+                return False
+            self._splice(_day(date), index, [items[index]], [] if new_line is None else [new_line])
+        return True
+
+    def delete_day(self, date):
+        with self._writing():
+            items = self._items(_day(date))
+            if items is None:
+                return False
+            self._append({"op": "drop", "target": _day(date), "before": items})
+        return True
+
+    def day_versions(self, start=None, end=None):
+        with self._lock:
+            self._refresh()
+            days = sorted(
+                (target[4:], str(entry["version"])) for target, entry in self.state.items()
+                if target.startswith("day:")
+            )
+        return {date: version for date, version in days
+                if (start is None or date >= start) and (end is None or date <= end)}
+
+    def list_days(self, start=None, end=None):
+        return list(self.day_versions(start, end))
+
+    # To-do list
+
+    def todo_exists(self):
+        return self._items("todo") is not None
+
+    def todo_lines(self):
+        return self._items("todo") or []
+
+    def todo_append(self, line):
+        with self._writing():
+            self._splice("todo", len(self.todo_lines()), [], [line])
+
+    def todo_replace(self, item_id, new_line, hint=None):
+        with self._writing():
+            items = self.todo_lines()
+            index = self._find(items, item_id, hint)
+            if index is None:
+                return False
+            self._splice("todo", index, [items[index]], [] if new_line is None else [new_line])
+        return True
+
+    def todo_assign_ids(self):
+        from scheduler import with_item_ids
+
+        with self._writing():
+            if self.todo_exists():
+                self._replace_all("todo", with_item_ids(self.todo_lines()))
+
+    # Contacts, calls and recurrence rules
+
+    def records_version(self, kind):
+        return self._version(_records(kind))
+
+    def load_records(self, kind):
+        return copy.deepcopy(self._items(_records(kind)) or [])
+
+    def save_records(self, kind, records):
+        with self._writing():
+            self._replace_all(_records(kind), copy.deepcopy(list(records)))
+
+    def get_record(self, kind, key):
+        pk = datastore.RECORD_KINDS[kind][0]
+        return next((r for r in self.load_records(kind) if r.get(pk) == key), None)
+
+    def insert_records(self, kind, records):
+        with self._writing():
+            self._splice(_records(kind), len(self._items(_records(kind)) or []), [], copy.deepcopy(list(records)))
+
+    def update_record(self, kind, key, changes):
+        pk = datastore.RECORD_KINDS[kind][0]
+        with self._writing():
+            records = self.load_records(kind)
+            for index, record in enumerate(records):
+                if record.get(pk) == key:
+                    self._splice(_records(kind), index, [record], [{**record, **changes}])
+                    return True
+        return False
+
+    def delete_record(self, kind, key):
+        pk = datastore.RECORD_KINDS[kind][0]
+        with self._writing():
+            records = self.load_records(kind)
+            for index, record in enumerate(records):
+                if record.get(pk) == key:
+                    self._splice(_records(kind), index, [record], [])
+                    return True
+        return False
+
+    def find_records(self, kind, **filters):
+        return [r for r in self.load_records(kind) if all(r.get(k) == v for k, v in filters.items())]
+
+    # History
+
+    def history(self):
+        """Every kept record, newest first."""
+        self._refresh()
+        for start in reversed(self._list("log-")):
+            records, _ = self._read_lines(self._segment_path(start))
+            yield from reversed(records)
+
+    def undo(self, steps=1):
+        """
+        Revert the last `steps` changes that are not undone yet, newest first.
+        Returns the records written; stops early at a change that no longer
+        matches the current state.
+        """
+        done = []
+        with self._writing():
+            undone = set()
+            for record in self.history():
+                if len(done) >= steps:
+                    break
+                if "undoes" in record:
+                    undone.add(record["undoes"])
+                    continue
+                if record["seq"] in undone:
+                    continue
+                inverse = _inverse(record)
+                if not _applies(self.state, inverse):
+                    break
+                done.append(self._append({**inverse, "undoes": record["seq"]}))
+        return done
+
+    def state_at(self, when):
+        """State as of timestamp `when`, or None if that is before the kept history."""
+        with self._lock:
+            self._refresh()
+            snapshots = self._list("snapshot-")
+            base = None
+            for seq in reversed(snapshots):
+                snapshot = self._read_snapshot(seq)
+                if snapshot["ts"] is not None and snapshot["ts"] <= when:
+                    base = snapshot
+                    break
+            if base is None:
+                if os.path.exists(self._segment_path(0)) or not snapshots:
+                    base = {"seq": 0, "state": {}}
+                else:
+                    return None
+            state = copy.deepcopy(base["state"])
+            for start in [s for s in self._list("log-") if s >= base["seq"]]:
+                records, _ = self._read_lines(self._segment_path(start))
+                for record in records:
+                    if record["ts"] > when:
+                        return state
+                    if record["seq"] > base["seq"]:
+                        _apply(state, record)
+            return state
+
+    def import_from(self, source):
+        """Copy every day, the to-do list and all records from another backend."""
+        with self._writing():
+            days = source.list_days()
+            for date in days:
+                text, _ = source.read_day(date)
+                self._replace_all(_day(date), text.splitlines(keepends=True))
+            if source.todo_exists():
+                self._replace_all("todo", source.todo_lines())
+            for kind in datastore.RECORD_KINDS:
+                self._replace_all(_records(kind), source.load_records(kind))
+            self.compact()
+        return f"📦 Imported {len(days)} schedule day(s), the to-do list and all records into {self.directory}/."
+
+
+class _Writing:
+    """Hold the journal lock (threads and processes) and catch up before a change."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.lock = storage.file_lock(backend.lock_target)
+
+    def __enter__(self):
+        self.backend._lock.acquire()
+        try:
+            self.lock.__enter__()
+        except BaseException:
+            self.backend._lock.release()
+            raise
+        self.backend._refresh()
+        return self.backend
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.lock.__exit__(exc_type, exc, tb)
+        finally:
+            self.backend._lock.release()
+
+
+def _journal():
+    backend = datastore.get_backend()
+    return backend if isinstance(backend, JournalBackend) else None
+
+
+def _parse_when(at):
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(at.strip(), fmt).timestamp()
+        except ValueError:
+            continue
+    raise ValueError(at)
+
+
+def _describe(record):
+    target = record["target"].replace(":", " ", 1)
+    if "undoes" in record:
+        action = f"undo of #{record['undoes']}"
+    elif record["op"] == "drop":
+        action = "deleted"
+    elif record.get("created"):
+        action = "created"
+    else:
+        action = f"-{len(record['remove'])} +{len(record['insert'])}"
+    when = datetime.fromtimestamp(record["ts"]).strftime("%Y-%m-%d %H:%M:%S")
+    return f"#{record['seq']} {when} {target}: {action}"
+
+
+NO_JOURNAL = "⚠️ Change history is only kept with KAALA_STORAGE=journal."
+
+
+def list_changes(limit: int = 10):
+    """The most recent changes to schedules, the to-do list and records."""
+    backend = _journal()
+    if backend is None:
+        return NO_JOURNAL
+    lines = []
+    for record in backend.history():
+        lines.append(f"- {_describe(record)}")
+        if len(lines) >= limit:
+            break
+    if not lines:
+        return "No changes recorded yet."
+    return "🕘 Recent changes:\n" + "\n".join(lines)
+
+
+def undo_last_change(steps: int = 1):
+    """Revert the most recent change(s) that have not been undone yet."""
+    backend = _journal()
+    if backend is None:
+        return NO_JOURNAL
+    done = backend.undo(steps)
+    if not done:
+        return "⚠️ Nothing to undo, or the last change was overwritten since."
+    out = f"↩️ Undid {len(done)} change(s):"
+    for record in done:
+        out += f"\n- {_describe(record)}"
+    if len(done) < steps:
+        out += "\n⚠️ Stopped early: an older change no longer matches the current state."
+    return out
+
+
+def _state_at(at):
+    backend = _journal()
+    if backend is None:
+        return None, NO_JOURNAL
+    try:
+        when = _parse_when(at)
+    except ValueError:
+        return None, "❌ Time must be YYYY-MM-DD HH:MM."
+    state = backend.state_at(when)
+    if state is None:
+        return None, f"⚠️ History before {at} has been compacted away."
+    return state, None
+
+
+def view_schedule_at(date: str, at: str):
+    """A day's schedule as it was at a given moment."""
+    state, error = _state_at(at)
+    if error:
+        return error
+    entry = state.get(_day(date))
+    if entry is None:
+        return f"No schedule for {date} at {at}."
+    return "".join(entry["items"])
+
+
+def view_todo_list_at(at: str):
+    """The to-do list as it was at a given moment."""
+    state, error = _state_at(at)
+    if error:
+        return error
+    lines = [line for line in (state.get("todo") or {"items": []})["items"] if line.strip()]
+    if not lines:
+        return f"No tasks in to-do list at {at}."
+    return f"To-do list at {at}:" + "".join(f"\n{i}. {line}" for i, line in enumerate(lines, 1))
@@ -0,0 +1,381 @@
+"""
+mail.py
+
+Pooled IMAP and SMTP sessions for the email tools.
+
+Logging in costs several round trips plus a TLS handshake, so sessions are
+kept open and reused. A session idle for longer than IMAP_NOOP_AFTER is
+checked with NOOP before use, and a background keepalive logs out sessions
+idle for more than IMAP_IDLE_TIMEOUT. A session that drops mid-command is
+discarded and the command retried once on a fresh one.
+
+Sending works the same way: one SMTP session per account is kept open
+for SMTP_IDLE_TIMEOUT seconds after its last message, so a batch of
+messages costs one STARTTLS and login instead of one per message.
+"""
+import os
+import re
+import ssl
+import atexit
+import imaplib
+import smtplib
+import threading
+import time
+from email import message_from_bytes
+from email.message import EmailMessage
+from email.header import decode_header, make_header
+
+IMAP_POOL_SIZE = 2
+IMAP_TIMEOUT = 30
+# Seconds a session may sit idle before it is NOOP-checked on checkout.
+IMAP_NOOP_AFTER = 60
+# Seconds an idle session is kept before the keepalive logs it out.
+IMAP_IDLE_TIMEOUT = 600
+KEEPALIVE_INTERVAL = 60
+HEADER_FIELDS = "BODY.PEEK[HEADER.FIELDS (FROM SUBJECT DATE)]"
+DROPPED = (imaplib.IMAP4.abort, OSError, ssl.SSLError)
+SMTP_TIMEOUT = 30
+# Seconds an unused SMTP session is kept open; servers drop idle ones after a few minutes.
+SMTP_IDLE_TIMEOUT = 120
+# Server replies that reject a message; every other OSError (SMTPException
+# included) means the session itself is gone.
+SMTP_REJECTED = (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused, smtplib.SMTPNotSupportedError)
+SMTP_DROPPED = (OSError, ssl.SSLError)
+
+
+class IMAPSession:
+    """One logged-in connection and the folder it has selected."""
+
+    def __init__(self, host, port, user, password):
+        self.conn = imaplib.IMAP4_SSL(host, port, timeout=IMAP_TIMEOUT)
+        self.conn.login(user, password)
+        self.folder = None
+        self.exists = 0
+        self.uidvalidity = None
+        self.last_used = time.monotonic()
+
+    def select(self, folder):
+        """Select `folder` read-only (re-selecting refreshes its message count)."""
+        status, data = self.conn.select(_quote(folder), readonly=True)
+        if status != "OK":
+            raise imaplib.IMAP4.error(f"cannot open folder {folder}: {data}")
+        self.folder = folder
+        self.exists = int(data[0] or 0)
+        _, validity = self.conn.response("UIDVALIDITY")
+        self.uidvalidity = int(validity[0]) if validity and validity[0] else None
+
+    def noop(self):
+        self.conn.noop()
+        self.last_used = time.monotonic()
+
+    def logout(self):
+        try:
+            self.conn.logout()
+        except Exception:
+            pass
+
+
+class IMAPPool:
+    """Up to `size` idle sessions for one account, shared by all threads."""
+
+    def __init__(self, host, port, user, password, size=IMAP_POOL_SIZE):
+        self.args = (host, port, user, password)
+        self.size = size
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def _checkout(self):
+        with self.lock:
+            session = self.idle.pop() if self.idle else None
+        if session and time.monotonic() - session.last_used > IMAP_NOOP_AFTER:
+            try:
+                session.noop()
+            except Exception:
+                session.logout()
+                session = None
+        return session or IMAPSession(*self.args)
+
+    def _checkin(self, session):
+        session.last_used = time.monotonic()
+        with self.lock:
+            if len(self.idle) < self.size:
+                self.idle.append(session)
+                return
+        session.logout()
+
+    def run(self, folder, fn):
+        """
+        Call fn(session) with a session that has `folder` selected. If the
+        connection drops, retry once on a fresh session.
+        """
+        for attempt in range(2):
+            session = self._checkout()
+            try:
+                session.select(folder)
+                result = fn(session)
+            except DROPPED:
+                session.logout()
+                if attempt:
+                    raise
+                continue
+            except Exception:
+                session.logout()
+                raise
+            self._checkin(session)
+            return result
+
+    def keepalive(self):
+        """NOOP idle sessions and log out the ones idle too long."""
+        with self.lock:
+            sessions, self.idle = self.idle, []
+        kept = []
+        for session in sessions:
+            if time.monotonic() - session.last_used > IMAP_IDLE_TIMEOUT:
+                session.logout()
+                continue
+            try:
+                session.noop()
+                kept.append(session)
+            except Exception:
+                session.logout()
+        with self.lock:
+            self.idle.extend(kept)
+
+    def close(self):
+        with self.lock:
+            sessions, self.idle = self.idle, []
+        for session in sessions:
+            session.logout()
+
+
+class SMTPClient:
+    """
+    One reusable SMTP session for an account. Sends are serialized; the
+    session is opened on first use and closed once idle for SMTP_IDLE_TIMEOUT.
+    """
+
+    def __init__(self, host, port, user, password):
+        self.args = (host, port, user, password)
+        self.user = user
+        self.server = None
+        self.last_used = 0
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        host, port, user, password = self.args
+        server = smtplib.SMTP(host, port, timeout=SMTP_TIMEOUT)
+        try:
+            server.starttls()
+            server.login(user, password)
+        except Exception:
+            server.close()
+            raise
+        return server
+
+    def _close(self):
+        server, self.server = self.server, None
+        if server:
+            try:
+                server.quit()
+            except Exception:
+                server.close()
+
+    def _session(self):
+        if self.server and time.monotonic() - self.last_used > SMTP_IDLE_TIMEOUT:
+            self._close()
+        if self.server is None:
+            self.server = self._connect()
+        return self.server
+
+    def _send_one(self, msg):
+        """Send on the current session, reconnecting once if it was dropped."""
+        for attempt in range(2):
+            try:
+                self._session().send_message(msg)
+                return
+            except SMTP_REJECTED:
+                raise
+            except SMTP_DROPPED:
+                self.server = None
+                if attempt:
+                    raise
+            finally:
+                self.last_used = time.monotonic()
+
+    def send(self, messages):
+        """
+        Send EmailMessages over one session. Returns one error per message
+        (None if it was sent); a rejected message does not stop the rest,
+        but if no session can be opened the remaining messages share that error.
+        """
+        errors = []
+        with self.lock:
+            for msg in messages:
+                try:
+                    self._send_one(msg)
+                    errors.append(None)
+                except SMTP_REJECTED as e:
+                    errors.append(e)
+                    if self.server is None:
+                        # Connecting or logging in was refused.
+                        break
+                    # A refused message leaves the session usable; RSET clears any half-sent state.
+                    try:
+                        self.server.rset()
+                    except Exception:
+                        self.server = None
+                except SMTP_DROPPED as e:
+                    # Already retried on a fresh session: the server is unreachable.
+                    errors.append(e)
+                    break
+                except Exception as e:
+                    # E.g. a header smtplib cannot encode; the session's state is unknown.
+                    errors.append(e)
+                    self._close()
+        return errors + errors[-1:] * (len(messages) - len(errors))
+
+    def keepalive(self):
+        """Close the session once it has been idle too long."""
+        if not self.lock.acquire(blocking=False):
+            return
+        try:
+            if self.server and time.monotonic() - self.last_used > SMTP_IDLE_TIMEOUT:
+                self._close()
+        finally:
+            self.lock.release()
+
+    def close(self):
+        with self.lock:
+            self._close()
+
+
+def is_retryable(error):
+    """Whether a failed send may succeed later: a dropped session or a 4xx reply."""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    return isinstance(error, SMTP_DROPPED) and not isinstance(error, smtplib.SMTPNotSupportedError)
+
+
+def build_message(sender, to, subject, body):
+    msg = EmailMessage()
+    msg["From"] = sender
+    msg["To"] = to
+    msg["Subject"] = subject
+    msg.set_content(body)
+    return msg
+
+
+_pools = {}
+_smtp_clients = {}
+_pools_lock = threading.Lock()
+_keepalive_started = False
+
+
+def _keepalive_loop():
+    while True:
+        time.sleep(KEEPALIVE_INTERVAL)
+        for pool in list(_pools.values()) + list(_smtp_clients.values()):
+            try:
+                pool.keepalive()
+            except Exception as e:
+                print(f"[mail] Keepalive failed: {e}")
+
+
+def _start_keepalive():
+    global _keepalive_started
+    if not _keepalive_started:
+        threading.Thread(target=_keepalive_loop, daemon=True).start()
+        _keepalive_started = True
+
+
+def imap_pool():
+    """The pool for the account in IMAP_HOST/EMAIL_USER, or None if unset."""
+    host = os.getenv("IMAP_HOST")
+    port = int(os.getenv("IMAP_PORT", 993))
+    user = os.getenv("EMAIL_USER")
+    password = os.getenv("EMAIL_PASS")
+    if not all([host, user, password]):
+        return None
+    with _pools_lock:
+        key = (host, port, user)
+        if key not in _pools:
+            _pools[key] = IMAPPool(host, port, user, password)
+        _start_keepalive()
+        return _pools[key]
+
+
+def smtp_client():
+    """The SMTP client for the account in SMTP_HOST/EMAIL_USER, or None if unset."""
+    host = os.getenv("SMTP_HOST")
+    port = int(os.getenv("SMTP_PORT", 587))
+    user = os.getenv("EMAIL_USER")
+    password = os.getenv("EMAIL_PASS")
+    if not all([host, user, password]):
+        return None
+    with _pools_lock:
+        key = (host, port, user)
+        if key not in _smtp_clients:
+            _smtp_clients[key] = SMTPClient(host, port, user, password)
+        _start_keepalive()
+        return _smtp_clients[key]
+
+
+@atexit.register
+def close_pools():
+    for pool in list(_pools.values()) + list(_smtp_clients.values()):
+        pool.close()
+
+
+def _quote(folder):
+    if folder.startswith('"') or not re.search(r'[\s"()]', folder):
+        return folder
+    return '"' + folder.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _decode(value):
+    if value is None:
+        return None
+    try:
+        return str(make_header(decode_header(value)))
+    except Exception:
+        return value
+
+
+def parse_header_fetch(data):
+    """[(uid, {"from", "subject", "date"})] from a FETCH response of UID and header fields."""
+    messages = []
+    for part in data:
+        if not isinstance(part, tuple):
+            continue
+        match = re.search(rb"UID (\d+)", part[0])
+        if not match:
+            continue
+        msg = message_from_bytes(part[1])
+        messages.append((int(match.group(1)), {
+            "from": _decode(msg.get("From")),
+            "subject": _decode(msg.get("Subject")),
+            "date": msg.get("Date"),
+        }))
+    return messages
+
+
+def recent_headers(session, limit):
+    """
+    Headers of the newest `limit` messages in the selected folder. UID SEARCH
+    covers only the last `limit` sequence numbers, and one UID FETCH gets
+    all their headers without marking anything read.
+    """
+    if session.exists == 0 or limit <= 0:
+        return []
+    first = max(1, session.exists - limit + 1)
+    status, data = session.conn.uid("SEARCH", None, f"{first}:*")
+    uids = data[0].split() if status == "OK" and data and data[0] else []
+    if not uids:
+        return []
+    uid_range = f"{min(map(int, uids))}:{max(map(int, uids))}"
+    status, data = session.conn.uid("FETCH", uid_range, f"(UID {HEADER_FIELDS})")
+    if status != "OK":
+        raise imaplib.IMAP4.error(f"FETCH failed: {data}")
+    return sorted(parse_header_fetch(data), key=lambda item: item[0], reverse=True)
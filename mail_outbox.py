@@ -0,0 +1,180 @@
+"""
+mail_outbox.py
+
+Durable queue for outgoing email.
+
+Queued messages are stored in SQLite and the sending tool returns at once;
+a background worker drains the queue in batches over the shared SMTP
+session, so throughput is bounded by the server rather than by handshakes.
+Messages that fail with a dropped connection or a 4xx reply are retried
+with backoff up to MAX_ATTEMPTS times; anything else is marked failed.
+"""
+import os
+import sqlite3
+import threading
+import time
+import mail
+
+MAIL_OUTBOX_DB = os.getenv("KAALA_MAIL_OUTBOX_DB", "mail_outbox.db")
+BATCH_SIZE = 50
+MAX_ATTEMPTS = 5
+RETRY_DELAY_MAX = 300
+
+_local = threading.local()
+_wakeup = threading.Event()
+_idle = threading.Event()
+_worker = None
+_worker_lock = threading.Lock()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    recipient TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    body TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_status ON messages (status, next_attempt_at, seq);
+"""
+
+
+def get_connection():
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(MAIL_OUTBOX_DB, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+        _local.conn = conn
+    return conn
+
+
+def enqueue(messages):
+    """Queue (to, subject, body) tuples and wake the worker. Returns how many were queued."""
+    now = time.time()
+    conn = get_connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.executemany(
+            "INSERT INTO messages (recipient, subject, body, created_at) VALUES (?, ?, ?, ?)",
+            [(to, subject, body, now) for to, subject, body in messages]
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    start_worker()
+    _wakeup.set()
+    return len(messages)
+
+
+def send_once():
+    """
+    Send one batch of due messages. Returns the number sent or given up on,
+    or 0 when nothing is due (or SMTP is not configured).
+    """
+    client = mail.smtp_client()
+    if client is None:
+        return 0
+    conn = get_connection()
+    rows = conn.execute(
+        "SELECT seq, recipient, subject, body, attempts FROM messages "
+        "WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY seq LIMIT ?",
+        (time.time(), BATCH_SIZE)
+    ).fetchall()
+    if not rows:
+        return 0
+    errors = [None] * len(rows)
+    built = []
+    for i, (_, to, subject, body, _) in enumerate(rows):
+        try:
+            built.append((i, mail.build_message(client.user, to, subject, body)))
+        except Exception as e:
+            # A message that cannot be built never will be; fail it rather than block the queue.
+            errors[i] = ValueError(f"Invalid message: {e}")
+    for (i, _), error in zip(built, client.send([msg for _, msg in built]) if built else []):
+        errors[i] = error
+    done = 0
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for (seq, _, _, _, attempts), error in zip(rows, errors):
+            if error is None:
+                conn.execute("DELETE FROM messages WHERE seq = ?", (seq,))
+                done += 1
+            elif mail.is_retryable(error) and attempts + 1 < MAX_ATTEMPTS:
+                delay = min(2 ** attempts * 5, RETRY_DELAY_MAX)
+                conn.execute(
+                    "UPDATE messages SET attempts = ?, last_error = ?, next_attempt_at = ? WHERE seq = ?",
+                    (attempts + 1, str(error), time.time() + delay, seq)
+                )
+            else:
+                conn.execute(
+                    "UPDATE messages SET status = 'failed', attempts = ?, last_error = ? WHERE seq = ?",
+                    (attempts + 1, str(error), seq)
+                )
+                done += 1
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return done
+
+
+def _next_due():
+    row = get_connection().execute(
+        "SELECT MIN(next_attempt_at) FROM messages WHERE status = 'pending'"
+    ).fetchone()
+    return row[0]
+
+
+def _worker_loop():
+    while True:
+        try:
+            while send_once():
+                pass
+        except Exception as e:
+            print(f"[mail_outbox] Send error: {e}")
+        due = _next_due()
+        if due is None or mail.smtp_client() is None:
+            _idle.set()
+            _wakeup.wait()
+        else:
+            _idle.clear()
+            _wakeup.wait(min(max(due - time.time(), 1), RETRY_DELAY_MAX))
+        _wakeup.clear()
+
+
+def start_worker():
+    """Start the background send thread if it is not running."""
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _idle.clear()
+            _worker = threading.Thread(target=_worker_loop, name="mail-outbox", daemon=True)
+            _worker.start()
+
+
+def flush(timeout=30):
+    """Wake the worker and wait up to `timeout` seconds for the queue to drain."""
+    start_worker()
+    _idle.clear()
+    _wakeup.set()
+    return _idle.wait(timeout)
+
+
+def get_mail_queue_status() -> str:
+    conn = get_connection()
+    pending = conn.execute("SELECT COUNT(*) FROM messages WHERE status = 'pending'").fetchone()[0]
+    failed = conn.execute(
+        "SELECT seq, recipient, subject, last_error FROM messages WHERE status = 'failed' ORDER BY seq"
+    ).fetchall()
+    if not pending and not failed:
+        return "✅ No emails waiting to be sent."
+    lines = [f"📤 {pending} email(s) waiting to be sent."] if pending else []
+    if failed:
+        lines.append(f"❌ {len(failed)} failed:")
+        lines += [f"- #{seq} to {recipient} '{subject}': {error}" for seq, recipient, subject, error in failed]
+    return "\n".join(lines)
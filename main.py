@@ -2,10 +2,13 @@
 
 from fastapi import FastAPI
 from scheduler import (
-    read_schedule, update_schedule, append_task,
-    mark_task_done, delete_schedule,
-    summarize_schedule, suggest_next_task, list_time_blocks
+    update_schedule, append_task,
+    mark_task_done, update_task, delete_task, delete_schedule,
+    summarize_schedule, suggest_next_task, list_time_blocks,
+    load_day, summarize_range, completion_stats
 )
+from journal import list_changes, undo_last_change, view_schedule_at
+from recurrence import add_recurring_task, list_recurring_tasks, update_recurring_task, delete_recurring_task
 
 app = FastAPI()
 
@@ -15,24 +18,71 @@ def root():
 
 @app.get("/read")
 def api_read(date: str):
-    return {"schedule": read_schedule(date)}
+    day = load_day(date)
+    return {"schedule": day.text, "version": day.version}
 
 @app.post("/update")
-def api_update(date: str, content: str):
-    return {"message": update_schedule(date, content)}
+def api_update(date: str, content: str, version: str = None):
+    return {"message": update_schedule(date, content, version)}
 
 @app.post("/append")
 def api_append(date: str, time: str, task: str):
     return {"message": append_task(date, time, task)}
 
 @app.post("/done")
-def api_done(date: str, task_text: str):
-    return {"message": mark_task_done(date, task_text)}
+def api_done(date: str, task_text: str = None, match: str = "exact", task_id: str = None):
+    return {"message": mark_task_done(date, task_text, match, task_id)}
+
+@app.post("/task/update")
+def api_update_task(date: str, task_text: str = None, new_text: str = None, time: str = None,
+                    match: str = "exact", task_id: str = None):
+    return {"message": update_task(date, task_text, new_text, time, match, task_id)}
+
+@app.delete("/task")
+def api_delete_task(date: str, task_text: str = None, match: str = "exact", task_id: str = None):
+    return {"message": delete_task(date, task_text, match, task_id)}
 
 @app.get("/summary")
 def api_summary(date: str):
     return {"summary": summarize_schedule(date)}
 
+@app.get("/summary/range")
+def api_summary_range(start: str, end: str):
+    return {"summary": summarize_range(start, end)}
+
+@app.get("/stats")
+def api_stats(start: str, end: str, granularity: str = "week"):
+    return {"stats": completion_stats(start, end, granularity)}
+
+@app.get("/recurring")
+def api_list_recurring():
+    return {"rules": list_recurring_tasks()}
+
+@app.post("/recurring")
+def api_add_recurring(task: str, time: str, rrule: str, start_date: str = None):
+    return {"message": add_recurring_task(task, time, rrule, start_date)}
+
+@app.post("/recurring/update")
+def api_update_recurring(rule_id: str, task: str = None, time: str = None, rrule: str = None,
+                         start_date: str = None):
+    return {"message": update_recurring_task(rule_id, task, time, rrule, start_date)}
+
+@app.delete("/recurring")
+def api_delete_recurring(rule_id: str):
+    return {"message": delete_recurring_task(rule_id)}
+
+@app.get("/history")
+def api_history(limit: int = 10):
+    return {"changes": list_changes(limit)}
+
+@app.post("/undo")
+def api_undo(steps: int = 1):
+    return {"message": undo_last_change(steps)}
+
+@app.get("/read/at")
+def api_read_at(date: str, at: str):
+    return {"schedule": view_schedule_at(date, at)}
+
 @app.get("/suggest")
 def api_suggest(date: str):
     return {"suggestion": suggest_next_task(date)}
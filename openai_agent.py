@@ -4,7 +4,8 @@ import json
 from datetime import datetime
 from scheduler import (
     read_schedule, append_task, update_schedule, delete_schedule,
-    mark_task_done, summarize_schedule, suggest_next_task
+    mark_task_done, summarize_schedule, suggest_next_task,
+    summarize_range, completion_stats
 )
 from google_calendar import (
     create_calendar_event,
@@ -16,21 +17,28 @@ from google_calendar import (
     create_all_day_event,
     delete_all_upcoming_events,
     find_events_by_keyword,
-    export_calendar_to_json
+    export_calendar_to_json,
+    export_calendar
 )
 
+from recurrence import add_recurring_task, list_recurring_tasks, update_recurring_task, delete_recurring_task
+from journal import list_changes, undo_last_change, view_schedule_at, view_todo_list_at
 from search_net import search_internet
+from travel import get_travel_time, get_travel_times, get_day_itinerary
+from timezones import convert_timezone, convert_timezones
+from weather import get_current_weather, get_weather_forecast, get_weather_for_locations, get_day_weather
+from google_api import get_api_stats
+import outbox
+import email_index
+import mail_outbox
 from integrations import (
-    list_emails, send_email,
-    get_travel_time,
-    get_current_weather, get_weather_forecast,
-    convert_timezone,
-    list_events_on_date, find_free_slots,
+    list_emails, send_email, send_emails,
+    list_events_on_date, find_free_slots, find_next_free_slots,
     read_todo_list, append_todo_item,
     mark_todo_item_done, delete_todo_item,
     schedule_task, schedule_todo_tasks
 )
-from contacts import add_contact, list_contacts, update_contact, delete_contact, find_contact, schedule_call, list_scheduled_calls, delete_scheduled_call, auto_schedule_calls
+from contacts import add_contact, list_contacts, update_contact, delete_contact, find_contact, schedule_call, list_scheduled_calls, delete_scheduled_call, auto_schedule_calls, find_call_slots
 from tools import tools
 from chat_history import load_recent_history, save_to_history
 import pytz
@@ -38,6 +46,14 @@ import pytz
 # Set OpenAI key
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
+# Replay calendar changes and emails left queued by a previous run
+outbox.start_worker()
+mail_outbox.start_worker()
+
+# Keep the local email index current in the background if asked to
+if os.getenv("KAALA_EMAIL_IDLE"):
+    email_index.start_listener()
+
 # Function dispatch map
 function_map = {
     "create_calendar_event": create_calendar_event,
@@ -50,20 +66,32 @@ function_map = {
     "delete_all_upcoming_events": delete_all_upcoming_events,
     "find_events_by_keyword": find_events_by_keyword,
     "export_calendar_to_json": export_calendar_to_json,
+    "export_calendar": export_calendar,
     "search_internet": search_internet,
+    "get_api_stats": get_api_stats,
+    "get_outbox_status": outbox.get_outbox_status,
     # Email
     "list_emails": list_emails,
+    "search_emails": email_index.search_emails,
     "send_email": send_email,
+    "send_emails": send_emails,
+    "get_mail_queue_status": mail_outbox.get_mail_queue_status,
     # Maps & Travel
     "get_travel_time": get_travel_time,
+    "get_travel_times": get_travel_times,
+    "get_day_itinerary": get_day_itinerary,
     # Weather
     "get_current_weather": get_current_weather,
     "get_weather_forecast": get_weather_forecast,
+    "get_weather_for_locations": get_weather_for_locations,
+    "get_day_weather": get_day_weather,
     # Timezone
     "convert_timezone": convert_timezone,
+    "convert_timezones": convert_timezones,
     # Calendar date-specific
     "list_events_on_date": list_events_on_date,
     "find_free_slots": find_free_slots,
+    "find_next_free_slots": find_next_free_slots,
     # To-do list
     "read_todo_list": read_todo_list,
     "append_todo_item": append_todo_item,
@@ -80,7 +108,21 @@ function_map = {
     "schedule_call": schedule_call,
     "list_scheduled_calls": list_scheduled_calls,
     "delete_scheduled_call": delete_scheduled_call,
-    "auto_schedule_calls": auto_schedule_calls
+    "auto_schedule_calls": auto_schedule_calls,
+    "find_call_slots": find_call_slots,
+    # Schedule reviews
+    "summarize_range": summarize_range,
+    "completion_stats": completion_stats,
+    # Recurring tasks
+    "add_recurring_task": add_recurring_task,
+    "list_recurring_tasks": list_recurring_tasks,
+    "update_recurring_task": update_recurring_task,
+    "delete_recurring_task": delete_recurring_task,
+    # History (journal storage)
+    "list_changes": list_changes,
+    "undo_last_change": undo_last_change,
+    "view_schedule_at": view_schedule_at,
+    "view_todo_list_at": view_todo_list_at
 }
 
 # Set India timezone and format today's date
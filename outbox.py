@@ -0,0 +1,310 @@
+"""
+outbox.py
+
+Durable outbox for Google Calendar mutations.
+
+Tools record inserts, patches and deletes here and return immediately; a
+background worker replays them in order through google_api. Redundant
+operations are coalesced before they are sent (an insert followed by a
+delete sends nothing, patches fold into a pending insert). Event IDs are
+generated client-side, so callers know them up front and replays are
+idempotent.
+"""
+import os
+import json
+import sqlite3
+import threading
+import time
+import google_api
+import calendar_store
+
+OUTBOX_DB = os.getenv("KAALA_OUTBOX_DB", "calendar_outbox.db")
+# In-flight operations older than this are assumed orphaned by a crash.
+STALE_CLAIM_SECONDS = 600
+RETRY_DELAY_MAX = 300
+
+_local = threading.local()
+_wakeup = threading.Event()
+_idle = threading.Event()
+_worker = None
+_worker_lock = threading.Lock()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ops (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    op TEXT NOT NULL,
+    calendar_id TEXT NOT NULL,
+    event_id TEXT NOT NULL,
+    body TEXT,
+    callback TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    claimed_at REAL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_ops_event ON ops (calendar_id, event_id, status);
+CREATE INDEX IF NOT EXISTS idx_ops_status ON ops (status, seq);
+"""
+
+
+def get_connection():
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(OUTBOX_DB, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+        _local.conn = conn
+    return conn
+
+
+def _merge(base, patch):
+    """Merge an event patch into a body, one level deep (start/end dicts)."""
+    merged = dict(base)
+    for key, value in patch.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = {**merged[key], **value}
+        else:
+            merged[key] = value
+    return merged
+
+
+def _apply_locally(op, calendar_id, event_id, body):
+    """Reflect a queued mutation in the local mirror so reads see it at once."""
+    if op == "delete":
+        calendar_store.remove_event(event_id, calendar_id)
+        return
+    current = calendar_store.get_event(event_id, calendar_id) or {"id": event_id}
+    calendar_store.upsert_event(_merge(current, body), calendar_id)
+
+
+def enqueue(op, calendar_id, event_id, body=None, callback=None):
+    """
+    Queue an "insert", "patch" or "delete" for an event and wake the worker.
+    Returns "queued", "coalesced" (folded into a pending operation) or
+    "cancelled" (a delete that annulled a pending insert).
+    """
+    conn = get_connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        pending = conn.execute(
+            "SELECT seq, op, body FROM ops WHERE calendar_id = ? AND event_id = ? AND status = 'pending' ORDER BY seq",
+            (calendar_id, event_id)
+        ).fetchall()
+        pending_insert = next((row for row in pending if row[1] == "insert"), None)
+        pending_patch = next((row for row in pending if row[1] == "patch"), None)
+        result = "queued"
+        if op == "delete" and pending_insert:
+            conn.execute(
+                "DELETE FROM ops WHERE calendar_id = ? AND event_id = ? AND status = 'pending'",
+                (calendar_id, event_id)
+            )
+            result = "cancelled"
+        elif op == "delete":
+            conn.execute(
+                "DELETE FROM ops WHERE calendar_id = ? AND event_id = ? AND status = 'pending' AND op = 'patch'",
+                (calendar_id, event_id)
+            )
+        elif op == "patch" and (pending_insert or pending_patch):
+            seq, _, pending_body = pending_insert or pending_patch
+            merged = _merge(json.loads(pending_body), body)
+            conn.execute("UPDATE ops SET body = ? WHERE seq = ?", (json.dumps(merged), seq))
+            result = "coalesced"
+        if result == "queued":
+            conn.execute(
+                "INSERT INTO ops (op, calendar_id, event_id, body, callback, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (op, calendar_id, event_id, json.dumps(body) if body is not None else None,
+                 json.dumps(callback) if callback else None, time.time())
+            )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    _apply_locally(op, calendar_id, event_id, body or {})
+    start_worker()
+    _wakeup.set()
+    return result
+
+
+def has_pending(event_id, calendar_id="primary"):
+    row = get_connection().execute(
+        "SELECT 1 FROM ops WHERE calendar_id = ? AND event_id = ? AND status IN ('pending', 'in_flight') LIMIT 1",
+        (calendar_id, event_id)
+    ).fetchone()
+    return row is not None
+
+
+def pending_events(calendar_ids=("primary",)):
+    """
+    (calendar_id, event) for events with an insert or patch not yet sent to
+    Google, as currently applied in the local mirror.
+    """
+    calendar_ids = list(calendar_ids)
+    rows = get_connection().execute(
+        f"SELECT DISTINCT calendar_id, event_id FROM ops WHERE op IN ('insert', 'patch') "
+        f"AND status IN ('pending', 'in_flight') AND calendar_id IN ({','.join('?' * len(calendar_ids))})",
+        calendar_ids
+    ).fetchall()
+    pending = []
+    for calendar_id, event_id in rows:
+        event = calendar_store.get_event(event_id, calendar_id)
+        if event is not None:
+            pending.append((calendar_id, event))
+    return pending
+
+
+def _claim_next():
+    conn = get_connection()
+    conn.execute(
+        "UPDATE ops SET status = 'pending' WHERE status = 'in_flight' AND claimed_at < ?",
+        (time.time() - STALE_CLAIM_SECONDS,)
+    )
+    row = conn.execute(
+        """
+        SELECT seq, op, calendar_id, event_id, body, callback, attempts FROM ops
+        WHERE status = 'pending' AND NOT EXISTS (
+            SELECT 1 FROM ops AS busy
+            WHERE busy.calendar_id = ops.calendar_id AND busy.event_id = ops.event_id
+              AND busy.status = 'in_flight'
+        )
+        ORDER BY seq LIMIT 1
+        """
+    ).fetchone()
+    if row is None:
+        return None
+    claimed = conn.execute(
+        "UPDATE ops SET status = 'in_flight', claimed_at = ? WHERE seq = ? AND status = 'pending'",
+        (time.time(), row[0])
+    ).rowcount
+    return row if claimed else _claim_next()
+
+
+def _send(op, calendar_id, event_id, body):
+    from google_calendar import get_calendar_service
+
+    service = get_calendar_service()
+    if op == "insert":
+        return google_api.insert_event(service, calendar_id, {**body, "id": event_id})
+    if op == "patch":
+        return google_api.execute(service.events().patch(calendarId=calendar_id, eventId=event_id, body=body))
+    try:
+        google_api.execute(service.events().delete(calendarId=calendar_id, eventId=event_id))
+    except Exception as e:
+        if google_api.error_status(e) not in (404, 410):
+            raise
+    return None
+
+
+def _restore_mirror(op, calendar_id, event_id):
+    """Undo the optimistic local change of an operation Google rejected."""
+    if op == "insert":
+        calendar_store.remove_event(event_id, calendar_id)
+        return
+    from google_calendar import get_calendar_service
+
+    try:
+        event = google_api.execute(get_calendar_service().events().get(calendarId=calendar_id, eventId=event_id))
+        calendar_store.upsert_event(event, calendar_id)
+    except Exception as e:
+        print(f"[outbox] Could not refresh {event_id} after a failed {op}: {e}")
+
+
+def _run_callback(callback, event, error):
+    if not callback:
+        return
+    callback = json.loads(callback)
+    if callback.get("kind") == "call":
+        from contacts import record_call_sync
+        record_call_sync(callback["call_id"], event, error)
+
+
+def replay_once():
+    """
+    Send the next queued operation. Returns False when the queue is empty or
+    the operation hit a transient error and should be retried later.
+    """
+    row = _claim_next()
+    if row is None:
+        return False
+    seq, op, calendar_id, event_id, body, callback, attempts = row
+    conn = get_connection()
+    try:
+        event = _send(op, calendar_id, event_id, json.loads(body) if body else None)
+    except Exception as e:
+        if google_api.is_retryable(e):
+            conn.execute(
+                "UPDATE ops SET status = 'pending', attempts = ?, last_error = ? WHERE seq = ?",
+                (attempts + 1, str(e), seq)
+            )
+            return False
+        conn.execute(
+            "UPDATE ops SET status = 'failed', attempts = ?, last_error = ? WHERE seq = ?",
+            (attempts + 1, str(e), seq)
+        )
+        _restore_mirror(op, calendar_id, event_id)
+        _run_callback(callback, None, str(e))
+        return True
+    conn.execute("DELETE FROM ops WHERE seq = ?", (seq,))
+    if event:
+        calendar_store.upsert_event(event, calendar_id)
+    _run_callback(callback, event, None)
+    return True
+
+
+def _worker_loop():
+    delay = 1
+    while True:
+        try:
+            while replay_once():
+                delay = 1
+        except Exception as e:
+            print(f"[outbox] Replay error: {e}")
+        if pending_count():
+            # Transient failure: back off, but wake early for new work.
+            _idle.clear()
+            _wakeup.wait(delay)
+            delay = min(delay * 2, RETRY_DELAY_MAX)
+        else:
+            _idle.set()
+            _wakeup.wait()
+        _wakeup.clear()
+
+
+def start_worker():
+    """Start the background replay thread if it is not running."""
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _idle.clear()
+            _worker = threading.Thread(target=_worker_loop, name="calendar-outbox", daemon=True)
+            _worker.start()
+
+
+def flush(timeout=30):
+    """Wake the worker and wait up to `timeout` seconds for the queue to drain."""
+    start_worker()
+    _idle.clear()
+    _wakeup.set()
+    return _idle.wait(timeout)
+
+
+def pending_count():
+    row = get_connection().execute(
+        "SELECT COUNT(*) FROM ops WHERE status IN ('pending', 'in_flight')"
+    ).fetchone()
+    return row[0]
+
+
+def get_outbox_status():
+    """Summarize queued and failed calendar changes."""
+    conn = get_connection()
+    pending = pending_count()
+    failed = conn.execute(
+        "SELECT seq, op, event_id, last_error FROM ops WHERE status = 'failed' ORDER BY seq"
+    ).fetchall()
+    out = f"🕒 {pending} calendar change(s) waiting to be sent to Google."
+    if failed:
+        out += f"\n⚠️ {len(failed)} change(s) failed:"
+        for seq, op, event_id, error in failed:
+            out += f"\n- #{seq} {op} {event_id}: {error}"
+    return out
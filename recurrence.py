@@ -0,0 +1,300 @@
+"""
+recurrence.py
+
+Recurring tasks ("standup every weekday at 10:00") stored once as a rule,
+using a subset of iCalendar RRULE: FREQ (DAILY, WEEKLY, MONTHLY, YEARLY),
+INTERVAL, BYDAY (plain weekdays), BYMONTHDAY, BYMONTH, COUNT and UNTIL.
+
+Occurrences are never written out. They are expanded only for the dates
+being read or summarized and cached per date; the cache is dropped as soon
+as any rule or exception changes. Completing, editing or skipping a single
+occurrence stores one exception record for that date, so storage grows with
+rules + exceptions rather than with days.
+"""
+import calendar
+import hashlib
+import re
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import datastore
+
+FREQS = ("DAILY", "WEEKLY", "MONTHLY", "YEARLY")
+WEEKDAYS = ("MO", "TU", "WE", "TH", "FR", "SA", "SU")
+TIME_PATTERN = re.compile(r"^\d{2}:\d{2}( - \d{2}:\d{2})?$")
+# Expanded dates kept in memory.
+OCCURRENCE_CACHE_SIZE = 128
+# COUNT rules are resolved to a last date by scanning at most this many days.
+MAX_COUNT_SCAN_DAYS = 366 * 50
+
+
+def parse_rrule(text):
+    """Parse "FREQ=WEEKLY;BYDAY=MO,WE" into a dict; raises ValueError for anything unsupported."""
+    text = text.strip().upper()
+    if text.startswith("RRULE:"):
+        text = text[len("RRULE:"):]
+    rule = {"freq": None, "interval": 1, "byday": None, "bymonthday": None, "bymonth": None,
+            "count": None, "until": None}
+    for part in filter(None, text.split(";")):
+        key, sep, value = part.partition("=")
+        if not sep or not value:
+            raise ValueError(f"'{part}' is not KEY=VALUE")
+        if key == "FREQ":
+            if value not in FREQS:
+                raise ValueError(f"FREQ must be one of {', '.join(FREQS)}")
+            rule["freq"] = value
+        elif key == "INTERVAL":
+            rule["interval"] = _positive(key, value)
+        elif key == "COUNT":
+            rule["count"] = _positive(key, value)
+        elif key == "BYDAY":
+            days = value.split(",")
+            unknown = [d for d in days if d not in WEEKDAYS]
+            if unknown:
+                raise ValueError(f"BYDAY supports plain weekdays ({','.join(WEEKDAYS)}), not {','.join(unknown)}")
+            rule["byday"] = sorted({WEEKDAYS.index(d) for d in days})
+        elif key == "BYMONTHDAY":
+            try:
+                days = [int(d) for d in value.split(",")]
+            except ValueError:
+                raise ValueError("BYMONTHDAY must be a list of day numbers")
+            if any(d == 0 or not -31 <= d <= 31 for d in days):
+                raise ValueError("BYMONTHDAY values must be 1..31 or -31..-1")
+            rule["bymonthday"] = sorted(set(days))
+        elif key == "BYMONTH":
+            try:
+                months = [int(m) for m in value.split(",")]
+            except ValueError:
+                raise ValueError("BYMONTH must be a list of month numbers")
+            if any(not 1 <= m <= 12 for m in months):
+                raise ValueError("BYMONTH values must be 1..12")
+            rule["bymonth"] = sorted(set(months))
+        elif key == "UNTIL":
+            rule["until"] = datetime.strptime(value.replace("-", "")[:8], "%Y%m%d").date().isoformat()
+        else:
+            raise ValueError(f"{key} is not supported")
+    if not rule["freq"]:
+        raise ValueError("FREQ is required")
+    if rule["count"] and rule["until"]:
+        raise ValueError("use COUNT or UNTIL, not both")
+    return rule
+
+
+def _positive(key, value):
+    if not value.isdigit() or int(value) < 1:
+        raise ValueError(f"{key} must be a positive integer")
+    return int(value)
+
+
+def _month_day_matches(day, month_days):
+    last = calendar.monthrange(day.year, day.month)[1]
+    return any(day.day == (d if d > 0 else last + d + 1) for d in month_days)
+
+
+def _matches(rule, start, day):
+    """Whether the rule, first occurring on `start`, generates `day` (ignoring COUNT/UNTIL)."""
+    if day < start:
+        return False
+    byday, bymonthday, bymonth, interval = rule["byday"], rule["bymonthday"], rule["bymonth"], rule["interval"]
+    if bymonth is not None and day.month not in bymonth:
+        return False
+    if byday is not None and day.weekday() not in byday:
+        return False
+    if bymonthday is not None and not _month_day_matches(day, bymonthday):
+        return False
+    freq = rule["freq"]
+    if freq == "DAILY":
+        return (day - start).days % interval == 0
+    if freq == "WEEKLY":
+        weeks = ((day - start).days + start.weekday() - day.weekday()) // 7
+        return weeks % interval == 0 and (byday is not None or day.weekday() == start.weekday())
+    expanded = byday is not None or bymonthday is not None
+    if freq == "MONTHLY":
+        months = (day.year - start.year) * 12 + day.month - start.month
+        return months % interval == 0 and (expanded or day.day == start.day)
+    # As in RFC 5545, YEARLY keeps the start month only when no BYMONTH,
+    # BYDAY or BYMONTHDAY says otherwise (BYDAY=MO is every Monday of the year).
+    years = day.year - start.year
+    return (years % interval == 0 and (expanded or day.day == start.day)
+            and (expanded or bymonth is not None or day.month == start.month))
+
+
+def _compile(record):
+    """A stored rule with its RRULE parsed and COUNT resolved to a last date."""
+    rule = parse_rrule(record["rrule"])
+    start = datetime.strptime(record["start"], "%Y-%m-%d").date()
+    until = datetime.strptime(rule["until"], "%Y-%m-%d").date() if rule["until"] else None
+    if rule["count"]:
+        day, seen = start, 0
+        for _ in range(MAX_COUNT_SCAN_DAYS):
+            if _matches(rule, start, day):
+                seen += 1
+                if seen == rule["count"]:
+                    break
+            day += timedelta(days=1)
+        until = day
+    return {**record, "parsed": rule, "first": start, "last": until}
+
+
+def _occurs(rule, day):
+    if rule["last"] and day > rule["last"]:
+        return False
+    return _matches(rule["parsed"], rule["first"], day)
+
+
+def occurrence_id(rule_id, date):
+    """Stable task ID of one occurrence, so it can be addressed like any other task."""
+    return hashlib.sha1(f"{rule_id}:{date}".encode()).hexdigest()[:6]
+
+
+_lock = threading.Lock()
+_state = {"version": None, "rules": {}, "exceptions": {}}
+_days = OrderedDict()
+
+
+def version():
+    """Changes whenever a rule or an exception is written."""
+    backend = datastore.get_backend()
+    return f"{backend.records_version('recurrences')}/{backend.records_version('occurrences')}"
+
+
+def _current():
+    """Compiled rules and exceptions, reloaded (dropping the day cache) only when they changed."""
+    global _state
+    current = version()
+    with _lock:
+        if _state["version"] == current:
+            return _state
+    backend = datastore.get_backend()
+    rules = {}
+    for record in backend.load_records("recurrences"):
+        try:
+            rules[record["id"]] = _compile(record)
+        except (KeyError, ValueError) as e:
+            print(f"[recurrence] Skipping rule {record.get('id')}: {e}")
+    exceptions = {(r["rule_id"], r["date"]): r for r in backend.load_records("occurrences")}
+    state = {"version": current, "rules": rules, "exceptions": exceptions}
+    with _lock:
+        _state = state
+        _days.clear()
+    return state
+
+
+def _expand(state, date, day):
+    found = []
+    for rule in state["rules"].values():
+        if not _occurs(rule, day):
+            continue
+        exception = state["exceptions"].get((rule["id"], date), {})
+        if exception.get("skip"):
+            continue
+        time = exception.get("time") or rule["time"]
+        text = exception.get("text") or rule["text"]
+        mark = "x" if exception.get("done") else " "
+        found.append((time, rule["id"], f"{time} | [{mark}] {text} ^{occurrence_id(rule['id'], date)}\n"))
+    found.sort()
+    return [(rule_id, line) for _, rule_id, line in found]
+
+
+def occurrences(date):
+    """(rule_id, schedule line) for every occurrence on `date`, sorted by time."""
+    state = _current()
+    with _lock:
+        if state is _state and date in _days:
+            _days.move_to_end(date)
+            return _days[date]
+    result = _expand(state, date, datetime.strptime(date, "%Y-%m-%d").date())
+    with _lock:
+        if state is _state:
+            _days[date] = result
+            while len(_days) > OCCURRENCE_CACHE_SIZE:
+                _days.popitem(last=False)
+    return result
+
+
+def occurrence_dates(start, end):
+    """Dates in [start, end] with at least one occurrence that is not skipped."""
+    state = _current()
+    day = datetime.strptime(start, "%Y-%m-%d").date()
+    last = datetime.strptime(end, "%Y-%m-%d").date()
+    dates = set()
+    while day <= last:
+        date = day.isoformat()
+        if any(_occurs(rule, day) and not state["exceptions"].get((rule["id"], date), {}).get("skip")
+               for rule in state["rules"].values()):
+            dates.add(date)
+        day += timedelta(days=1)
+    return dates
+
+
+def set_exception(rule_id, date, **changes):
+    """Override one occurrence: done, skip, time and/or text for that date only."""
+    backend = datastore.get_backend()
+    key = f"{rule_id}:{date}"
+    if not backend.update_record("occurrences", key, changes):
+        backend.insert_records("occurrences", [{"key": key, "rule_id": rule_id, "date": date, **changes}])
+
+
+def _validate(time, rrule, start_date):
+    if time is not None and not TIME_PATTERN.match(time):
+        return "❌ Time must be HH:MM or HH:MM - HH:MM."
+    try:
+        if rrule is not None:
+            parse_rrule(rrule)
+        if start_date is not None:
+            datetime.strptime(start_date, "%Y-%m-%d")
+    except ValueError as e:
+        return f"❌ Invalid recurrence: {e}"
+    return None
+
+
+def add_recurring_task(task: str, time: str, rrule: str, start_date: str = None):
+    """Define a task that repeats by an RRULE, e.g. "FREQ=WEEKLY;BYDAY=MO,TU,WE,TH,FR"."""
+    error = _validate(time, rrule, start_date)
+    if error:
+        return error
+    rule = {
+        "id": uuid.uuid4().hex[:8],
+        "text": task.strip(),
+        "time": time,
+        "rrule": rrule.strip().upper(),
+        "start": start_date or datetime.now().strftime("%Y-%m-%d"),
+    }
+    datastore.get_backend().insert_records("recurrences", [rule])
+    return f"🔁 Added recurring task '{rule['text']}' at {time} ({rule['rrule']} from {rule['start']}), id {rule['id']}."
+
+
+def list_recurring_tasks():
+    rules = datastore.get_backend().load_records("recurrences")
+    if not rules:
+        return "No recurring tasks."
+    out = "🔁 Recurring tasks:"
+    for rule in rules:
+        out += f"\n- {rule['id']}: {rule['time']} {rule['text']} ({rule['rrule']} from {rule['start']})"
+    return out
+
+
+def update_recurring_task(rule_id: str, task: str = None, time: str = None, rrule: str = None,
+                          start_date: str = None):
+    """Change a rule; occurrences already completed or overridden keep their exceptions."""
+    error = _validate(time, rrule, start_date)
+    if error:
+        return error
+    changes = {"text": task and task.strip(), "time": time, "rrule": rrule and rrule.strip().upper(), "start": start_date}
+    changes = {k: v for k, v in changes.items() if v}
+    if not changes:
+        return "⚠️ Nothing to update."
+    if not datastore.get_backend().update_record("recurrences", rule_id, changes):
+        return f"❌ No recurring task with id {rule_id}."
+    return f"🔁 Updated recurring task {rule_id}."
+
+
+def delete_recurring_task(rule_id: str):
+    """Remove a rule and all of its per-date exceptions."""
+    backend = datastore.get_backend()
+    if not backend.delete_record("recurrences", rule_id):
+        return f"❌ No recurring task with id {rule_id}."
+    for exception in backend.find_records("occurrences", rule_id=rule_id):
+        backend.delete_record("occurrences", exception["key"])
+    return f"🗑️ Deleted recurring task {rule_id}."
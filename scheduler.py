@@ -1,85 +1,515 @@
 # scheduler.py
 
 import os
-from datetime import datetime
+import re
+import threading
+import uuid
+from difflib import SequenceMatcher
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import datastore
+import recurrence
+import storage
 
-SCHEDULE_DIR = "schedules"
+SCHEDULE_DIR = datastore.SCHEDULE_DIR
 os.makedirs(SCHEDULE_DIR, exist_ok=True)
+# Number of parsed day files kept in memory.
+SCHEDULE_CACHE_SIZE = 64
+# Tasks and to-do items end in a stable ID, e.g. "09:00 | [ ] Standup ^3f9a1c".
+TASK_ID_PATTERN = re.compile(r"\s\^([0-9a-f]{6})\s*$")
+MATCH_MODES = ("exact", "prefix", "fuzzy")
+FUZZY_CUTOFF = 0.6
+
+
+class Task:
+    """One "HH:MM - HH:MM | [ ] text" line of a day file, or an occurrence of a recurring rule."""
+    __slots__ = ("start", "end", "done", "text", "lineno", "id", "rule")
+
+    def __init__(self, start, end, done, text, lineno, id=None, rule=None):
+        self.start = start
+        self.end = end
+        self.done = done
+        self.text = text
+        self.lineno = lineno
+        self.id = id
+        self.rule = rule
+
+    def time(self):
+        return f"{self.start} - {self.end}" if self.end else self.start
+
+    def minutes(self):
+        """Planned length from "HH:MM - HH:MM", or 0 if the line has no end time."""
+        try:
+            start = datetime.strptime(self.start, "%H:%M")
+            end = datetime.strptime(self.end, "%H:%M")
+        except (TypeError, ValueError):
+            return 0
+        return max(0, int((end - start).total_seconds() // 60))
+
+
+class DaySchedule:
+    """
+    Parsed day: the day file's lines plus the day's recurring occurrences,
+    which are slotted in by start time. `text` is the merged view; `lines`
+    and task.lineno refer to the file alone.
+    """
+    __slots__ = ("text", "lines", "tasks", "blocks", "version", "ids", "rules_version", "occurrence_lines")
+
+    def __init__(self, text, version=None, occurrences=(), rules_version=None):
+        self.version = version
+        self.rules_version = rules_version
+        self.lines = text.splitlines(keepends=True)
+        self.tasks = []
+        self.blocks = []
+        # Task ID -> position in self.tasks.
+        self.ids = {}
+        self.occurrence_lines = {}
+        merged = []
+        pending = list(occurrences)
+        for lineno, line in enumerate(self.lines):
+            task = _parse_task(line, lineno)
+            while pending and task and task.start and (_parse_task(pending[0][1], None).start or "") < task.start:
+                merged.append(self._occurrence(*pending.pop(0)))
+            merged.append((line, task))
+        if pending and merged and not merged[-1][0].endswith("\n"):
+            merged[-1] = (merged[-1][0] + "\n", merged[-1][1])
+        merged.extend(self._occurrence(*item) for item in pending)
+        for line, task in merged:
+            if " | " in line:
+                self.blocks.append(line.split(" | ")[0])
+            if task:
+                if task.id:
+                    self.ids[task.id] = len(self.tasks)
+                self.tasks.append(task)
+        self.text = "".join(line for line, _ in merged)
+
+    def _occurrence(self, rule_id, line):
+        task = _parse_task(line, None)
+        task.rule = rule_id
+        self.occurrence_lines[task.id] = line
+        return line, task
+
+    def task_line(self, task):
+        return self.occurrence_lines[task.id] if task.rule else self.lines[task.lineno]
+
+    def next_open_task(self):
+        return next((t for t in self.tasks if not t.done), None)
+
+    def summary(self):
+        return {
+            "total": len(self.tasks),
+            "done": sum(1 for t in self.tasks if t.done),
+            "planned_minutes": sum(t.minutes() for t in self.tasks),
+        }
+
+
+def _parse_task(line, lineno):
+    for marker, done in (("| [x]", True), ("| [ ]", False)):
+        index = line.find(marker)
+        if index != -1:
+            break
+    else:
+        return None
+    times = line[:index].strip()
+    start, _, end = (part.strip() for part in times.partition(" - "))
+    text, task_id = split_task_id(line[index + len(marker):])
+    return Task(start or None, end or None, done, text, lineno, task_id)
+
+
+def split_task_id(text):
+    """Split "text ^id" into (text, id); id is None for untagged lines."""
+    match = TASK_ID_PATTERN.search(text)
+    if not match:
+        return text.strip(), None
+    return text[:match.start()].strip(), match.group(1)
+
+
+def new_task_id(taken=()):
+    while True:
+        task_id = uuid.uuid4().hex[:6]
+        if task_id not in taken:
+            return task_id
+
+
+def _tag(line, taken):
+    """Append a fresh ID to a line, keeping its line ending."""
+    body = line.rstrip("\r\n")
+    task_id = new_task_id(taken)
+    taken.add(task_id)
+    return f"{body} ^{task_id}{line[len(body):]}"
+
+
+def with_task_ids(text):
+    """Schedule text with an ID on every task line."""
+    lines = text.splitlines(keepends=True)
+    tasks = [(i, _parse_task(line, i)) for i, line in enumerate(lines)]
+    taken = {task.id for _, task in tasks if task and task.id}
+    for i, task in tasks:
+        if task and not task.id:
+            lines[i] = _tag(lines[i], taken)
+    return "".join(lines)
+
+
+def with_item_ids(lines):
+    """To-do lines with an ID on every "[ ]"/"[x]" item."""
+    taken = {split_task_id(line)[1] for line in lines} - {None}
+    return [
+        _tag(line, taken) if line.startswith(("[ ]", "[x]")) and not split_task_id(line)[1] else line
+        for line in lines
+    ]
+
+
+def match_items(items, query, match="exact"):
+    """
+    Items (anything with .text) matching query, case-insensitively:
+    "exact" compares the whole text, "prefix" its start, and "fuzzy" returns
+    the closest text(s) by similarity ratio.
+    """
+    needle = query.strip().casefold()
+    if match == "exact":
+        return [item for item in items if item.text.casefold() == needle]
+    if match == "prefix":
+        return [item for item in items if item.text.casefold().startswith(needle)]
+    scored = [(SequenceMatcher(None, needle, item.text.casefold()).ratio(), item) for item in items]
+    best = max((score for score, _ in scored), default=0)
+    if best < FUZZY_CUTOFF:
+        return []
+    return [item for score, item in scored if score == best]
+
+
+def resolve_item(items, query=None, match="exact", item_id=None, kind="task"):
+    """
+    Pick exactly one item by ID or by text. Returns (item, None) or
+    (None, message) when nothing or more than one item matches.
+    """
+    if item_id:
+        found = [item for item in items if item.id == item_id]
+    elif query:
+        if match not in MATCH_MODES:
+            return None, f"⚠️ match must be one of: {', '.join(MATCH_MODES)}."
+        found = match_items(items, query, match)
+    else:
+        return None, f"⚠️ Give the {kind} text or its id."
+    if not found:
+        return None, f"{kind.capitalize()} not found."
+    if len(found) > 1:
+        options = "; ".join(f"'{item.text}' (id {item.id})" for item in found)
+        return None, f"⚠️ '{query}' matches {len(found)} {kind}s: {options}. Use the id or a more specific text."
+    return found[0], None
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _invalidate(date):
+    with _cache_lock:
+        _cache.pop(date, None)
+
+
+def load_day(date: str, create: bool = True) -> DaySchedule:
+    """
+    Parsed schedule for a date, creating an empty one if missing (or
+    returning None when create is False and nothing recurs that day).
+    Cached per date and revalidated against the backend's version (a stat
+    or one indexed lookup) and the recurrence rules' version, so an
+    unchanged day is never re-read or re-expanded.
+    """
+    if create:
+        create_schedule_if_missing(date)
+    backend = datastore.get_backend()
+    version = backend.day_version(date)
+    rules_version = recurrence.version()
+    with _cache_lock:
+        entry = _cache.get(date)
+        if entry and entry.version == version and entry.rules_version == rules_version:
+            _cache.move_to_end(date)
+            return entry
+    occurrences = recurrence.occurrences(date)
+    if version is None and not create and not occurrences:
+        return None
+    text, version = backend.read_day(date) if version is not None else ("", None)
+    day = DaySchedule(text or "", version, occurrences, rules_version)
+    with _cache_lock:
+        _cache[date] = day
+        _cache.move_to_end(date)
+        while len(_cache) > SCHEDULE_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return day
+
 
 def get_schedule_path(date: str) -> str:
     return os.path.join(SCHEDULE_DIR, f"{date}.txt")
 
 def create_schedule_if_missing(date: str):
-    path = get_schedule_path(date)
-    if not os.path.exists(path):
-        with open(path, "w") as f:
-            f.write(f"# Schedule for {date}\n\n")
-            f.write("09:00 - 10:00 | [ ] Morning routine\n")
-            f.write("10:00 - 12:00 | [ ] Deep work session\n")
-            f.write("14:00 - 15:00 | [ ] Learn something new\n")
-        return f"Created new schedule for {date}."
-    return None
+    backend = datastore.get_backend()
+    if backend.day_version(date) is not None:
+        return None
+    # Repeating tasks come from recurrence rules, expanded when the day is read.
+    created = backend.create_day(date, f"# Schedule for {date}\n\n")
+    if not created:
+        return None
+    _invalidate(date)
+    return f"Created new schedule for {date}."
 
 def read_schedule(date: str):
-    create_schedule_if_missing(date)
-    path = get_schedule_path(date)
-    with open(path, "r") as f:
-        return f.read()
-
-def update_schedule(date: str, new_content: str):
-    path = get_schedule_path(date)
-    with open(path, "w") as f:
-        f.write(new_content)
+    return load_day(date).text
+
+def _split_occurrences(date, text):
+    """
+    Separate recurring occurrences from replacement day text. Returns the
+    text to store and the per-occurrence changes it implies; an occurrence
+    left out of the text is skipped for that date.
+    """
+    occurrences = {}
+    for rule_id, line in recurrence.occurrences(date):
+        task = _parse_task(line, None)
+        occurrences[task.id] = (rule_id, task)
+    kept, changes = [], []
+    for line in text.splitlines(keepends=True):
+        task = _parse_task(line, None)
+        if not task or task.id not in occurrences:
+            kept.append(line)
+            continue
+        rule_id, old = occurrences.pop(task.id)
+        changed = {key: new for key, new, before in (
+            ("done", task.done, old.done), ("text", task.text, old.text), ("time", task.time(), old.time())
+        ) if new != before}
+        if changed:
+            changes.append((rule_id, changed))
+    changes.extend((rule_id, {"skip": True}) for rule_id, _ in occurrences.values())
+    return "".join(kept), changes
+
+def update_schedule(date: str, new_content: str, expected_version: str = None):
+    """Replace a day's schedule; with expected_version, refuse if it changed since read."""
+    new_content, changes = _split_occurrences(date, new_content)
+    try:
+        datastore.get_backend().write_day(date, with_task_ids(new_content), expected_version)
+    except storage.VersionConflict:
+        return f"⚠️ Schedule for {date} changed since it was read; reload it and try again."
+    for rule_id, changed in changes:
+        recurrence.set_exception(rule_id, date, **changed)
+    _invalidate(date)
     return f"Updated schedule for {date}."
 
 def append_task(date: str, time: str, task: str):
-    path = get_schedule_path(date)
-    line = f"{time} | [ ] {task}\n"
-    with open(path, "a") as f:
-        f.write(line)
-    return f"Appended task to {date}: {task}"
-
-def mark_task_done(date: str, task_text: str):
-    path = get_schedule_path(date)
-    if not os.path.exists(path):
-        return "Schedule not found."
-    with open(path, "r") as f:
-        lines = f.readlines()
-    updated = []
-    found = False
-    for line in lines:
-        if task_text in line and "[ ]" in line:
-            updated.append(line.replace("[ ]", "[x]"))
-            found = True
-        else:
-            updated.append(line)
-    with open(path, "w") as f:
-        f.writelines(updated)
-    return "Task marked as done." if found else "Task not found."
+    day = load_day(date, create=False)
+    task_id = new_task_id(day.ids if day else ())
+    datastore.get_backend().append_line(date, f"{time} | [ ] {task} ^{task_id}\n")
+    _invalidate(date)
+    return f"Appended task to {date}: {task} (id {task_id})"
+
+def _find_task(date, task_text, match, task_id, open_only=False):
+    """Resolve one task of a day; returns (day, task, error)."""
+    day = load_day(date, create=False)
+    if day is None:
+        return None, None, "Schedule not found."
+    if any(not t.id for t in day.tasks):
+        # Legacy day: tag its tasks once so they can be addressed by ID.
+        datastore.get_backend().assign_task_ids(date)
+        _invalidate(date)
+        day = load_day(date, create=False)
+    tasks = day.tasks
+    if open_only and not task_id:
+        # Prefer open tasks so a finished namesake does not make the text ambiguous.
+        tasks = [t for t in tasks if not t.done] or tasks
+    task, error = resolve_item(tasks, task_text, match, task_id)
+    return day, task, error
+
+def _task_line(day, task, time=None, text=None, done=None):
+    line = day.task_line(task)
+    body = line.rstrip("\r\n")
+    marker = body.find("| [")
+    times = time if time is not None else body[:marker].strip()
+    done = task.done if done is None else done
+    return f"{times} | [{'x' if done else ' '}] {text or task.text} ^{task.id}{line[len(body):]}"
+
+def _replace_task(date, task, new_line):
+    found = datastore.get_backend().replace_task(date, task.id, new_line, hint=task.lineno)
+    _invalidate(date)
+    return found
+
+def mark_task_done(date: str, task_text: str = None, match: str = "exact", task_id: str = None):
+    """Tick one task, chosen by id or by text (match: exact, prefix or fuzzy)."""
+    day, task, error = _find_task(date, task_text, match, task_id, open_only=True)
+    if error:
+        return error
+    if task.done:
+        return f"Task '{task.text}' is already done."
+    if task.rule:
+        recurrence.set_exception(task.rule, date, done=True)
+    elif not _replace_task(date, task, _task_line(day, task, done=True)):
+        return "Task not found."
+    return "Task marked as done."
+
+def update_task(date: str, task_text: str = None, new_text: str = None, time: str = None,
+                match: str = "exact", task_id: str = None):
+    """Change one task's text and/or time block, keeping its id."""
+    day, task, error = _find_task(date, task_text, match, task_id)
+    if error:
+        return error
+    if task.rule:
+        changes = {key: value for key, value in (("time", time), ("text", new_text)) if value}
+        recurrence.set_exception(task.rule, date, **changes)
+    elif not _replace_task(date, task, _task_line(day, task, time=time, text=new_text)):
+        return "Task not found."
+    return f"Updated task {task.id} on {date}."
+
+def delete_task(date: str, task_text: str = None, match: str = "exact", task_id: str = None):
+    """Remove one task from a day's schedule."""
+    day, task, error = _find_task(date, task_text, match, task_id)
+    if error:
+        return error
+    if task.rule:
+        recurrence.set_exception(task.rule, date, skip=True)
+        return f"Skipped recurring task '{task.text}' on {date}."
+    if not _replace_task(date, task, None):
+        return "Task not found."
+    return f"Deleted task '{task.text}' from {date}."
 
 def summarize_schedule(date: str):
-    schedule = read_schedule(date)
-    lines = schedule.splitlines()
-    total = sum(1 for l in lines if "| [ ]" in l or "| [x]" in l)
-    done = sum(1 for l in lines if "| [x]" in l)
-    return f"{done}/{total} tasks completed."
+    tasks = load_day(date).tasks
+    done = sum(1 for t in tasks if t.done)
+    return f"{done}/{len(tasks)} tasks completed."
 
 def list_time_blocks(date: str):
-    schedule = read_schedule(date)
-    blocks = [line.split(" | ")[0] for line in schedule.splitlines() if " | " in line]
-    return "Scheduled time blocks:\n" + "\n".join(blocks)
+    return "Scheduled time blocks:\n" + "\n".join(load_day(date).blocks)
 
 def suggest_next_task(date: str):
-    schedule = read_schedule(date)
-    for line in schedule.splitlines():
-        if "| [ ]" in line:
-            return f"Next task: {line.strip()}"
+    day = load_day(date)
+    task = day.next_open_task()
+    if task:
+        return f"Next task: {day.task_line(task).strip()}"
     return "All tasks completed!"
 
 def delete_schedule(date: str):
-    path = get_schedule_path(date)
-    if os.path.exists(path):
-        os.remove(path)
-        return f"Deleted schedule for {date}."
-    return "Schedule not found."
+    if not datastore.get_backend().delete_day(date):
+        return "Schedule not found."
+    _invalidate(date)
+    return f"Deleted schedule for {date}."
+
+
+# Range queries. Per-day summaries are kept in a small index keyed by day
+# version (plus the rules' version on days with recurring tasks), so only
+# days that changed since the last query are re-parsed.
+SUMMARY_INDEX = os.path.join(SCHEDULE_DIR, ".summary_index.json")
+GRANULARITIES = ("day", "week", "month")
+
+
+def _day_summaries(start: str, end: str):
+    """{date: summary} for every scheduled or recurring day in [start, end], without creating any."""
+    versions = datastore.get_backend().day_versions(start, end)
+    rules_version = recurrence.version()
+    recurring = recurrence.occurrence_dates(start, end)
+    keys = {
+        date: f"{versions.get(date)}+{rules_version}" if date in recurring else versions[date]
+        for date in sorted(set(versions) | recurring)
+    }
+    with storage.file_lock(SUMMARY_INDEX):
+        index = storage.load_json(SUMMARY_INDEX, {})
+        if index.get("backend") != datastore.STORAGE_BACKEND:
+            index = {"backend": datastore.STORAGE_BACKEND, "days": {}}
+        days = index["days"]
+        changed = False
+        summaries = {}
+        for date, key in keys.items():
+            entry = days.get(date)
+            if not entry or entry["version"] != key:
+                day = load_day(date, create=False)
+                if day is None:
+                    continue
+                entry = {"version": key, **day.summary()}
+                days[date] = entry
+                changed = True
+            summaries[date] = entry
+        for date in [d for d in days if start <= d <= end and d not in keys]:
+            del days[date]
+            changed = True
+        if changed:
+            storage.save_json(SUMMARY_INDEX, index)
+    return summaries
+
+
+def _streaks(start: str, end: str, summaries):
+    """(longest, current) runs of consecutive fully completed days up to `end`."""
+    longest = current = 0
+    day = datetime.strptime(start, "%Y-%m-%d").date()
+    last = datetime.strptime(end, "%Y-%m-%d").date()
+    while day <= last:
+        s = summaries.get(day.isoformat())
+        if s and s["total"] and s["done"] == s["total"]:
+            current += 1
+            longest = max(longest, current)
+        else:
+            current = 0
+        day += timedelta(days=1)
+    return longest, current
+
+
+def _bucket(date: str, granularity: str):
+    if granularity == "day":
+        return date
+    if granularity == "month":
+        return date[:7]
+    year, week, _ = datetime.strptime(date, "%Y-%m-%d").isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def _percent(done, total):
+    return f"{round(100 * done / total)}%" if total else "n/a"
+
+
+def _validate_range(start: str, end: str):
+    try:
+        if datetime.strptime(start, "%Y-%m-%d") > datetime.strptime(end, "%Y-%m-%d"):
+            return "⚠️ Start date must not be after end date."
+    except ValueError:
+        return "❌ Dates must be YYYY-MM-DD."
+    return None
+
+def summarize_range(start: str, end: str):
+    """Completion and planned hours per scheduled day in [start, end], with totals and streaks."""
+    error = _validate_range(start, end)
+    if error:
+        return error
+    summaries = _day_summaries(start, end)
+    if not summaries:
+        return f"No schedules between {start} and {end}."
+    total = sum(s["total"] for s in summaries.values())
+    done = sum(s["done"] for s in summaries.values())
+    minutes = sum(s["planned_minutes"] for s in summaries.values())
+    longest, current = _streaks(start, end, summaries)
+    out = (
+        f"📊 {start} to {end}: {done}/{total} tasks completed ({_percent(done, total)}) "
+        f"across {len(summaries)} scheduled day(s), {minutes / 60:.1f} planned hours. "
+        f"Longest streak: {longest} day(s); current streak: {current} day(s)."
+    )
+    for date, s in summaries.items():
+        out += f"\n- {date}: {s['done']}/{s['total']} done, {s['planned_minutes'] / 60:.1f}h planned"
+    return out
 
+def completion_stats(start: str, end: str, granularity: str = "week"):
+    """Completion counts and planned hours in [start, end], grouped by day, week or month."""
+    if granularity not in GRANULARITIES:
+        return f"⚠️ Granularity must be one of: {', '.join(GRANULARITIES)}."
+    error = _validate_range(start, end)
+    if error:
+        return error
+    summaries = _day_summaries(start, end)
+    if not summaries:
+        return f"No schedules between {start} and {end}."
+    buckets = OrderedDict()
+    for date, s in summaries.items():
+        bucket = buckets.setdefault(_bucket(date, granularity), {"days": 0, "total": 0, "done": 0, "planned_minutes": 0})
+        bucket["days"] += 1
+        for key in ("total", "done", "planned_minutes"):
+            bucket[key] += s[key]
+    longest, current = _streaks(start, end, summaries)
+    out = f"📈 Completion by {granularity}, {start} to {end}:"
+    for name, b in buckets.items():
+        out += (
+            f"\n- {name}: {b['done']}/{b['total']} tasks ({_percent(b['done'], b['total'])}), "
+            f"{b['planned_minutes'] / 60:.1f}h planned over {b['days']} day(s)"
+        )
+    out += f"\nLongest streak: {longest} day(s); current streak: {current} day(s)."
+    return out
@@ -6,17 +6,38 @@ except ImportError:
     _DDGS_AVAILABLE = False
     print("[Warning] 'duckduckgo_search' library not found; falling back to manual HTML scraping for text searches.")
 import json
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, BrokenExecutor, wait, FIRST_COMPLETED
 import requests
+from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup
 from urllib.parse import urlparse, parse_qs, unquote
 
+# Per-request (connect, read) timeout for result pages.
+FETCH_TIMEOUT = (3.05, 5)
+# Wall-clock budget for fetching and parsing all result pages; pages not
+# ready by then are returned empty.
+SEARCH_DEADLINE = 8
+FETCH_WORKERS = 8
+PARSE_WORKERS = 2
+
+_session = requests.Session()
+_session.headers["User-Agent"] = "Mozilla/5.0"
+_session.mount("https://", HTTPAdapter(pool_connections=FETCH_WORKERS, pool_maxsize=FETCH_WORKERS))
+_session.mount("http://", HTTPAdapter(pool_connections=FETCH_WORKERS, pool_maxsize=FETCH_WORKERS))
+_fetch_pool = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix="search-fetch")
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
 def manual_text_search(query, num_results):
     """Fallback text search using DuckDuckGo HTML scraping."""
     search_url = "https://html.duckduckgo.com/html/"
     params = {"q": query}
     headers = {"User-Agent": "Mozilla/5.0"}
     try:
-        resp = requests.get(search_url, params=params, timeout=10, headers=headers)
+        resp = _session.get(search_url, params=params, timeout=10, headers=headers)
         resp.raise_for_status()
         soup = BeautifulSoup(resp.text, "html.parser")
         anchors = soup.find_all("a", class_="result__a", href=True)
@@ -128,7 +149,7 @@ class DuckDuckGoSearchManager:
         for url in links:
             if any(site in url for site in priority_sites):
                 try:
-                    resp = requests.get(url, timeout=5, headers=self.headers)
+                    resp = _session.get(url, timeout=FETCH_TIMEOUT, headers=self.headers)
                     soup = BeautifulSoup(resp.text, 'html.parser')
                     text = soup.get_text(separator="\n")
 
@@ -148,7 +169,7 @@ class DuckDuckGoSearchManager:
         results = self.text_search(query, num_results=3)
         for url in results:
             try:
-                response = requests.get(url, timeout=5, headers=self.headers)
+                response = _session.get(url, timeout=FETCH_TIMEOUT, headers=self.headers)
                 soup = BeautifulSoup(response.text, 'html.parser')
                 paragraphs = soup.find_all('p')
                 for para in paragraphs:
@@ -163,44 +184,108 @@ class DuckDuckGoSearchManager:
         return search_internet(query + " event time and location", num_results=3)
 
 
-def search_internet(query: str, num_results: int = 5) -> list:
-    print(f"[search_internet] Searching DuckDuckGo for: {query}")
-    ddg = DuckDuckGoSearchManager()
-    urls = ddg.text_search(query, num_results=num_results)
+def _fetch_page(url):
+    response = _session.get(url, timeout=FETCH_TIMEOUT)
+    response.raise_for_status()
+    return response.text
 
-    final_results = []
-    headers = {"User-Agent": "Mozilla/5.0"}
 
-    for url in urls:
-        try:
-            response = requests.get(url, timeout=5, headers=headers)
-            response.raise_for_status()
-            soup = BeautifulSoup(response.text, 'html.parser')
+def parse_page(url, html):
+    """Title and visible text of a page. Runs in the parse process pool."""
+    soup = BeautifulSoup(html, 'html.parser')
 
-            # Remove script and style elements
-            for tag in soup(["script", "style"]):
-                tag.decompose()
+    # Remove script and style elements
+    for tag in soup(["script", "style"]):
+        tag.decompose()
 
-            # Extract visible text content
-            content = soup.get_text(separator="\n", strip=True)
-            title = soup.title.string.strip() if soup.title and soup.title.string else url
+    # Extract visible text content
+    content = soup.get_text(separator="\n", strip=True)
+    title = soup.title.string.strip() if soup.title and soup.title.string else url
+    return {"title": title, "url": url, "content": content}
 
-            final_results.append({
-                "title": title,
-                "url": url,
-                "content": content
-            })
 
-        except Exception as e:
-            print(f"[search_internet] Error scraping {url}: {e}")
-            final_results.append({
-                "title": url,
-                "url": url,
-                "content": ""
-            })
+def _get_parse_pool():
+    """
+    Process pool for HTML parsing, so BeautifulSoup's CPU time runs in
+    parallel instead of behind the GIL. Falls back to the fetch threads
+    where processes cannot be started.
+    """
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            try:
+                # Forking this multi-threaded process could copy a lock held by
+                # another thread into the child; forkserver children start clean
+                # and import parse_page from this module (spawn where forkserver
+                # is unavailable, e.g. Windows).
+                method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+                _parse_pool = ProcessPoolExecutor(
+                    max_workers=PARSE_WORKERS, mp_context=multiprocessing.get_context(method)
+                )
+            except (OSError, NotImplementedError, ImportError) as e:
+                print(f"[search_internet] Parsing in threads, no process pool: {e}")
+                _parse_pool = _fetch_pool
+        return _parse_pool
 
-    return final_results
 
+def _reset_parse_pool(pool):
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is pool and pool is not _fetch_pool:
+            _parse_pool = None
+            pool.shutdown(wait=False, cancel_futures=True)
 
 
+def search_internet(query: str, num_results: int = 5, deadline: float = SEARCH_DEADLINE) -> list:
+    """
+    Search and return the title and text of each result page. Pages are
+    fetched concurrently and parsed in a process pool; whatever is not ready
+    after `deadline` seconds comes back with empty content.
+    """
+    print(f"[search_internet] Searching DuckDuckGo for: {query}")
+    ddg = DuckDuckGoSearchManager()
+    urls = ddg.text_search(query, num_results=num_results)
+
+    stop = time.monotonic() + deadline
+    final_results = [{"title": url, "url": url, "content": ""} for url in urls]
+    fetches = {_fetch_pool.submit(_fetch_page, url): i for i, url in enumerate(urls)}
+    parses = {}
+    pending = set(fetches)
+    parse_pool = _get_parse_pool() if urls else None
 
+    while pending:
+        remaining = stop - time.monotonic()
+        if remaining <= 0:
+            break
+        done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future in fetches:
+                i = fetches[future]
+                try:
+                    html = future.result()
+                except Exception as e:
+                    print(f"[search_internet] Error scraping {urls[i]}: {e}")
+                    continue
+                try:
+                    parse = parse_pool.submit(parse_page, urls[i], html)
+                except RuntimeError:
+                    # The pool broke or was shut down; parse this page in a thread.
+                    _reset_parse_pool(parse_pool)
+                    parse_pool = _get_parse_pool()
+                    parse = _fetch_pool.submit(parse_page, urls[i], html)
+                parses[parse] = i
+                pending.add(parse)
+            else:
+                i = parses[future]
+                try:
+                    final_results[i] = future.result()
+                except Exception as e:
+                    if isinstance(e, BrokenExecutor):
+                        _reset_parse_pool(parse_pool)
+                    print(f"[search_internet] Error parsing {urls[i]}: {e}")
+
+    if pending:
+        print(f"[search_internet] Deadline reached; {len(pending)} page(s) left unread.")
+        for future in pending:
+            future.cancel()
+    return final_results
@@ -0,0 +1,158 @@
+"""
+storage.py
+
+Crash-safe file storage shared by the scheduler, to-do and contacts modules.
+
+Writes go to a temporary file in the same directory, are fsynced and then
+renamed over the target, so readers see either the old or the new file and
+never a torn one. Read-modify-write sequences hold an advisory lock on a
+sibling ".<name>.lock" file (reentrant within a thread), which serializes
+writers across processes such as several uvicorn workers and the CLI.
+Every replaced file gets a new inode, so (inode, mtime, size) works as a
+cheap version for optimistic checks.
+"""
+import os
+import json
+import threading
+import time
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process locking only.
+    fcntl = None
+
+
+class VersionConflict(Exception):
+    """The file changed since the caller read it."""
+
+
+_locks = {}
+_locks_guard = threading.Lock()
+_held = threading.local()
+
+
+def lock_path(path):
+    directory, name = os.path.split(os.path.abspath(path))
+    return os.path.join(directory, f".{name}.lock")
+
+
+@contextmanager
+def file_lock(path):
+    """Exclusive advisory lock on `path`; nested use in one thread is a no-op."""
+    path = os.path.abspath(path)
+    with _locks_guard:
+        lock = _locks.setdefault(path, threading.RLock())
+    held = _held.__dict__.setdefault("depth", {})
+    with lock:
+        if held.get(path):
+            held[path] += 1
+            try:
+                yield
+            finally:
+                held[path] -= 1
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(lock_path(path), "a") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            held[path] = 1
+            try:
+                yield
+            finally:
+                held[path] = 0
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def file_version(path):
+    """Opaque version of a file's current contents, or None if it is missing."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return f"{st.st_ino}-{st.st_mtime_ns}-{st.st_size}"
+
+
+def atomic_write(path, data, expected_version=None):
+    """
+    Replace `path` with `data` (str or bytes) via temp file, fsync and rename.
+    With expected_version, raise VersionConflict if the file changed since
+    that version was read.
+    """
+    with file_lock(path):
+        if expected_version is not None and file_version(path) != expected_version:
+            raise VersionConflict(path)
+        directory, name = os.path.split(os.path.abspath(path))
+        tmp_path = os.path.join(directory, f".{name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with open(tmp_path, "wb" if isinstance(data, bytes) else "w") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        if hasattr(os, "O_DIRECTORY"):
+            dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+    return file_version(path)
+
+
+def read_text(path, default=""):
+    """
+    Return (text, version); a missing file reads as `default`. The version is
+    taken before reading, so a concurrent replace can only make it stale.
+    """
+    version = file_version(path)
+    try:
+        with open(path) as f:
+            text = f.read()
+    except FileNotFoundError:
+        return default, None
+    return text, version
+
+
+@contextmanager
+def edit_text(path, default=""):
+    """
+    Lock `path` for a read-modify-write. Yields a document whose `.text` is
+    the current contents; if it was changed on exit, it is written back
+    atomically.
+    """
+    with file_lock(path):
+        text, _ = read_text(path, default)
+        doc = SimpleNamespace(text=text)
+        yield doc
+        if doc.text != text or not os.path.exists(path):
+            atomic_write(path, doc.text)
+
+
+def load_json(path, default):
+    """
+    Load a JSON file. A missing file yields `default`; a corrupt one is moved
+    aside to "<path>.corrupt-<timestamp>" and reported, then `default` is
+    returned so the data is preserved for recovery instead of overwritten.
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+    except json.JSONDecodeError as e:
+        with file_lock(path):
+            backup = f"{path}.corrupt-{int(time.time())}"
+            if os.path.exists(path):
+                os.replace(path, backup)
+                print(f"[storage] {path} is not valid JSON ({e}); moved it to {backup}.")
+        return default
+
+
+def save_json(path, data, expected_version=None):
+    return atomic_write(path, json.dumps(data, indent=2), expected_version)
@@ -0,0 +1,64 @@
+"""
+timezones.py
+
+Time zone lookups and batch conversion.
+
+Zone objects are looked up once per name and reused, so converting many
+timestamps (or localizing every event of a sync) costs one lookup per zone
+rather than one per timestamp.
+"""
+from datetime import datetime
+from functools import lru_cache
+import pytz
+
+
+@lru_cache(maxsize=None)
+def get_zone(name):
+    """The pytz zone for `name`; raises pytz.UnknownTimeZoneError for unknown names."""
+    return pytz.timezone(name)
+
+
+def parse_times(times, from_tz):
+    """
+    Aware datetimes for ISO timestamps, read as `from_tz` unless they carry
+    their own UTC offset.
+    """
+    src = get_zone(from_tz)
+    parsed = []
+    for value in times:
+        dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        parsed.append(dt if dt.tzinfo else src.localize(dt))
+    return parsed
+
+
+def convert_times(times, from_tz, to_tz):
+    """Convert ISO timestamps from `from_tz` to `to_tz`, returning aware datetimes."""
+    dst = get_zone(to_tz)
+    return [dt.astimezone(dst) for dt in parse_times(times, from_tz)]
+
+
+def convert_timezone(time_str: str, from_tz: str, to_tz: str) -> str:
+    try:
+        return convert_times([time_str], from_tz, to_tz)[0].isoformat()
+    except Exception as e:
+        return f"Failed to convert timezone: {e}"
+
+
+def convert_timezones(times: list, from_tz: str, to_tz: list) -> str:
+    """Convert every timestamp in `times` into each zone in `to_tz` in one call."""
+    targets = [to_tz] if isinstance(to_tz, str) else list(to_tz)
+    if not times or not targets:
+        return "⚠️ Give at least one time and one target time zone."
+    try:
+        parsed = parse_times(times, from_tz)
+        columns = [[dt.astimezone(get_zone(target)) for dt in parsed] for target in targets]
+    except pytz.UnknownTimeZoneError as e:
+        return f"❌ Unknown time zone: {e}"
+    except ValueError as e:
+        return f"❌ Times must be ISO format, e.g. 2025-06-01T09:00: {e}"
+    out = f"🕒 {from_tz} → {', '.join(targets)}:"
+    for i, value in enumerate(times):
+        out += f"\n- {value}: " + " | ".join(
+            f"{column[i].strftime('%Y-%m-%d %H:%M')} {target}" for target, column in zip(targets, columns)
+        )
+    return out
@@ -49,7 +49,9 @@ tools = [
             "description": "Lists today's Google Calendar events.",
             "parameters": {
                 "type": "object",
-                "properties": {}
+                "properties": {
+                    "max_staleness": {"type": "integer", "description": "Maximum age in seconds of the local calendar mirror before it is refreshed from Google (0 forces a refresh)", "default": 60}
+                }
             }
         }
     },
@@ -64,7 +66,8 @@ tools = [
                     "n": {
                         "type": "integer",
                         "description": "Number of events to retrieve"
-                    }
+                    },
+                    "max_staleness": {"type": "integer", "description": "Maximum age in seconds of the local calendar mirror before it is refreshed from Google (0 forces a refresh)", "default": 60}
                 },
                 "required": []
             }
@@ -97,7 +100,8 @@ tools = [
                     "description": {
                         "type": "string",
                         "description": "Updated description for the event"
-                    }
+                    },
+                    "calendar_id": {"type": "string", "description": "Calendar the event belongs to (shown next to events from other calendars)", "default": "primary"}
                 },
                 "required": ["event_id"]
             }
@@ -114,7 +118,8 @@ tools = [
                     "event_id": {
                         "type": "string",
                         "description": "The ID of the event to delete"
-                    }
+                    },
+                    "calendar_id": {"type": "string", "description": "Calendar the event belongs to (shown next to events from other calendars)", "default": "primary"}
                 },
                 "required": ["event_id"]
             }
@@ -179,7 +184,8 @@ tools = [
             "parameters": {
                 "type": "object",
                 "properties": {
-                    "keyword": {"type": "string"}
+                    "keyword": {"type": "string"},
+                    "max_staleness": {"type": "integer", "description": "Maximum age in seconds of the local calendar mirror before it is refreshed from Google (0 forces a refresh)", "default": 60}
                 },
                 "required": ["keyword"]
             }
@@ -203,6 +209,46 @@ tools = [
             }
         }
     },
+    {
+        "type": "function",
+        "function": {
+            "name": "export_calendar",
+            "description": "Stream calendar events in a date range to a JSONL, iCalendar or JSON file, following every result page. Can resume an interrupted export.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "filepath": {"type": "string", "description": "Path of the export file", "default": "calendar_dump.jsonl"},
+                    "fmt": {"type": "string", "enum": ["jsonl", "ics", "json"], "description": "Output format", "default": "jsonl"},
+                    "start_date": {"type": "string", "description": "First date in YYYY-MM-DD format (default: now)"},
+                    "end_date": {"type": "string", "description": "Last date in YYYY-MM-DD format (default: 90 days after start)"},
+                    "resume": {"type": "boolean", "description": "Resume from the export's checkpoint file", "default": False}
+                },
+                "required": []
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "get_api_stats",
+            "description": "Show Google API request, retry and throttling counters since startup.",
+            "parameters": {
+                "type": "object",
+                "properties": {}
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "get_outbox_status",
+            "description": "Show calendar changes that are queued for Google Calendar and any that failed.",
+            "parameters": {
+                "type": "object",
+                "properties": {}
+            }
+        }
+    },
     {
         "type": "function",
         "function": {
@@ -218,6 +264,26 @@ tools = [
             }
         }
     },
+    {
+        "type": "function",
+        "function": {
+            "name": "search_emails",
+            "description": "Search email headers from a local index, e.g. emails from someone about a topic this week. Filters combine; dates are YYYY-MM-DD and inclusive.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "query": {"type": "string", "description": "Words to match in the subject"},
+                    "sender": {"type": "string", "description": "Part of the sender's name or address"},
+                    "since": {"type": "string", "description": "Earliest date (YYYY-MM-DD)"},
+                    "until": {"type": "string", "description": "Latest date (YYYY-MM-DD)"},
+                    "folder": {"type": "string", "description": "Mailbox folder name", "default": "INBOX"},
+                    "limit": {"type": "integer", "description": "Maximum emails to return", "default": 10},
+                    "max_staleness": {"type": "integer", "description": "Sync with the server first if the index is older than this many seconds (0 forces a sync)", "default": 300}
+                },
+                "required": []
+            }
+        }
+    },
     {
         "type": "function",
         "function": {
@@ -228,12 +294,48 @@ tools = [
                 "properties": {
                     "to": {"type": "string", "description": "Recipient email address"},
                     "subject": {"type": "string", "description": "Email subject"},
-                    "body": {"type": "string", "description": "Email body content"}
+                    "body": {"type": "string", "description": "Email body content"},
+                    "queue": {"type": "boolean", "description": "Hand the email to the background sender and return immediately"}
                 },
                 "required": ["to", "subject", "body"]
             }
         }
     },
+    {
+        "type": "function",
+        "function": {
+            "name": "send_emails",
+            "description": "Send several emails at once over one SMTP connection, e.g. meeting notes to each attendee.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "messages": {
+                        "type": "array",
+                        "description": "Emails to send",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "to": {"type": "string", "description": "Recipient email address"},
+                                "subject": {"type": "string", "description": "Email subject"},
+                                "body": {"type": "string", "description": "Email body content"}
+                            },
+                            "required": ["to", "subject", "body"]
+                        }
+                    },
+                    "queue": {"type": "boolean", "description": "Hand the emails to the background sender and return immediately"}
+                },
+                "required": ["messages"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "get_mail_queue_status",
+            "description": "Show emails still waiting in the background send queue, and any that failed.",
+            "parameters": {"type": "object", "properties": {}, "required": []}
+        }
+    },
     {
         "type": "function",
         "function": {
@@ -250,6 +352,42 @@ tools = [
             }
         }
     },
+    {
+        "type": "function",
+        "function": {
+            "name": "get_travel_times",
+            "description": "Get travel times from each of several origins to each of several destinations in one Google Maps lookup.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "origins": {"type": "array", "items": {"type": "string"}, "description": "Starting locations"},
+                    "destinations": {"type": "array", "items": {"type": "string"}, "description": "Destination locations"},
+                    "mode": {"type": "string", "description": "Travel mode (driving, walking, bicycling, transit)", "default": "driving"},
+                    "departure_time": {"type": "string", "description": "Optional departure time (YYYY-MM-DDTHH:MM) for traffic-aware estimates"},
+                    "timezone": {"type": "string", "description": "Timezone of departure_time", "default": "Asia/Kolkata"}
+                },
+                "required": ["origins", "destinations"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "get_day_itinerary",
+            "description": "Travel time for each leg between a day's calendar events that have a location, warning where the gap between events is too short.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "date_str": {"type": "string", "description": "Date in YYYY-MM-DD format"},
+                    "mode": {"type": "string", "description": "Travel mode (driving, walking, bicycling, transit)", "default": "driving"},
+                    "start_location": {"type": "string", "description": "Where the day starts, e.g. home"},
+                    "timezone": {"type": "string", "description": "Timezone name", "default": "Asia/Kolkata"},
+                    "max_staleness": {"type": "integer", "description": "Maximum age in seconds of the local calendar mirror before it is refreshed from Google (0 forces a refresh)", "default": 60}
+                },
+                "required": ["date_str"]
+            }
+        }
+    },
     {
         "type": "function",
         "function": {
@@ -273,12 +411,44 @@ tools = [
                 "type": "object",
                 "properties": {
                     "location": {"type": "string", "description": "Location name (city, region)"},
-                    "date": {"type": "string", "description": "Date in YYYY-MM-DD or ISO format"}
+                    "date": {"type": "string", "description": "Date in YYYY-MM-DD or ISO format"},
+                    "time_of_day": {"type": "string", "description": "Optional time (HH:MM) to get the nearest 3-hour forecast instead of the day's range"}
                 },
                 "required": ["location", "date"]
             }
         }
     },
+    {
+        "type": "function",
+        "function": {
+            "name": "get_weather_for_locations",
+            "description": "Get current weather, or the forecast for a date, for several locations at once.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "locations": {"type": "array", "items": {"type": "string"}, "description": "Location names (city, region)"},
+                    "date": {"type": "string", "description": "Optional date in YYYY-MM-DD format; omit for current weather"}
+                },
+                "required": ["locations"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "get_day_weather",
+            "description": "Get the forecast at each of a day's calendar events that have a location, at the event's start time.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "date_str": {"type": "string", "description": "Date in YYYY-MM-DD format"},
+                    "timezone": {"type": "string", "description": "Timezone name", "default": "Asia/Kolkata"},
+                    "max_staleness": {"type": "integer", "description": "Maximum age in seconds of the local calendar mirror before it is refreshed from Google (0 forces a refresh)", "default": 60}
+                },
+                "required": ["date_str"]
+            }
+        }
+    },
     {
         "type": "function",
         "function": {
@@ -295,6 +465,22 @@ tools = [
             }
         }
     },
+    {
+        "type": "function",
+        "function": {
+            "name": "convert_timezones",
+            "description": "Convert many timestamps into one or more time zones in a single call, e.g. a week of meeting times for every participant's zone.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "times": {"type": "array", "items": {"type": "string"}, "description": "Timestamps in ISO format (YYYY-MM-DDTHH:MM)"},
+                    "from_tz": {"type": "string", "description": "Source time zone"},
+                    "to_tz": {"type": "array", "items": {"type": "string"}, "description": "Target time zones"}
+                },
+                "required": ["times", "from_tz", "to_tz"]
+            }
+        }
+    },
     {
         "type": "function",
         "function": {
@@ -303,7 +489,8 @@ tools = [
             "parameters": {
                 "type": "object",
                 "properties": {
-                    "date_str": {"type": "string", "description": "Date in YYYY-MM-DD format"}
+                    "date_str": {"type": "string", "description": "Date in YYYY-MM-DD format"},
+                    "max_staleness": {"type": "integer", "description": "Maximum age in seconds of the local calendar mirror before it is refreshed from Google (0 forces a refresh)", "default": 60}
                 },
                 "required": ["date_str"]
             }
@@ -324,6 +511,25 @@ tools = [
             }
         }
     },
+    {
+        "type": "function",
+        "function": {
+            "name": "find_next_free_slots",
+            "description": "Find the first N free slots of a given length within working hours across the next K days, considering all busy time on the calendar.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "duration": {"type": "integer", "description": "Slot length in minutes"},
+                    "days": {"type": "integer", "description": "Number of days to search", "default": 7},
+                    "count": {"type": "integer", "description": "Number of slots to return", "default": 3},
+                    "start_date": {"type": "string", "description": "First date to search in YYYY-MM-DD format (default: now)"},
+                    "work_start": {"type": "string", "description": "Start of working hours, HH:MM", "default": "09:00"},
+                    "work_end": {"type": "string", "description": "End of working hours, HH:MM", "default": "18:00"}
+                },
+                "required": ["duration"]
+            }
+        }
+    },
     {
         "type": "function",
         "function": {
@@ -354,13 +560,14 @@ tools = [
         "type": "function",
         "function": {
             "name": "mark_todo_item_done",
-            "description": "Mark a to-do item as done.",
+            "description": "Mark a to-do item as done, chosen by its id (shown as ^id in the list) or by its text. Exactly one item is changed; if the text matches several, their ids are returned.",
             "parameters": {
                 "type": "object",
                 "properties": {
-                    "task_text": {"type": "string", "description": "Text of the task to mark done"}
-                },
-                "required": ["task_text"]
+                    "task_text": {"type": "string", "description": "Text of the task to mark done"},
+                    "match": {"type": "string", "enum": ["exact", "prefix", "fuzzy"], "description": "How task_text is compared with item texts", "default": "exact"},
+                    "item_id": {"type": "string", "description": "ID of the item (takes precedence over task_text)"}
+                }
             }
         }
     },
@@ -368,13 +575,14 @@ tools = [
         "type": "function",
         "function": {
             "name": "delete_todo_item",
-            "description": "Delete a to-do item from the list.",
+            "description": "Delete a to-do item from the list, chosen by its id (shown as ^id in the list) or by its text. Exactly one item is changed; if the text matches several, their ids are returned.",
             "parameters": {
                 "type": "object",
                 "properties": {
-                    "task_text": {"type": "string", "description": "Text of the task to delete"}
-                },
-                "required": ["task_text"]
+                    "task_text": {"type": "string", "description": "Text of the task to delete"},
+                    "match": {"type": "string", "enum": ["exact", "prefix", "fuzzy"], "description": "How task_text is compared with item texts", "default": "exact"},
+                    "item_id": {"type": "string", "description": "ID of the item (takes precedence over task_text)"}
+                }
             }
         }
     },
@@ -400,12 +608,30 @@ tools = [
         "type": "function",
         "function": {
             "name": "schedule_todo_tasks",
-            "description": "Auto-schedule all undone to-do list items into free slots on a given date.",
+            "description": "Auto-schedule all undone to-do list items into free slots on a given date in one pass, most important and most constrained first. Items may carry tags such as '~90m' (duration), '!1' (priority, 1 highest to 5) and '@14:00-17:00' (window). Use dry_run to preview the plan.",
             "parameters": {
                 "type": "object",
                 "properties": {
                     "date_str": {"type": "string", "description": "Date in YYYY-MM-DD format"},
-                    "default_duration": {"type": "integer", "description": "Default duration per task in minutes", "default": 60}
+                    "default_duration": {"type": "integer", "description": "Default duration per task in minutes", "default": 60},
+                    "tasks": {
+                        "type": "array",
+                        "description": "Per-item overrides, matched by to-do id or text",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "id": {"type": "string", "description": "To-do item id"},
+                                "text": {"type": "string", "description": "To-do item text, if no id"},
+                                "duration": {"type": "integer", "description": "Minutes needed"},
+                                "priority": {"type": "integer", "description": "1 (most important) to 5"},
+                                "earliest_time": {"type": "string", "description": "HH:MM"},
+                                "latest_time": {"type": "string", "description": "HH:MM"}
+                            }
+                        }
+                    },
+                    "dry_run": {"type": "boolean", "description": "Only show the plan; create no events", "default": False},
+                    "earliest_time": {"type": "string", "description": "Earliest start for all items (HH:MM, default 00:00)"},
+                    "latest_time": {"type": "string", "description": "Latest end for all items (HH:MM, default 23:59)"}
                 },
                 "required": ["date_str"]
             }
@@ -543,11 +769,171 @@ tools = [
                     "time_str": {"type": "string", "description": "Time in HH:MM format for each call"},
                     "duration": {"type": "integer", "description": "Duration of each call in minutes"},
                     "notes": {"type": "string", "description": "Optional notes or agenda for calls"},
-                    "timezone": {"type": "string", "description": "Timezone for scheduling", "default": "Asia/Kolkata"}
+                    "timezone": {"type": "string", "description": "Timezone for scheduling", "default": "Asia/Kolkata"},
+                    "avoid_conflicts": {"type": "boolean", "description": "Move each call to the first free time after time_str on its day", "default": False}
                 },
                 "required": ["start_date_str", "end_date_str", "time_str", "duration"]
             }
         }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "find_call_slots",
+            "description": "Suggest free slots within working hours for a call with a contact.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "contact_id": {"type": "string", "description": "ID of the contact to call"},
+                    "duration": {"type": "integer", "description": "Duration of the call in minutes"},
+                    "days": {"type": "integer", "description": "Number of days ahead to search", "default": 7},
+                    "count": {"type": "integer", "description": "Number of slots to suggest", "default": 3}
+                },
+                "required": ["contact_id", "duration"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "summarize_range",
+            "description": "Summarize local schedules over a date range: tasks completed, planned hours and completion streaks, with one line per scheduled day. Days without a schedule are skipped, not created.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "start": {"type": "string", "description": "First date (YYYY-MM-DD)"},
+                    "end": {"type": "string", "description": "Last date (YYYY-MM-DD), inclusive"}
+                },
+                "required": ["start", "end"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "completion_stats",
+            "description": "Task completion and planned hours from local schedules over a date range, grouped by day, week or month. Use for weekly or monthly reviews.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "start": {"type": "string", "description": "First date (YYYY-MM-DD)"},
+                    "end": {"type": "string", "description": "Last date (YYYY-MM-DD), inclusive"},
+                    "granularity": {"type": "string", "enum": ["day", "week", "month"], "description": "Grouping period", "default": "week"}
+                },
+                "required": ["start", "end"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "add_recurring_task",
+            "description": "Add a task that repeats on the local schedule, defined once by an RRULE. Occurrences appear in every matching day's schedule and can be marked done, edited or deleted for one day with the usual task tools.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "task": {"type": "string", "description": "Task text, e.g. 'Standup'"},
+                    "time": {"type": "string", "description": "Time block, 'HH:MM - HH:MM' or 'HH:MM'"},
+                    "rrule": {"type": "string", "description": "Recurrence rule using FREQ (DAILY, WEEKLY, MONTHLY, YEARLY), INTERVAL, BYDAY, BYMONTHDAY, BYMONTH, COUNT and UNTIL, e.g. 'FREQ=WEEKLY;BYDAY=MO,TU,WE,TH,FR'"},
+                    "start_date": {"type": "string", "description": "First date the rule applies (YYYY-MM-DD), default today"}
+                },
+                "required": ["task", "time", "rrule"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "list_recurring_tasks",
+            "description": "List recurring task rules with their ids.",
+            "parameters": {"type": "object", "properties": {}}
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "update_recurring_task",
+            "description": "Change a recurring task rule for all of its days. Per-day changes already made are kept.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "rule_id": {"type": "string", "description": "Id from list_recurring_tasks"},
+                    "task": {"type": "string", "description": "New task text"},
+                    "time": {"type": "string", "description": "New time block, 'HH:MM - HH:MM' or 'HH:MM'"},
+                    "rrule": {"type": "string", "description": "New recurrence rule"},
+                    "start_date": {"type": "string", "description": "New first date (YYYY-MM-DD)"}
+                },
+                "required": ["rule_id"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "delete_recurring_task",
+            "description": "Delete a recurring task rule so it no longer appears on any day.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "rule_id": {"type": "string", "description": "Id from list_recurring_tasks"}
+                },
+                "required": ["rule_id"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "list_changes",
+            "description": "List recent changes to schedules, the to-do list, contacts, calls and recurring tasks (journal storage only).",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "limit": {"type": "integer", "description": "Number of changes to show", "default": 10}
+                }
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "undo_last_change",
+            "description": "Undo the most recent change(s) to local planner data, newest first (journal storage only).",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "steps": {"type": "integer", "description": "Number of changes to undo", "default": 1}
+                }
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "view_schedule_at",
+            "description": "Show a day's schedule as it was at an earlier moment (journal storage only).",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "date": {"type": "string", "description": "Schedule date (YYYY-MM-DD)"},
+                    "at": {"type": "string", "description": "Moment to view, 'YYYY-MM-DD HH:MM'"}
+                },
+                "required": ["date", "at"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "view_todo_list_at",
+            "description": "Show the to-do list as it was at an earlier moment (journal storage only).",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "at": {"type": "string", "description": "Moment to view, 'YYYY-MM-DD HH:MM'"}
+                },
+                "required": ["at"]
+            }
+        }
     }
 ]
-
@@ -0,0 +1,240 @@
+"""
+travel.py
+
+Travel times from the Google Maps Distance Matrix API.
+
+Lookups go through one shared googlemaps client and a TTL cache keyed by
+(origin, destination, mode, departure bucket), so a repeated commute costs
+nothing. Uncached pairs that depart in the same bucket go out as one
+origins x destinations matrix, so a day's itinerary is one request when
+its legs share a departure (or have none in the future) and one request
+per departure bucket when traffic at each leg's own time is wanted, since
+a Distance Matrix request takes a single departure time.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import googlemaps
+import pytz
+import calendar_store
+from calendar_store import DEFAULT_MAX_STALENESS
+
+TRAVEL_CACHE_TTL = int(os.getenv("KAALA_TRAVEL_CACHE_TTL", 3600))
+TRAVEL_CACHE_SIZE = 1024
+# Departure times within the same bucket share cached results.
+DEPARTURE_BUCKET = 15 * 60
+# Google's Distance Matrix limits per request.
+MAX_ORIGINS = 25
+MAX_DESTINATIONS = 25
+MAX_ELEMENTS = 100
+LEG_WORKERS = 4
+
+_clients = {}
+_cache = OrderedDict()
+_lock = threading.Lock()
+_leg_pool = ThreadPoolExecutor(max_workers=LEG_WORKERS, thread_name_prefix="travel")
+
+
+def get_client():
+    """The shared client for GOOGLE_MAPS_API_KEY, or None if it is unset."""
+    api_key = os.getenv("GOOGLE_MAPS_API_KEY")
+    if not api_key:
+        return None
+    with _lock:
+        if api_key not in _clients:
+            _clients[api_key] = googlemaps.Client(key=api_key)
+        return _clients[api_key]
+
+
+def _bucket(departure_time):
+    return int(departure_time.timestamp() // DEPARTURE_BUCKET) if departure_time else None
+
+
+def _cached(key):
+    with _lock:
+        entry = _cache.get(key)
+        if entry is None:
+            return None
+        expires, element = entry
+        if expires < time.monotonic():
+            del _cache[key]
+            return None
+        _cache.move_to_end(key)
+        return element
+
+
+def _store(key, element):
+    with _lock:
+        _cache[key] = (time.monotonic() + TRAVEL_CACHE_TTL, element)
+        _cache.move_to_end(key)
+        while len(_cache) > TRAVEL_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def _chunks(origins, destinations):
+    """(origins, destinations) blocks covering the full matrix within the request limits."""
+    for d in range(0, len(destinations), MAX_DESTINATIONS):
+        dest_block = destinations[d:d + MAX_DESTINATIONS]
+        per_request = min(MAX_ORIGINS, max(1, MAX_ELEMENTS // len(dest_block)))
+        for o in range(0, len(origins), per_request):
+            yield origins[o:o + per_request], dest_block
+
+
+def _lookup(wanted, mode):
+    """
+    Distance Matrix elements for (origin, destination, departure_time)
+    lookups, keyed by (origin, destination, departure bucket). Cached ones
+    are reused; the rest are grouped by departure bucket and each group is
+    requested as one origins x destinations matrix, with the requests sent
+    concurrently.
+    """
+    result, groups = {}, {}
+    for origin, destination, departure in wanted:
+        bucket = _bucket(departure)
+        element = _cached((origin, destination, mode, bucket))
+        if element is None:
+            groups.setdefault(bucket, (departure, {}))[1][(origin, destination)] = None
+        else:
+            result[(origin, destination, bucket)] = element
+    blocks = []
+    for bucket, (departure, missing) in groups.items():
+        origins = list(dict.fromkeys(origin for origin, _ in missing))
+        destinations = list(dict.fromkeys(destination for _, destination in missing))
+        blocks += [(bucket, departure, o, d) for o, d in _chunks(origins, destinations)]
+    if not blocks:
+        return result
+    client = get_client()
+    if client is None:
+        raise RuntimeError("Google Maps API key not set.")
+
+    def fetch(block):
+        _, departure, origin_block, dest_block = block
+        extra = {"departure_time": departure} if departure else {}
+        return block, client.distance_matrix(origins=origin_block, destinations=dest_block, mode=mode, **extra)
+
+    responses = map(fetch, blocks) if len(blocks) == 1 else _leg_pool.map(fetch, blocks)
+    for (bucket, _, origin_block, dest_block), matrix in responses:
+        for origin, row in zip(origin_block, matrix["rows"]):
+            for destination, element in zip(dest_block, row["elements"]):
+                if element.get("status") == "OK":
+                    _store((origin, destination, mode, bucket), element)
+                result[(origin, destination, bucket)] = element
+    return result
+
+
+def travel_matrix(pairs, mode="driving", departure_time=None):
+    """
+    Distance Matrix elements for (origin, destination) pairs, as a dict keyed
+    by pair. Only pairs missing from the cache are requested, in one
+    cross-product matrix. departure_time (an aware datetime) asks for
+    traffic-aware durations.
+    """
+    bucket = _bucket(departure_time)
+    found = _lookup([(origin, destination, departure_time) for origin, destination in pairs], mode)
+    return {pair: found[(*pair, bucket)] for pair in dict.fromkeys(pairs)}
+
+
+def _duration(element):
+    return element.get("duration_in_traffic") or element["duration"]
+
+
+def _duration_text(element):
+    return _duration(element)["text"]
+
+
+def _departure(departure_time, timezone):
+    if not departure_time:
+        return None
+    return pytz.timezone(timezone).localize(datetime.fromisoformat(departure_time))
+
+
+def get_travel_time(origin: str, destination: str, mode: str = "driving") -> str:
+    if get_client() is None:
+        return "Google Maps API key not set."
+    try:
+        elem = travel_matrix([(origin, destination)], mode)[(origin, destination)]
+        if elem.get("status") != "OK":
+            return f"Could not compute travel time: {elem.get('status')}"
+        return f"Travel time from {origin} to {destination} by {mode}: {_duration_text(elem)}"
+    except Exception as e:
+        return f"Failed to get travel time: {e}"
+
+
+def get_travel_times(origins: list, destinations: list, mode: str = "driving",
+                     departure_time: str = None, timezone: str = "Asia/Kolkata") -> str:
+    """Travel times from every origin to every destination in one lookup."""
+    if get_client() is None:
+        return "Google Maps API key not set."
+    try:
+        departure = _departure(departure_time, timezone)
+    except ValueError:
+        return "❌ departure_time must be an ISO date-time, e.g. 2025-06-01T09:00."
+    pairs = [(o, d) for o in origins for d in destinations if o != d]
+    if not pairs:
+        return "⚠️ No origin/destination pairs to look up."
+    try:
+        elements = travel_matrix(pairs, mode, departure)
+    except Exception as e:
+        return f"Failed to get travel times: {e}"
+    out = f"🚗 Travel times by {mode}:"
+    for (origin, destination), elem in elements.items():
+        duration = _duration_text(elem) if elem.get("status") == "OK" else elem.get("status")
+        out += f"\n- {origin} → {destination}: {duration}"
+    return out
+
+
+def day_locations(date_str, timezone="Asia/Kolkata", max_staleness=DEFAULT_MAX_STALENESS):
+    """(event, location) for the timed events on a date that have a location, in start order."""
+    tz = pytz.timezone(timezone)
+    start = tz.localize(datetime.strptime(date_str, "%Y-%m-%d"))
+    events = calendar_store.query_calendars(start, start + timedelta(days=1), max_staleness=max_staleness)
+    return [(event, event["location"].strip()) for event in events
+            if event.get("location", "").strip() and "dateTime" in event.get("start", {})]
+
+
+def get_day_itinerary(date_str: str, mode: str = "driving", start_location: str = None,
+                      timezone: str = "Asia/Kolkata", max_staleness: int = DEFAULT_MAX_STALENESS) -> str:
+    """
+    Travel time for each leg between the day's events that have a location,
+    optionally starting from `start_location`. Each leg departs when the
+    previous event ends, so durations include traffic for legs still ahead;
+    legs departing in the same window share one request.
+    """
+    if get_client() is None:
+        return "Google Maps API key not set."
+    try:
+        located = day_locations(date_str, timezone, max_staleness)
+    except ValueError:
+        return "❌ Date must be YYYY-MM-DD."
+    except Exception as e:
+        return f"Failed to read events: {e}"
+    tz = pytz.timezone(timezone)
+    stops = ([(None, start_location)] if start_location else []) + located
+    legs = [(a, b) for a, b in zip(stops, stops[1:]) if a[1] != b[1]]
+    if not legs:
+        return f"No travel between located events on {date_str}."
+    now = datetime.now(tz)
+    departures = []
+    for (prev, _), _ in legs:
+        departure = calendar_store.parse_event_time(prev["end"], tz) if prev is not None else None
+        # Google only predicts traffic for departures that have not happened yet.
+        departures.append(departure if departure and departure > now else None)
+    try:
+        elements = _lookup([(a[1], b[1], departure) for (a, b), departure in zip(legs, departures)], mode)
+    except Exception as e:
+        return f"Failed to get travel times: {e}"
+    out = f"🗺️ Itinerary for {date_str} by {mode}:"
+    for ((prev, origin), (event, destination)), departure in zip(legs, departures):
+        elem = elements[(origin, destination, _bucket(departure))]
+        if elem.get("status") != "OK":
+            out += f"\n- {origin} → {destination}: {elem.get('status')}"
+            continue
+        out += f"\n- {origin} → {destination}: {_duration_text(elem)}"
+        if prev is not None:
+            gap = calendar_store.parse_event_time(event["start"], tz) - calendar_store.parse_event_time(prev["end"], tz)
+            if gap.total_seconds() < _duration(elem)["value"]:
+                out += f" ⚠️ only {int(gap.total_seconds() // 60)} min after '{prev.get('summary', '')}' ends"
+    return out
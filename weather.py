@@ -0,0 +1,198 @@
+"""
+weather.py
+
+OpenWeatherMap lookups over one pooled HTTP session.
+
+Current conditions are cached for CURRENT_TTL seconds. The 5-day/3-hour
+forecast is cached whole for FORECAST_TTL seconds (OpenWeatherMap refreshes
+it every three hours), and every date or time-of-day question for that
+location is answered from the cached payload. Lookups for several
+locations fetch the uncached ones concurrently.
+"""
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
+import requests
+import pytz
+import calendar_store
+import travel
+from calendar_store import DEFAULT_MAX_STALENESS
+
+API_URL = "https://api.openweathermap.org/data/2.5"
+REQUEST_TIMEOUT = 10
+CURRENT_TTL = int(os.getenv("KAALA_WEATHER_CURRENT_TTL", 600))
+FORECAST_TTL = int(os.getenv("KAALA_WEATHER_FORECAST_TTL", 3 * 3600))
+MAX_WORKERS = 4
+
+_session = requests.Session()
+_cache = {}
+_lock = threading.Lock()
+_pool = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="weather")
+
+
+def _key(location):
+    return " ".join(location.lower().split())
+
+
+def _fetch(kind, location, ttl):
+    """The JSON payload of an endpoint ("weather" or "forecast") for a location, cached for `ttl`."""
+    key = (kind, _key(location))
+    with _lock:
+        entry = _cache.get(key)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+    resp = _session.get(
+        f"{API_URL}/{kind}",
+        params={"q": location, "appid": os.getenv("OWM_API_KEY"), "units": "metric"},
+        timeout=REQUEST_TIMEOUT,
+    )
+    data = resp.json()
+    if str(data.get("cod")) != "200":
+        raise ValueError(data.get("message") or f"HTTP {resp.status_code}")
+    with _lock:
+        _cache[key] = (time.monotonic() + ttl, data)
+    return data
+
+
+def current(location):
+    return _fetch("weather", location, CURRENT_TTL)
+
+
+def forecast(location):
+    return _fetch("forecast", location, FORECAST_TTL)
+
+
+def prefetch(locations, kind="forecast"):
+    """
+    Warm the cache for several locations at once. Returns {location: error}
+    for the ones that could not be fetched.
+    """
+    fetch = forecast if kind == "forecast" else current
+    futures = {location: _pool.submit(fetch, location) for location in dict.fromkeys(locations)}
+    errors = {}
+    for location, future in futures.items():
+        try:
+            future.result()
+        except Exception as e:
+            errors[location] = e
+    return errors
+
+
+def _slots(data):
+    """(local datetime, item) for each forecast slot, in the location's own time."""
+    offset = timedelta(seconds=data.get("city", {}).get("timezone", 0))
+    return [
+        (datetime.fromtimestamp(item["dt"], dt_timezone.utc).replace(tzinfo=None) + offset, item)
+        for item in data.get("list", [])
+    ]
+
+
+def slot_at(data, when):
+    """The forecast slot nearest to `when` (naive, location-local), or None if outside the forecast."""
+    slots = _slots(data)
+    if not slots or not slots[0][0] - timedelta(hours=3) <= when <= slots[-1][0] + timedelta(hours=3):
+        return None
+    return min(slots, key=lambda slot: abs(slot[0] - when))
+
+
+def day_summary(data, date):
+    """(min °C, max °C, most common description) for a date, or None if outside the forecast."""
+    items = [item for dt, item in _slots(data) if dt.date() == date]
+    if not items:
+        return None
+    temps = [item["main"]["temp"] for item in items]
+    desc = Counter(item["weather"][0]["description"] for item in items).most_common(1)[0][0]
+    return min(temps), max(temps), desc
+
+
+def get_current_weather(location: str) -> str:
+    if not os.getenv("OWM_API_KEY"):
+        return "OpenWeatherMap API key not set."
+    try:
+        data = current(location)
+        temp = data["main"]["temp"]
+        desc = data["weather"][0]["description"]
+        return f"Current weather in {location}: {temp}°C, {desc}."
+    except Exception as e:
+        return f"Failed to get weather: {e}"
+
+
+def get_weather_forecast(location: str, date: str, time_of_day: str = None) -> str:
+    """Forecast for a date: the day's range, or the slot nearest `time_of_day` (HH:MM) if given."""
+    if not os.getenv("OWM_API_KEY"):
+        return "OpenWeatherMap API key not set."
+    try:
+        target = datetime.fromisoformat(f"{date[:10]}T{time_of_day}" if time_of_day else date)
+    except ValueError:
+        return "❌ Date must be YYYY-MM-DD and time HH:MM."
+    try:
+        data = forecast(location)
+    except Exception as e:
+        return f"Failed to get weather forecast: {e}"
+    if time_of_day:
+        slot = slot_at(data, target)
+        if not slot:
+            return f"No forecast found for {date} {time_of_day} in {location}."
+        dt, item = slot
+        return (f"Forecast for {location} on {date} at {dt.strftime('%H:%M')}: "
+                f"{item['main']['temp']}°C, {item['weather'][0]['description']}.")
+    summary = day_summary(data, target.date())
+    if not summary:
+        return f"No forecast found for {date} in {location}."
+    low, high, desc = summary
+    return f"Forecast for {location} on {date}: {low:.0f}–{high:.0f}°C, mostly {desc}."
+
+
+def get_weather_for_locations(locations: list, date: str = None) -> str:
+    """Current weather, or the forecast for `date`, for several locations in one lookup."""
+    if not os.getenv("OWM_API_KEY"):
+        return "OpenWeatherMap API key not set."
+    if not locations:
+        return "⚠️ No locations given."
+    errors = prefetch(locations, "forecast" if date else "weather")
+    lines = []
+    for location in dict.fromkeys(locations):
+        if location in errors:
+            lines.append(f"Failed to get weather for {location}: {errors[location]}")
+        elif date:
+            lines.append(get_weather_forecast(location, date))
+        else:
+            lines.append(get_current_weather(location))
+    return "\n".join(lines)
+
+
+def get_day_weather(date_str: str, timezone: str = "Asia/Kolkata",
+                    max_staleness: int = DEFAULT_MAX_STALENESS) -> str:
+    """Forecast at each of a day's events that have a location, at the event's start time."""
+    if not os.getenv("OWM_API_KEY"):
+        return "OpenWeatherMap API key not set."
+    try:
+        located = travel.day_locations(date_str, timezone, max_staleness)
+    except ValueError:
+        return "❌ Date must be YYYY-MM-DD."
+    except Exception as e:
+        return f"Failed to read events: {e}"
+    if not located:
+        return f"No events with a location on {date_str}."
+    errors = prefetch(location for _, location in located)
+    tz = pytz.timezone(timezone)
+    out = f"🌤️ Weather for events on {date_str}:"
+    for event, location in located:
+        label = event.get("summary", "")
+        start = calendar_store.parse_event_time(event["start"], tz)
+        when = start.astimezone(tz).strftime("%H:%M")
+        if location in errors:
+            out += f"\n- {when} {label} ({location}): {errors[location]}"
+            continue
+        data = forecast(location)
+        offset = timedelta(seconds=data.get("city", {}).get("timezone", 0))
+        slot = slot_at(data, start.astimezone(dt_timezone.utc).replace(tzinfo=None) + offset)
+        if not slot:
+            out += f"\n- {when} {label} ({location}): no forecast yet"
+            continue
+        item = slot[1]
+        out += f"\n- {when} {label} ({location}): {item['main']['temp']}°C, {item['weather'][0]['description']}"
+    return out